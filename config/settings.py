@@ -1,3 +1,4 @@
+from functools import cached_property
 from pathlib import Path
 
 from mees_shared.settings import BaseAppSettings
@@ -65,9 +66,15 @@ class Settings(BaseAppSettings):
     model_config = {
         "env_file": str(Path(__file__).resolve().parent / ".env"),
         "env_file_encoding": "utf-8",
+        "frozen": True,
     }
 
-    @property
+    # Settings are frozen, so DSNs are built once and cached.
+    @cached_property
+    def dsn(self) -> str:
+        return super().dsn
+
+    @cached_property
     def stuff_dsn(self) -> str:
         return self.cross_dsn(
             self.stuff_db_name, self.stuff_db_user, self.stuff_db_password,
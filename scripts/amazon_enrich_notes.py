@@ -20,9 +20,12 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 import psycopg2
+from psycopg2.extras import execute_values
 
 from config.settings import settings
 
+CURRENCY_SYMBOLS = {"GBP": "£", "USD": "$", "EUR": "€"}
+
 
 def build_notes(conn) -> dict:
     """Build note text for each matched active transaction.
@@ -31,9 +34,9 @@ def build_notes(conn) -> dict:
 
     Reads matches from finance DB and order items from stuff DB (cross-DB).
     """
+    # Step 1: Get matches from finance DB. They are all needed again once the
+    # order items are in, so they are fetched in one go.
     cur = conn.cursor()
-
-    # Step 1: Get matches from finance DB
     cur.execute("""
         SELECT am.raw_transaction_id, am.order_id
         FROM amazon_order_match am
@@ -50,37 +53,38 @@ def build_notes(conn) -> dict:
     # Step 2: Fetch order items from stuff DB (cross-DB)
     stuff_conn = psycopg2.connect(settings.stuff_dsn)
     try:
-        stuff_cur = stuff_conn.cursor()
-        stuff_cur.execute("""
-            SELECT order_id, description, unit_price, quantity, currency
-            FROM amazon_order_item
-            WHERE order_id = ANY(%s) AND unit_price IS NOT NULL
-            ORDER BY order_id, description
-        """, (order_ids,))
         items_by_order = defaultdict(list)
-        for order_id, desc, price, qty, currency in stuff_cur.fetchall():
-            items_by_order[order_id].append({
-                "description": desc,
-                "price": price,
-                "quantity": qty,
-                "currency": currency or "GBP",
-            })
+        with stuff_conn.cursor(name="amazon_note_items") as stuff_cur:
+            stuff_cur.itersize = 5000
+            stuff_cur.execute("""
+                SELECT order_id, description, unit_price, quantity, currency
+                FROM amazon_order_item
+                WHERE order_id = ANY(%s) AND unit_price IS NOT NULL
+                ORDER BY order_id, description
+            """, (order_ids,))
+            for order_id, desc, price, qty, currency in stuff_cur:
+                items_by_order[order_id].append({
+                    "description": desc,
+                    "price": price,
+                    "quantity": qty,
+                    "currency": currency or "GBP",
+                })
     finally:
         stuff_conn.close()
 
-    # Step 3: Combine matches with items
-    txn_orders = defaultdict(lambda: defaultdict(list))
+    # Step 3: Combine matches with items. Matches arrive ordered by
+    # (transaction, order_id), so each transaction's items stay grouped by order.
+    txn_items = defaultdict(list)
+    txn_order_ids = defaultdict(list)
     for txn_id, order_id in matches:
-        for item in items_by_order.get(order_id, []):
-            txn_orders[str(txn_id)][order_id].append(item)
+        items = items_by_order.get(order_id)
+        if items:
+            txn_items[str(txn_id)].extend(items)
+            txn_order_ids[str(txn_id)].append(order_id)
 
     results = {}
-    for txn_id, orders in txn_orders.items():
-        order_ids = sorted(orders.keys())
-        all_items = []
-        for oid in order_ids:
-            all_items.extend(orders[oid])
-
+    for txn_id, all_items in txn_items.items():
+        order_ids = txn_order_ids[txn_id]
         note = _format_note(all_items, order_ids)
         results[txn_id] = {"note": note, "order_ids": order_ids}
 
@@ -89,11 +93,9 @@ def build_notes(conn) -> dict:
 
 def _format_note(items: list, order_ids: list) -> str:
     """Format items into a readable note string."""
-    currency_symbols = {"GBP": "£", "USD": "$", "EUR": "€"}
-
     lines = []
     for item in items:
-        sym = currency_symbols.get(item["currency"], item["currency"] + " ")
+        sym = CURRENCY_SYMBOLS.get(item["currency"], item["currency"] + " ")
         price_str = f"{sym}{item['price']:.2f}"
         if item["quantity"] > 1:
             lines.append(f"{item['description']} x{item['quantity']} ({price_str} each)")
@@ -120,51 +122,48 @@ def write_notes(notes: dict, conn, dry_run: bool = False) -> dict:
     - Existing amazon_match note: replace
     - Existing note from other source: append Amazon info, keep original source
     """
+    if dry_run:
+        return {"written": len(notes), "appended": 0}
+
     cur = conn.cursor()
-    written = 0
-    appended = 0
-
-    for txn_id, data in notes.items():
-        if dry_run:
-            written += 1
-            continue
-
-        # Check if a note already exists
-        cur.execute(
-            "SELECT note, source FROM transaction_note WHERE raw_transaction_id = %s",
-            (txn_id,),
+    rows = [(txn_id, data["note"]) for txn_id, data in notes.items()]
+
+    # Data-modifying CTEs share one snapshot, so `written` still sees the
+    # pre-update notes and the two branches touch disjoint rows.
+    results = execute_values(cur, """
+        WITH incoming (raw_transaction_id, new_note) AS (VALUES %s),
+        appended AS (
+            UPDATE transaction_note tn
+            SET note = COALESCE(tn.note, '') || E'\\n\\n' || i.new_note,
+                updated_at = now()
+            FROM incoming i
+            WHERE tn.raw_transaction_id = i.raw_transaction_id
+              AND tn.source IS DISTINCT FROM 'amazon_match'
+              AND position(i.new_note IN COALESCE(tn.note, '')) = 0
+            RETURNING tn.raw_transaction_id
+        ),
+        written AS (
+            INSERT INTO transaction_note (raw_transaction_id, note, source)
+            SELECT i.raw_transaction_id, i.new_note, 'amazon_match'
+            FROM incoming i
+            WHERE NOT EXISTS (
+                SELECT 1 FROM transaction_note tn
+                WHERE tn.raw_transaction_id = i.raw_transaction_id
+                  AND tn.source IS DISTINCT FROM 'amazon_match'
+            )
+            ON CONFLICT (raw_transaction_id)
+            DO UPDATE SET note = EXCLUDED.note,
+                          source = 'amazon_match',
+                          updated_at = now()
+            RETURNING raw_transaction_id
         )
-        row = cur.fetchone()
-
-        if row and row[1] not in ("amazon_match",):
-            # Append Amazon info to existing note, keep original source
-            existing_note = row[0] or ""
-            amazon_suffix = f"\n\n{data['note']}"
-            # Avoid double-appending if already present
-            if data["note"] not in existing_note:
-                combined = existing_note + amazon_suffix
-                cur.execute("""
-                    UPDATE transaction_note
-                    SET note = %s, updated_at = now()
-                    WHERE raw_transaction_id = %s
-                """, (combined, txn_id))
-                appended += 1
-        else:
-            # Insert new or replace existing amazon_match note
-            cur.execute("""
-                INSERT INTO transaction_note (raw_transaction_id, note, source)
-                VALUES (%s, %s, 'amazon_match')
-                ON CONFLICT (raw_transaction_id)
-                DO UPDATE SET note = EXCLUDED.note,
-                              source = 'amazon_match',
-                              updated_at = now()
-            """, (txn_id, data["note"]))
-            written += 1
-
-    if not dry_run:
-        conn.commit()
+        SELECT (SELECT count(*) FROM written), (SELECT count(*) FROM appended)
+    """, rows, template="(%s::uuid, %s)", page_size=1000, fetch=True)
 
-    return {"written": written, "appended": appended}
+    return {
+        "written": sum(r[0] for r in results),
+        "appended": sum(r[1] for r in results),
+    }
 
 
 def write_tags(txn_ids: list, conn, dry_run: bool = False) -> int:
@@ -173,19 +172,14 @@ def write_tags(txn_ids: list, conn, dry_run: bool = False) -> int:
         return len(txn_ids)
 
     cur = conn.cursor()
-    tagged = 0
-    for txn_id in txn_ids:
-        cur.execute("""
-            INSERT INTO transaction_tag (raw_transaction_id, tag, source)
-            VALUES (%s, 'amazon-matched', 'amazon_match')
-            ON CONFLICT (raw_transaction_id, tag) DO NOTHING
-            RETURNING raw_transaction_id
-        """, (txn_id,))
-        if cur.fetchone():
-            tagged += 1
-
-    conn.commit()
-    return tagged
+    result = execute_values(cur, """
+        INSERT INTO transaction_tag (raw_transaction_id, tag, source)
+        VALUES %s
+        ON CONFLICT (raw_transaction_id, tag) DO NOTHING
+        RETURNING raw_transaction_id
+    """, [(txn_id, "amazon-matched", "amazon_match") for txn_id in txn_ids],
+        page_size=1000, fetch=True)
+    return len(result)
 
 
 def main():
@@ -198,6 +192,9 @@ def main():
     conn = psycopg2.connect(settings.dsn)
 
     try:
+        # One transaction for the whole run; a crash just means re-running
+        conn.cursor().execute("SET LOCAL synchronous_commit = off")
+
         # Build notes
         notes = build_notes(conn)
         print(f"  Transactions with Amazon matches: {len(notes)}")
@@ -227,6 +224,8 @@ def main():
         tagged = write_tags(txn_ids, conn)
         print(f"  Tags added: {tagged}")
 
+        conn.commit()
+
         print("\n=== Done ===")
     finally:
         conn.close()
@@ -12,11 +12,11 @@ Usage:
 
 import argparse
 import csv
+import io
 import json
 import re
 import sys
-from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import date
 from decimal import Decimal, InvalidOperation
 from pathlib import Path
 from typing import Dict, List, Optional, Set, Tuple
@@ -27,12 +27,19 @@ import psycopg2
 
 from config.settings import settings
 
+PRICE_STRIP_RE = re.compile(r"[£$€,\s]")
+
+ITEM_COLUMNS = (
+    "order_id, order_date, asin, description, quantity, unit_price, currency, "
+    "category, order_url, item_url, is_subscription, raw_data"
+)
+
 
 def parse_price(price_str: str) -> Optional[Decimal]:
     """Parse a price string like '£23.36' or '$5.99' into a Decimal."""
     if not price_str:
         return None
-    cleaned = re.sub(r"[£$€,\s]", "", price_str.strip())
+    cleaned = PRICE_STRIP_RE.sub("", price_str)
     if not cleaned:
         return None
     try:
@@ -45,246 +52,207 @@ def load_amazon_csv(filepath: str) -> List[dict]:
     """Parse an Amazon order history CSV into normalised dicts."""
     items = []
     with open(filepath, newline="", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            order_id = row.get("order id", "").strip()
-            order_date = row.get("order date", "").strip()
+        for row in csv.DictReader(f):
+            get = row.get
+            order_id = get("order id", "").strip()
+            order_date = get("order date", "").strip()
 
             if not order_id or not order_date:
                 continue
 
-            # Validate date
+            # Validate date (YYYY-MM-DD)
             try:
-                parsed_date = datetime.strptime(order_date, "%Y-%m-%d").date()
+                parsed_date = date.fromisoformat(order_date)
             except ValueError:
                 continue
 
-            description = row.get("description", "").strip()
+            description = get("description", "").strip()
             if not description:
                 continue
 
-            quantity_str = row.get("quantity", "1").strip()
+            quantity_str = get("quantity", "1").strip()
             try:
                 quantity = int(quantity_str)
             except ValueError:
                 quantity = 1
 
-            unit_price = parse_price(row.get("price", ""))
-            asin = row.get("ASIN", "").strip() or None
-            category = row.get("category", "").strip() or None
-            is_sub = row.get("subscribe & save", "0").strip() == "1"
-            order_url = row.get("order url", "").strip() or None
-            item_url = row.get("item url", "").strip() or None
-
-            raw_data = {k: v for k, v in row.items() if v}
-
             items.append({
                 "order_id": order_id,
                 "order_date": parsed_date,
-                "asin": asin,
+                "asin": get("ASIN", "").strip() or None,
                 "description": description,
                 "quantity": quantity,
-                "unit_price": unit_price,
-                "category": category,
-                "is_subscription": is_sub,
-                "order_url": order_url,
-                "item_url": item_url,
-                "raw_data": raw_data,
+                "unit_price": parse_price(get("price", "")),
+                "category": get("category", "").strip() or None,
+                "is_subscription": get("subscribe & save", "0").strip() == "1",
+                "order_url": get("order url", "").strip() or None,
+                "item_url": get("item url", "").strip() or None,
+                "raw_data": {k: v for k, v in row.items() if v},
             })
 
     return items
 
 
 def write_items(items: List[dict], conn) -> Dict[str, int]:
-    """Write Amazon order items to amazon_order_item. Idempotent."""
-    cur = conn.cursor()
-    inserted = 0
+    """Write Amazon order items to amazon_order_item. Idempotent.
 
+    Rows are streamed into a temp staging table with COPY, then merged with
+    a single INSERT ... SELECT so ON CONFLICT still skips existing items.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
     for item in items:
-        cur.execute("""
-            INSERT INTO amazon_order_item (
-                order_id, order_date, asin, description,
-                quantity, unit_price, currency, category,
-                order_url, item_url, is_subscription, raw_data
-            ) VALUES (
-                %s, %s, %s, %s,
-                %s, %s, 'GBP', %s,
-                %s, %s, %s, %s
-            )
-            ON CONFLICT (order_id, asin, description) DO NOTHING
-            RETURNING id
-        """, (
+        writer.writerow((
             item["order_id"],
             item["order_date"],
             item["asin"],
             item["description"],
             item["quantity"],
             item["unit_price"],
+            "GBP",
             item["category"],
             item["order_url"],
             item["item_url"],
             item["is_subscription"],
             json.dumps(item["raw_data"]),
         ))
-        if cur.fetchone():
-            inserted += 1
+    buf.seek(0)
+
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TEMP TABLE tmp_amazon_order_item
+            (LIKE amazon_order_item INCLUDING DEFAULTS) ON COMMIT DROP
+    """)
+    cur.copy_expert(
+        f"COPY tmp_amazon_order_item ({ITEM_COLUMNS}) FROM STDIN WITH (FORMAT csv)",
+        buf,
+    )
+    cur.execute(f"""
+        INSERT INTO amazon_order_item ({ITEM_COLUMNS})
+        SELECT {ITEM_COLUMNS} FROM tmp_amazon_order_item
+        ON CONFLICT (order_id, asin, description) DO NOTHING
+    """)
+    inserted = cur.rowcount
 
-    conn.commit()
     return {"inserted": inserted, "skipped": len(items) - inserted}
 
 
-def build_order_totals(conn) -> Dict[str, dict]:
-    """Group amazon_order_item by order_id, compute total per order."""
+def count_orders(conn) -> int:
+    """Count priced orders in amazon_order_item (the matching inputs)."""
     cur = conn.cursor()
     cur.execute("""
-        SELECT order_id, order_date,
-               SUM(unit_price * quantity) as total,
-               COUNT(*) as item_count,
-               array_agg(DISTINCT category) FILTER (WHERE category IS NOT NULL) as categories
+        SELECT count(DISTINCT order_id)
         FROM amazon_order_item
         WHERE unit_price IS NOT NULL
-        GROUP BY order_id, order_date
-        ORDER BY order_date DESC
     """)
+    return cur.fetchone()[0]
 
-    orders = {}
-    for row in cur.fetchall():
-        orders[row[0]] = {
-            "order_id": row[0],
-            "order_date": row[1],
-            "total": row[2],
-            "item_count": row[3],
-            "categories": row[4] or [],
-        }
 
-    return orders
-
-
-def find_amazon_transactions(conn) -> List[dict]:
-    """Find all active bank transactions that look like Amazon charges."""
+def count_amazon_transactions(conn) -> int:
+    """Count active bank transactions that look like Amazon charges."""
     cur = conn.cursor()
-    # Match on raw_merchant containing Amazon-like patterns
-    # Use active_transaction to only match visible (non-suppressed) transactions
     cur.execute("""
-        SELECT id, posted_at, amount, currency, raw_merchant, institution
+        SELECT count(*)
         FROM active_transaction
-        WHERE (
-            raw_merchant ILIKE '%%AMZN%%'
-            OR raw_merchant ILIKE '%%AMAZON%%'
-            OR raw_merchant ILIKE '%%AMZ %%'
-            OR raw_merchant ILIKE '%%Amazon.co%%'
-        )
+        WHERE raw_merchant ~* 'amzn|amazon|amz '
         AND amount < 0
-        ORDER BY posted_at DESC
     """)
+    return cur.fetchone()[0]
+
+
+# Candidate (order, transaction) pairs, computed entirely in Postgres.
+# Mirrors the old Python sweep: ±5 day window, exact = within 1p, close =
+# within 5% (shipping, rounding). An order that matches any transaction
+# exactly is not also close-matched; otherwise a close order is attached to
+# its most recent candidate transaction only.
+MATCH_CANDIDATES_SQL = """
+    WITH order_totals AS (
+        SELECT order_id, order_date, SUM(unit_price * quantity) AS total
+        FROM amazon_order_item
+        WHERE unit_price IS NOT NULL
+        GROUP BY order_id, order_date
+    ),
+    amazon_txns AS (
+        SELECT id, posted_at, ABS(amount) AS amount
+        FROM active_transaction
+        WHERE raw_merchant ~* 'amzn|amazon|amz '
+        AND amount < 0
+    ),
+    candidates AS (
+        SELECT ot.order_id, t.id AS raw_transaction_id, t.posted_at,
+               ot.total, t.amount, ABS(ot.total - t.amount) AS diff
+        FROM amazon_txns t
+        JOIN order_totals ot
+          ON ot.order_date BETWEEN t.posted_at - 5 AND t.posted_at + 5
+        WHERE NOT EXISTS (
+            SELECT 1 FROM amazon_order_match am
+            WHERE am.order_id = ot.order_id AND am.raw_transaction_id = t.id
+        )
+    ),
+    exact_matches AS (
+        SELECT order_id, raw_transaction_id,
+               0.95 AS confidence, 'date_amount_exact' AS method,
+               'Exact: order ' || total || ' == txn ' || amount AS notes
+        FROM candidates
+        WHERE diff <= 0.01
+    ),
+    close_matches AS (
+        SELECT DISTINCT ON (c.order_id)
+               c.order_id, c.raw_transaction_id,
+               GREATEST(0.50, LEAST(0.85, 0.70 - c.diff / c.amount)) AS confidence,
+               'date_amount_close' AS method,
+               'Close: order ' || c.total || ' vs txn ' || c.amount
+                   || ' (diff ' || c.diff || ')' AS notes
+        FROM candidates c
+        WHERE c.diff > 0.01 AND c.diff <= c.amount * 0.05
+          AND NOT EXISTS (SELECT 1 FROM exact_matches e WHERE e.order_id = c.order_id)
+        ORDER BY c.order_id, c.posted_at DESC, c.raw_transaction_id
+    ),
+    matches AS (
+        SELECT * FROM exact_matches
+        UNION ALL
+        SELECT * FROM close_matches
+    )
+"""
+
 
-    txns = []
-    for row in cur.fetchall():
-        txns.append({
-            "id": row[0],
-            "posted_at": row[1],
-            "amount": abs(row[2]),  # make positive for matching
-            "currency": row[3],
-            "raw_merchant": row[4],
-            "institution": row[5],
-        })
-
-    return txns
-
-
-def match_orders_to_transactions(
-    orders: Dict[str, dict],
-    txns: List[dict],
-    conn,
-    dry_run: bool = False,
-) -> Dict[str, int]:
+def match_orders_to_transactions(conn, dry_run: bool = False) -> Dict[str, int]:
     """Match Amazon orders to bank transactions by date + amount.
 
     Strategy:
     1. Exact match: order total == transaction amount, within ±5 days
     2. Close match: order total within 5% of transaction amount, within ±5 days
        (accounts for shipping, discounts, etc.)
-    3. For unmatched transactions, try combinations of orders that sum to the amount
 
     Not 1:1 — one transaction can match multiple orders (combined shipment),
     one order can match multiple transactions (split payment).
+
+    The join runs as a single INSERT ... SELECT, so no rows cross the wire.
     """
     cur = conn.cursor()
-    stats = {"exact": 0, "close": 0, "skipped_existing": 0}
-    date_window = timedelta(days=5)
-
-    # Index orders by date for efficient lookup
-    orders_by_date = defaultdict(list)
-    for order in orders.values():
-        orders_by_date[order["order_date"]].append(order)
-
-    matched_order_ids = set()
-
-    for txn in txns:
-        txn_date = txn["posted_at"]
-        txn_amount = txn["amount"]
-
-        # Check existing matches for this transaction
-        cur.execute("""
-            SELECT order_id FROM amazon_order_match
-            WHERE raw_transaction_id = %s
-        """, (txn["id"],))
-        existing = {r[0] for r in cur.fetchall()}
-
-        # Collect candidate orders within date window
-        candidates = []
-        check_date = txn_date - date_window
-        while check_date <= txn_date + date_window:
-            for order in orders_by_date.get(check_date, []):
-                if order["order_id"] not in existing:
-                    candidates.append(order)
-            check_date += timedelta(days=1)
-
-        if not candidates:
-            continue
-
-        # Try exact match first (within 1p tolerance)
-        for order in candidates:
-            if order["total"] is None:
-                continue
-            diff = abs(order["total"] - txn_amount)
-            if diff <= Decimal("0.01"):
-                if not dry_run:
-                    _insert_match(cur, order["order_id"], txn["id"],
-                                  Decimal("0.95"), "date_amount_exact",
-                                  f"Exact: order {order['total']} == txn {txn_amount}")
-                matched_order_ids.add(order["order_id"])
-                stats["exact"] += 1
-
-        # Try close match (within 5% — shipping, rounding)
-        for order in candidates:
-            if order["total"] is None or order["order_id"] in matched_order_ids:
-                continue
-            diff = abs(order["total"] - txn_amount)
-            if diff <= txn_amount * Decimal("0.05") and diff > Decimal("0.01"):
-                confidence = Decimal("0.70") - (diff / txn_amount)
-                confidence = max(Decimal("0.50"), min(Decimal("0.85"), confidence))
-                if not dry_run:
-                    _insert_match(cur, order["order_id"], txn["id"],
-                                  confidence, "date_amount_close",
-                                  f"Close: order {order['total']} vs txn {txn_amount} (diff {diff})")
-                matched_order_ids.add(order["order_id"])
-                stats["close"] += 1
-
-    if not dry_run:
-        conn.commit()
-
-    return stats
 
+    if dry_run:
+        cur.execute(MATCH_CANDIDATES_SQL + """
+            SELECT method, count(*) FROM matches GROUP BY method
+        """)
+    else:
+        cur.execute(MATCH_CANDIDATES_SQL + """
+            , inserted AS (
+                INSERT INTO amazon_order_match (order_id, raw_transaction_id,
+                                                match_confidence, match_method, notes)
+                SELECT order_id, raw_transaction_id, confidence, method, notes
+                FROM matches
+                ON CONFLICT (order_id, raw_transaction_id) DO NOTHING
+                RETURNING match_method
+            )
+            SELECT match_method, count(*) FROM inserted GROUP BY match_method
+        """)
+    counts = dict(cur.fetchall())
 
-def _insert_match(cur, order_id: str, txn_id, confidence, method: str, notes: str):
-    """Insert a match row, ignoring duplicates."""
-    cur.execute("""
-        INSERT INTO amazon_order_match (order_id, raw_transaction_id,
-                                        match_confidence, match_method, notes)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (order_id, raw_transaction_id) DO NOTHING
-    """, (order_id, txn_id, confidence, method, notes))
+    return {
+        "exact": counts.get("date_amount_exact", 0),
+        "close": counts.get("date_amount_close", 0),
+    }
 
 
 def fixup_suppressed_matches(conn, dry_run: bool = False) -> Dict[str, int]:
@@ -296,56 +264,56 @@ def fixup_suppressed_matches(conn, dry_run: bool = False) -> Dict[str, int]:
     """
     cur = conn.cursor()
 
-    # Find matches pointing to non-active transactions
-    cur.execute("""
-        SELECT am.order_id, am.raw_transaction_id, am.match_confidence, am.match_method
-        FROM amazon_order_match am
-        WHERE NOT EXISTS (
-            SELECT 1 FROM active_transaction at WHERE at.id = am.raw_transaction_id
+    stale_sql = """
+        WITH stale AS (
+            SELECT am.order_id, am.raw_transaction_id AS old_txn_id,
+                   am.match_confidence, am.match_method,
+                   pref.raw_transaction_id AS new_txn_id
+            FROM amazon_order_match am
+            LEFT JOIN LATERAL (
+                SELECT dgm2.raw_transaction_id
+                FROM dedup_group_member dgm1
+                JOIN dedup_group_member dgm2 ON dgm2.dedup_group_id = dgm1.dedup_group_id
+                WHERE dgm1.raw_transaction_id = am.raw_transaction_id
+                  AND dgm2.is_preferred = true
+                  AND dgm2.raw_transaction_id != am.raw_transaction_id
+                LIMIT 1
+            ) pref ON true
+            WHERE NOT EXISTS (
+                SELECT 1 FROM active_transaction at WHERE at.id = am.raw_transaction_id
+            )
         )
-    """)
-    stale = cur.fetchall()
-
-    if not stale:
-        return {"fixed": 0, "orphaned": 0}
-
-    fixed = 0
-    orphaned = 0
-
-    for order_id, old_txn_id, confidence, method in stale:
-        # Find the preferred member in the same dedup group
-        cur.execute("""
-            SELECT dgm2.raw_transaction_id
-            FROM dedup_group_member dgm1
-            JOIN dedup_group_member dgm2 ON dgm2.dedup_group_id = dgm1.dedup_group_id
-            WHERE dgm1.raw_transaction_id = %s
-              AND dgm2.is_preferred = true
-              AND dgm2.raw_transaction_id != %s
-        """, (str(old_txn_id), str(old_txn_id)))
-        row = cur.fetchone()
-
-        if row:
-            new_txn_id = row[0]
-            if not dry_run:
-                # Insert new match (ON CONFLICT handles duplicates)
-                cur.execute("""
-                    INSERT INTO amazon_order_match
-                        (order_id, raw_transaction_id, match_confidence, match_method, notes)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (order_id, raw_transaction_id) DO NOTHING
-                """, (order_id, str(new_txn_id), confidence, method,
-                      f"Fixup: re-pointed from suppressed {old_txn_id}"))
-                # Delete old match
-                cur.execute("""
-                    DELETE FROM amazon_order_match
-                    WHERE order_id = %s AND raw_transaction_id = %s
-                """, (order_id, str(old_txn_id)))
-            fixed += 1
-        else:
-            orphaned += 1
-
-    if not dry_run:
-        conn.commit()
+    """
+    counts_sql = """
+        SELECT count(*) FILTER (WHERE new_txn_id IS NOT NULL),
+               count(*) FILTER (WHERE new_txn_id IS NULL)
+        FROM stale
+    """
+
+    if dry_run:
+        cur.execute(stale_sql + counts_sql)
+    else:
+        # Re-point to the preferred member and drop the stale row in one
+        # statement; orphans (no preferred member) are left in place.
+        cur.execute(stale_sql + """
+            , repointed AS (
+                INSERT INTO amazon_order_match
+                    (order_id, raw_transaction_id, match_confidence, match_method, notes)
+                SELECT order_id, new_txn_id, match_confidence, match_method,
+                       'Fixup: re-pointed from suppressed ' || old_txn_id
+                FROM stale
+                WHERE new_txn_id IS NOT NULL
+                ON CONFLICT (order_id, raw_transaction_id) DO NOTHING
+            ),
+            removed AS (
+                DELETE FROM amazon_order_match am
+                USING stale s
+                WHERE am.order_id = s.order_id
+                  AND am.raw_transaction_id = s.old_txn_id
+                  AND s.new_txn_id IS NOT NULL
+            )
+        """ + counts_sql)
+    fixed, orphaned = cur.fetchone()
 
     return {"fixed": fixed, "orphaned": orphaned}
 
@@ -362,6 +330,9 @@ def main():
     conn = psycopg2.connect(settings.dsn)
 
     try:
+        # One transaction for the whole run; a crash just means re-running
+        conn.cursor().execute("SET LOCAL synchronous_commit = off")
+
         # Step 1: Load CSVs
         if not args.match_only:
             if not args.files:
@@ -401,14 +372,14 @@ def main():
         # Step 2: Match orders to bank transactions
         print("\nStep 2: Matching orders to bank transactions...")
 
-        orders = build_order_totals(conn)
-        print(f"  Orders in DB: {len(orders)}")
+        order_count = count_orders(conn)
+        print(f"  Orders in DB: {order_count}")
 
-        txns = find_amazon_transactions(conn)
-        print(f"  Amazon bank transactions: {len(txns)}")
+        txn_count = count_amazon_transactions(conn)
+        print(f"  Amazon bank transactions: {txn_count}")
 
-        if txns and orders:
-            match_stats = match_orders_to_transactions(orders, txns, conn, args.dry_run)
+        if txn_count and order_count:
+            match_stats = match_orders_to_transactions(conn, args.dry_run)
             print(f"  Matches: {match_stats['exact']} exact, {match_stats['close']} close")
 
             if not args.dry_run:
@@ -428,17 +399,10 @@ def main():
                 """)
                 matched_txns = cur.fetchone()[0]
                 print(f"\n  Total matched: {matched_orders} orders ↔ {matched_txns} active transactions")
+                print(f"  Coverage: {matched_txns}/{txn_count} Amazon transactions matched "
+                      f"({100*matched_txns/txn_count:.0f}%)")
 
-                cur.execute("""
-                    SELECT count(*) FROM active_transaction
-                    WHERE (raw_merchant ILIKE '%%AMZN%%' OR raw_merchant ILIKE '%%AMAZON%%'
-                           OR raw_merchant ILIKE '%%AMZ %%' OR raw_merchant ILIKE '%%Amazon.co%%')
-                    AND amount < 0
-                """)
-                total_amazon = cur.fetchone()[0]
-                print(f"  Coverage: {matched_txns}/{total_amazon} Amazon transactions matched "
-                      f"({100*matched_txns/total_amazon:.0f}%)" if total_amazon > 0 else "")
-
+        conn.commit()
         print("\n=== Done ===")
     finally:
         conn.close()
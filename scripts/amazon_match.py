@@ -17,11 +17,12 @@ from collections import defaultdict
 from datetime import timedelta
 from decimal import Decimal
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
 
 from config.settings import settings
 
@@ -33,62 +34,47 @@ def build_order_totals() -> Dict[str, dict]:
     """
     conn = psycopg2.connect(settings.stuff_dsn)
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT order_id, order_date,
-                   SUM(unit_price * quantity) as total,
-                   COUNT(*) as item_count,
-                   array_agg(DISTINCT category) FILTER (WHERE category IS NOT NULL) as categories
-            FROM amazon_order_item
-            WHERE unit_price IS NOT NULL
-            GROUP BY order_id, order_date
-            ORDER BY order_date DESC
-        """)
-
-        orders = {}
-        for row in cur.fetchall():
-            orders[row[0]] = {
-                "order_id": row[0],
-                "order_date": row[1],
-                "total": row[2],
-                "item_count": row[3],
-                "categories": row[4] or [],
-            }
-        return orders
+        with conn.cursor(name="amazon_order_totals", cursor_factory=RealDictCursor) as cur:
+            cur.itersize = 5000
+            cur.execute("""
+                SELECT order_id, order_date,
+                       SUM(unit_price * quantity) as total,
+                       COUNT(*) as item_count,
+                       COALESCE(
+                           array_agg(DISTINCT category) FILTER (WHERE category IS NOT NULL),
+                           '{}'
+                       ) as categories
+                FROM amazon_order_item
+                WHERE unit_price IS NOT NULL
+                GROUP BY order_id, order_date
+            """)
+            return {row["order_id"]: row for row in cur}
     finally:
         conn.close()
 
 
 def find_amazon_transactions(conn) -> List[dict]:
     """Find all active bank transactions that look like Amazon charges."""
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT id, posted_at, amount, currency, raw_merchant, institution
-        FROM active_transaction
-        WHERE (
-            raw_merchant ILIKE '%%AMZN%%'
-            OR raw_merchant ILIKE '%%AMAZON%%'
-            OR raw_merchant ILIKE '%%AMZ %%'
-            OR raw_merchant ILIKE '%%Amazon.co%%'
-        )
-        AND amount < 0
-        ORDER BY posted_at DESC
-    """)
-
-    txns = []
-    for row in cur.fetchall():
-        txns.append({
-            "id": row[0],
-            "posted_at": row[1],
-            "amount": abs(row[2]),  # make positive for matching
-            "currency": row[3],
-            "raw_merchant": row[4],
-            "institution": row[5],
-        })
+    with conn.cursor(name="amazon_txns", cursor_factory=RealDictCursor) as cur:
+        cur.itersize = 5000
+        cur.execute("""
+            SELECT id, posted_at,
+                   ABS(amount) AS amount,  -- make positive for matching
+                   currency, raw_merchant, institution
+            FROM active_transaction
+            WHERE raw_merchant ~* 'amzn|amazon|amz '
+            AND amount < 0
+        """)
+        txns = list(cur)
 
     return txns
 
 
+def _to_pence(amount: Decimal) -> int:
+    """Convert a money Decimal to integer pence for cheap comparisons."""
+    return int((amount * 100).to_integral_value())
+
+
 def match_orders_to_transactions(
     orders: Dict[str, dict],
     txns: List[dict],
@@ -106,130 +92,143 @@ def match_orders_to_transactions(
     stats = {"exact": 0, "close": 0, "skipped_existing": 0}
     date_window = timedelta(days=5)
 
-    # Index orders by date for efficient lookup
-    orders_by_date = defaultdict(list)
-    for order in orders.values():
-        orders_by_date[order["order_date"]].append(order)
+    # Orders as parallel arrays sorted by date, newest first (same order as txns)
+    sorted_orders = sorted(
+        (o for o in orders.values() if o["total"] is not None),
+        key=lambda o: o["order_date"], reverse=True,
+    )
+    order_dates = [o["order_date"] for o in sorted_orders]
+    order_totals = [o["total"] for o in sorted_orders]
+    order_pence = [_to_pence(t) for t in order_totals]
+    order_ids = [o["order_id"] for o in sorted_orders]
+    n_orders = len(sorted_orders)
+
+    # Pre-fetch existing matches for all candidate transactions in one query
+    cur.execute("""
+        SELECT raw_transaction_id, order_id FROM amazon_order_match
+        WHERE raw_transaction_id = ANY(%s::uuid[])
+    """, (list({str(t["id"]) for t in txns}),))
+    existing_by_txn = defaultdict(set)
+    for txn_id, order_id in cur.fetchall():
+        existing_by_txn[txn_id].add(order_id)
 
     matched_order_ids = set()
+    matches_to_insert: List[Tuple] = []
 
-    for txn in txns:
+    # Sort-merge walk: as txn dates decrease, the [lo, hi) window of orders
+    # within ±5 days only ever slides forward through the sorted arrays.
+    lo = hi = 0
+    for txn in sorted(txns, key=lambda t: t["posted_at"], reverse=True):
         txn_date = txn["posted_at"]
         txn_amount = txn["amount"]
-
-        # Check existing matches for this transaction
-        cur.execute("""
-            SELECT order_id FROM amazon_order_match
-            WHERE raw_transaction_id = %s
-        """, (txn["id"],))
-        existing = {r[0] for r in cur.fetchall()}
-
-        # Collect candidate orders within date window
-        candidates = []
-        check_date = txn_date - date_window
-        while check_date <= txn_date + date_window:
-            for order in orders_by_date.get(check_date, []):
-                if order["order_id"] not in existing:
-                    candidates.append(order)
-            check_date += timedelta(days=1)
-
+        txn_pence = _to_pence(txn_amount)
+        existing = existing_by_txn.get(txn["id"])
+
+        while lo < n_orders and order_dates[lo] > txn_date + date_window:
+            lo += 1
+        if hi < lo:
+            hi = lo
+        while hi < n_orders and order_dates[hi] >= txn_date - date_window:
+            hi += 1
+
+        if existing:
+            candidates = [i for i in range(lo, hi) if order_ids[i] not in existing]
+        else:
+            candidates = range(lo, hi)
         if not candidates:
             continue
 
         # Try exact match first (within 1p tolerance)
-        for order in candidates:
-            if order["total"] is None:
-                continue
-            diff = abs(order["total"] - txn_amount)
-            if diff <= Decimal("0.01"):
-                if not dry_run:
-                    _insert_match(cur, order["order_id"], txn["id"],
-                                  Decimal("0.95"), "date_amount_exact",
-                                  f"Exact: order {order['total']} == txn {txn_amount}")
-                matched_order_ids.add(order["order_id"])
+        for i in candidates:
+            if abs(order_pence[i] - txn_pence) <= 1:
+                matches_to_insert.append((
+                    order_ids[i], txn["id"], Decimal("0.95"), "date_amount_exact",
+                    f"Exact: order {order_totals[i]} == txn {txn_amount}",
+                ))
+                matched_order_ids.add(order_ids[i])
                 stats["exact"] += 1
 
         # Try close match (within 5% — shipping, rounding)
-        for order in candidates:
-            if order["total"] is None or order["order_id"] in matched_order_ids:
+        for i in candidates:
+            if order_ids[i] in matched_order_ids:
                 continue
-            diff = abs(order["total"] - txn_amount)
-            if diff <= txn_amount * Decimal("0.05") and diff > Decimal("0.01"):
+            diff_pence = abs(order_pence[i] - txn_pence)
+            if 1 < diff_pence and diff_pence * 20 <= txn_pence:
+                diff = abs(order_totals[i] - txn_amount)
                 confidence = Decimal("0.70") - (diff / txn_amount)
                 confidence = max(Decimal("0.50"), min(Decimal("0.85"), confidence))
-                if not dry_run:
-                    _insert_match(cur, order["order_id"], txn["id"],
-                                  confidence, "date_amount_close",
-                                  f"Close: order {order['total']} vs txn {txn_amount} (diff {diff})")
-                matched_order_ids.add(order["order_id"])
+                matches_to_insert.append((
+                    order_ids[i], txn["id"], confidence, "date_amount_close",
+                    f"Close: order {order_totals[i]} vs txn {txn_amount} (diff {diff})",
+                ))
+                matched_order_ids.add(order_ids[i])
                 stats["close"] += 1
 
-    if not dry_run:
-        conn.commit()
+    if not dry_run and matches_to_insert:
+        execute_values(cur, """
+            INSERT INTO amazon_order_match (order_id, raw_transaction_id,
+                                            match_confidence, match_method, notes)
+            VALUES %s
+            ON CONFLICT (order_id, raw_transaction_id) DO NOTHING
+        """, matches_to_insert, page_size=1000)
 
     return stats
 
 
-def _insert_match(cur, order_id: str, txn_id, confidence, method: str, notes: str):
-    """Insert a match row, ignoring duplicates."""
-    cur.execute("""
-        INSERT INTO amazon_order_match (order_id, raw_transaction_id,
-                                        match_confidence, match_method, notes)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (order_id, raw_transaction_id) DO NOTHING
-    """, (order_id, txn_id, confidence, method, notes))
-
-
 def fixup_suppressed_matches(conn, dry_run: bool = False) -> Dict[str, int]:
     """Re-point matches from suppressed transactions to their preferred counterparts."""
     cur = conn.cursor()
 
-    cur.execute("""
-        SELECT am.order_id, am.raw_transaction_id, am.match_confidence, am.match_method
-        FROM amazon_order_match am
-        WHERE NOT EXISTS (
-            SELECT 1 FROM active_transaction at WHERE at.id = am.raw_transaction_id
+    stale_sql = """
+        WITH stale AS (
+            SELECT am.order_id, am.raw_transaction_id AS old_txn_id,
+                   am.match_confidence, am.match_method,
+                   pref.raw_transaction_id AS new_txn_id
+            FROM amazon_order_match am
+            LEFT JOIN LATERAL (
+                SELECT dgm2.raw_transaction_id
+                FROM dedup_group_member dgm1
+                JOIN dedup_group_member dgm2 ON dgm2.dedup_group_id = dgm1.dedup_group_id
+                WHERE dgm1.raw_transaction_id = am.raw_transaction_id
+                  AND dgm2.is_preferred = true
+                  AND dgm2.raw_transaction_id != am.raw_transaction_id
+                LIMIT 1
+            ) pref ON true
+            WHERE NOT EXISTS (
+                SELECT 1 FROM active_transaction at WHERE at.id = am.raw_transaction_id
+            )
         )
-    """)
-    stale = cur.fetchall()
-
-    if not stale:
-        return {"fixed": 0, "orphaned": 0}
-
-    fixed = 0
-    orphaned = 0
-
-    for order_id, old_txn_id, confidence, method in stale:
-        cur.execute("""
-            SELECT dgm2.raw_transaction_id
-            FROM dedup_group_member dgm1
-            JOIN dedup_group_member dgm2 ON dgm2.dedup_group_id = dgm1.dedup_group_id
-            WHERE dgm1.raw_transaction_id = %s
-              AND dgm2.is_preferred = true
-              AND dgm2.raw_transaction_id != %s
-        """, (str(old_txn_id), str(old_txn_id)))
-        row = cur.fetchone()
-
-        if row:
-            new_txn_id = row[0]
-            if not dry_run:
-                cur.execute("""
-                    INSERT INTO amazon_order_match
-                        (order_id, raw_transaction_id, match_confidence, match_method, notes)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (order_id, raw_transaction_id) DO NOTHING
-                """, (order_id, str(new_txn_id), confidence, method,
-                      f"Fixup: re-pointed from suppressed {old_txn_id}"))
-                cur.execute("""
-                    DELETE FROM amazon_order_match
-                    WHERE order_id = %s AND raw_transaction_id = %s
-                """, (order_id, str(old_txn_id)))
-            fixed += 1
-        else:
-            orphaned += 1
+    """
+    counts_sql = """
+        SELECT count(*) FILTER (WHERE new_txn_id IS NOT NULL),
+               count(*) FILTER (WHERE new_txn_id IS NULL)
+        FROM stale
+    """
 
-    if not dry_run:
-        conn.commit()
+    if dry_run:
+        cur.execute(stale_sql + counts_sql)
+    else:
+        # Re-point to the preferred member and drop the stale row in one
+        # statement; orphans (no preferred member) are left in place.
+        cur.execute(stale_sql + """
+            , repointed AS (
+                INSERT INTO amazon_order_match
+                    (order_id, raw_transaction_id, match_confidence, match_method, notes)
+                SELECT order_id, new_txn_id, match_confidence, match_method,
+                       'Fixup: re-pointed from suppressed ' || old_txn_id
+                FROM stale
+                WHERE new_txn_id IS NOT NULL
+                ON CONFLICT (order_id, raw_transaction_id) DO NOTHING
+            ),
+            removed AS (
+                DELETE FROM amazon_order_match am
+                USING stale s
+                WHERE am.order_id = s.order_id
+                  AND am.raw_transaction_id = s.old_txn_id
+                  AND s.new_txn_id IS NOT NULL
+            )
+        """ + counts_sql)
+    fixed, orphaned = cur.fetchone()
 
     return {"fixed": fixed, "orphaned": orphaned}
 
@@ -250,6 +249,9 @@ def main():
     conn = psycopg2.connect(settings.dsn)
 
     try:
+        # One transaction for the whole run; a crash just means re-running
+        conn.cursor().execute("SET LOCAL synchronous_commit = off")
+
         print("\nStep 2: Finding Amazon bank transactions...")
         txns = find_amazon_transactions(conn)
         print(f"  Amazon bank transactions: {len(txns)}")
@@ -278,8 +280,7 @@ def main():
 
                 cur.execute("""
                     SELECT count(*) FROM active_transaction
-                    WHERE (raw_merchant ILIKE '%%AMZN%%' OR raw_merchant ILIKE '%%AMAZON%%'
-                           OR raw_merchant ILIKE '%%AMZ %%' OR raw_merchant ILIKE '%%Amazon.co%%')
+                    WHERE raw_merchant ~* 'amzn|amazon|amz '
                     AND amount < 0
                 """)
                 total_amazon = cur.fetchone()[0]
@@ -287,6 +288,7 @@ def main():
                     print(f"  Coverage: {matched_txns}/{total_amazon} Amazon transactions matched "
                           f"({100*matched_txns/total_amazon:.0f}%)")
 
+        conn.commit()
         print("\n=== Done ===")
     finally:
         conn.close()
@@ -45,60 +45,53 @@ def apply_split_rules(dry_run: bool = False) -> dict:
         if not rules:
             return {"total_rules": 0, "overrides_created": 0}
 
-        total_created = 0
-
-        for rule_id, pattern, amt_exact, amt_min, amt_max, target_id, desc in rules:
-            # Build amount condition
-            amount_conditions = []
-            params: dict = {"pattern": pattern, "target_id": str(target_id), "rule_id": rule_id}
-
-            if amt_exact is not None:
-                amount_conditions.append("rt.amount = %(amt_exact)s")
-                params["amt_exact"] = amt_exact
-            if amt_min is not None:
-                amount_conditions.append("rt.amount >= %(amt_min)s")
-                params["amt_min"] = amt_min
-            if amt_max is not None:
-                amount_conditions.append("rt.amount <= %(amt_max)s")
-                params["amt_max"] = amt_max
-
-            amount_where = (" AND " + " AND ".join(amount_conditions)) if amount_conditions else ""
-
-            if dry_run:
-                # Count matching transactions without existing overrides
-                cur.execute(f"""
-                    SELECT COUNT(*)
-                    FROM cleaned_transaction ct
-                    JOIN active_transaction rt ON rt.id = ct.raw_transaction_id
-                    WHERE ct.cleaned_merchant LIKE %(pattern)s
-                      {amount_where}
-                      AND NOT EXISTS (
-                          SELECT 1 FROM transaction_merchant_override tmo
-                          WHERE tmo.raw_transaction_id = rt.id
-                      )
-                """, params)
-                count = cur.fetchone()[0]
-                print(f"    Rule {rule_id}: {desc or pattern} -> {count} transactions would be overridden")
-                total_created += count
-            else:
-                cur.execute(f"""
+        # All rules in one set-based pass; DISTINCT ON keeps the first rule
+        # (by priority) that matches each transaction.
+        matches_sql = """
+            SELECT DISTINCT ON (rt.id)
+                   rt.id AS raw_transaction_id,
+                   r.target_merchant_id, r.id AS split_rule_id
+            FROM merchant_split_rule r
+            JOIN cleaned_transaction ct ON ct.cleaned_merchant LIKE r.merchant_pattern
+            JOIN active_transaction rt ON rt.id = ct.raw_transaction_id
+            WHERE (r.amount_exact IS NULL OR rt.amount = r.amount_exact)
+              AND (r.amount_min IS NULL OR rt.amount >= r.amount_min)
+              AND (r.amount_max IS NULL OR rt.amount <= r.amount_max)
+              AND NOT EXISTS (
+                  SELECT 1 FROM transaction_merchant_override tmo
+                  WHERE tmo.raw_transaction_id = rt.id
+              )
+            ORDER BY rt.id, r.priority, r.id
+        """
+
+        if dry_run:
+            # LEFT JOIN from the rule table so rules matching nothing still
+            # show up (with 0) in the preview.
+            cur.execute(f"""
+                SELECT r.id, COUNT(m.split_rule_id)
+                FROM merchant_split_rule r
+                LEFT JOIN ({matches_sql}) m ON m.split_rule_id = r.id
+                GROUP BY r.id
+            """)
+        else:
+            cur.execute(f"""
+                WITH inserted AS (
                     INSERT INTO transaction_merchant_override
                         (raw_transaction_id, canonical_merchant_id, split_rule_id)
-                    SELECT rt.id, %(target_id)s::uuid, %(rule_id)s
-                    FROM cleaned_transaction ct
-                    JOIN active_transaction rt ON rt.id = ct.raw_transaction_id
-                    WHERE ct.cleaned_merchant LIKE %(pattern)s
-                      {amount_where}
-                      AND NOT EXISTS (
-                          SELECT 1 FROM transaction_merchant_override tmo
-                          WHERE tmo.raw_transaction_id = rt.id
-                      )
+                    SELECT raw_transaction_id, target_merchant_id, split_rule_id
+                    FROM ({matches_sql}) m
                     ON CONFLICT (raw_transaction_id) DO NOTHING
-                """, params)
-                created = cur.rowcount
-                total_created += created
-                if created:
-                    print(f"    Rule {rule_id}: {desc or pattern} -> {created} overrides created")
+                    RETURNING split_rule_id
+                )
+                SELECT split_rule_id, COUNT(*) FROM inserted GROUP BY split_rule_id
+            """)
+        counts = dict(cur.fetchall())
+
+        verb = "would be overridden" if dry_run else "overrides created"
+        for rule_id, pattern, *_, desc in rules:
+            if dry_run or counts.get(rule_id):
+                print(f"    Rule {rule_id}: {desc or pattern} -> {counts.get(rule_id, 0)} {verb}")
+        total_created = sum(counts.values())
 
         if not dry_run:
             conn.commit()
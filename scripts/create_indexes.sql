@@ -0,0 +1,36 @@
+-- Supporting indexes on core tables for batch scripts
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Amazon merchant detection (amazon_load.py, amazon_match.py):
+-- raw_merchant ~* 'amzn|amazon|amz '
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_raw_merchant_trgm
+    ON raw_transaction USING GIN (raw_merchant gin_trgm_ops);
+
+-- Pot reconciliation totals (create_pot_accounts.py):
+-- SUM(amount), MAX(posted_at) per synthetic Monzo pot account_ref
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_raw_txn_synthetic_pot
+    ON raw_transaction (account_ref, posted_at) INCLUDE (amount)
+    WHERE source = 'synthetic' AND institution = 'monzo';
+
+-- iBank matching (ibank_enrich.py, ibank_import_tags.py):
+-- WHERE source = 'ibank', joined to account_alias on (institution, account_ref)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_raw_txn_ibank
+    ON raw_transaction (institution, account_ref, posted_at)
+    WHERE source = 'ibank';
+
+-- iBank tag import (ibank_import_tags.py): transaction_ref -> id for iBank rows
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_raw_txn_ibank_ref
+    ON raw_transaction (transaction_ref) INCLUDE (id)
+    WHERE source = 'ibank' AND transaction_ref IS NOT NULL;
+
+-- active_transaction and suppression checks:
+-- NOT EXISTS (... WHERE raw_transaction_id = rt.id AND NOT is_preferred)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_dedup_member_suppressed
+    ON dedup_group_member (raw_transaction_id)
+    WHERE NOT is_preferred;
+
+-- Transfer linker (link_fx_events.py): has this transaction got an event leg?
+-- EXISTS (... economic_event_leg WHERE raw_transaction_id = ...)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_event_leg_raw_txn
+    ON economic_event_leg (raw_transaction_id);
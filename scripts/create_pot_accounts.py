@@ -12,11 +12,11 @@ side of the ledger.
 Idempotent: uses ON CONFLICT with transaction_ref = 'pot_mirror_{original_id}'.
 """
 
-import json
 import sys
 from pathlib import Path
 
 import psycopg2
+from psycopg2.extras import Json, execute_values
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 from config.settings import settings
@@ -40,79 +40,90 @@ def create_pot_accounts(dry_run: bool = False) -> dict:
     try:
         cur = conn.cursor()
 
-        # Find all pot transfers on the main Monzo account
+        # Pot transfers on the main Monzo account for pots not in POT_ACCOUNTS
         cur.execute("""
-            SELECT id, posted_at, amount, currency, raw_merchant, raw_memo, raw_data
+            SELECT raw_merchant, count(*)
             FROM active_transaction
             WHERE institution = 'monzo'
               AND account_ref = 'acc_00009cSZpPQxiG2CFWlPjF'
               AND raw_merchant LIKE 'pot_%%'
-            ORDER BY posted_at
-        """)
-        rows = cur.fetchall()
-
-        inserted = 0
-        skipped = 0
-
-        for row in rows:
-            txn_id, posted_at, amount, currency, raw_merchant, raw_memo, raw_data = row
-
-            # Determine which pot this belongs to
-            pot_id = raw_merchant  # raw_merchant IS the pot ID for pot transfers
-            account_ref = POT_ACCOUNTS.get(pot_id)
-            if not account_ref:
-                print(f"  WARNING: Unknown pot {pot_id}, skipping")
-                skipped += 1
-                continue
-
+              AND raw_merchant <> ALL(%s)
+            GROUP BY raw_merchant
+            ORDER BY raw_merchant
+        """, (list(POT_ACCOUNTS),))
+        unknown = cur.fetchall()
+        for pot_id, count in unknown:
+            print(f"  WARNING: Unknown pot {pot_id} ({count} transfers), skipping")
+        skipped = sum(count for _, count in unknown)
+
+        # Known pot transfers, joined to their account_ref server-side.
+        # raw_merchant IS the pot ID for pot transfers.
+        transfers_sql = """
+            WITH pots (pot_id, account_ref) AS (VALUES %s),
+            transfers AS (
+                SELECT t.id, t.posted_at, t.amount, t.currency, t.raw_merchant,
+                       t.raw_memo, p.account_ref
+                FROM active_transaction t
+                JOIN pots p ON p.pot_id = t.raw_merchant
+                WHERE t.institution = 'monzo'
+                  AND t.account_ref = 'acc_00009cSZpPQxiG2CFWlPjF'
+            )
+        """
+        pot_values = list(POT_ACCOUNTS.items())
+
+        if dry_run:
+            rows = execute_values(cur, transfers_sql + """
+                SELECT posted_at, -amount, currency, account_ref
+                FROM transfers
+                ORDER BY posted_at
+            """, pot_values, fetch=True)
+            for posted_at, mirror_amount, currency, account_ref in rows:
+                print(f"  [DRY RUN] {posted_at} {mirror_amount:>10.2f} {currency} -> {account_ref}")
+            found = len(rows)
+            inserted = found
+        else:
             # Mirror the amount: main account debit (-) becomes pot credit (+)
-            mirror_amount = -amount
-            mirror_ref = f"pot_mirror_{txn_id}"
+            counts = execute_values(cur, transfers_sql + """
+                , mirrored AS (
+                    INSERT INTO raw_transaction (
+                        source, institution, account_ref, transaction_ref,
+                        posted_at, amount, currency,
+                        raw_merchant, raw_memo, is_dirty, raw_data
+                    )
+                    SELECT 'synthetic', 'monzo', account_ref, 'pot_mirror_' || id,
+                           posted_at, -amount, btrim(currency),
+                           'Pot Transfer', raw_memo, false,
+                           jsonb_build_object('mirror_of', id::text, 'pot_id', raw_merchant)
+                    FROM transfers
+                    ON CONFLICT (institution, account_ref, transaction_ref)
+                        WHERE transaction_ref IS NOT NULL
+                    DO NOTHING
+                    RETURNING 1
+                )
+                SELECT (SELECT count(*) FROM transfers), (SELECT count(*) FROM mirrored)
+            """, pot_values, fetch=True)
+            found = sum(row[0] for row in counts)
+            inserted = sum(row[1] for row in counts)
+            skipped += found - inserted
 
-            if dry_run:
-                print(f"  [DRY RUN] {posted_at} {mirror_amount:>10.2f} {currency} -> {account_ref}")
-                inserted += 1
-                continue
+        total = found + sum(count for _, count in unknown)
 
-            cur.execute("""
-                INSERT INTO raw_transaction (
-                    source, institution, account_ref, transaction_ref,
-                    posted_at, amount, currency,
-                    raw_merchant, raw_memo, is_dirty, raw_data
-                ) VALUES (
-                    'synthetic', 'monzo', %s, %s,
-                    %s, %s, %s,
-                    %s, %s, false, %s
-                )
-                ON CONFLICT (institution, account_ref, transaction_ref)
-                    WHERE transaction_ref IS NOT NULL
-                DO NOTHING
-            """, (
-                account_ref,
-                mirror_ref,
-                posted_at,
-                mirror_amount,
-                currency.strip(),
-                'Pot Transfer',
-                raw_memo,
-                json.dumps({"mirror_of": str(txn_id), "pot_id": pot_id}),
-            ))
-            if cur.rowcount > 0:
-                inserted += 1
-            else:
-                skipped += 1
+        # Insert reconciliation adjustments for interest / untracked movements.
+        # Current sum and latest date for every pot in one grouped query.
+        cur.execute("""
+            SELECT account_ref, COALESCE(SUM(amount), 0), MAX(posted_at)
+            FROM raw_transaction
+            WHERE institution = 'monzo'
+              AND source = 'synthetic'
+              AND account_ref = ANY(%s)
+            GROUP BY account_ref
+        """, (list(POT_ACTUAL_BALANCE),))
+        pot_totals = {ref: (float(pot_sum), latest) for ref, pot_sum, latest in cur.fetchall()}
 
-        # Insert reconciliation adjustments for interest / untracked movements
         adjustments = 0
+        adjustment_rows = []
         for account_ref, actual_balance in POT_ACTUAL_BALANCE.items():
-            cur.execute("""
-                SELECT COALESCE(SUM(amount), 0)
-                FROM raw_transaction
-                WHERE institution = 'monzo'
-                  AND account_ref = %s
-                  AND source = 'synthetic'
-            """, (account_ref,))
-            current_sum = float(cur.fetchone()[0])
+            current_sum, latest = pot_totals.get(account_ref, (0.0, None))
             diff = actual_balance - current_sum
             if abs(diff) < 0.01:
                 continue
@@ -124,40 +135,34 @@ def create_pot_accounts(dry_run: bool = False) -> dict:
                 continue
 
             # Use latest pot transfer date for the adjustment
-            cur.execute("""
-                SELECT MAX(posted_at) FROM raw_transaction
-                WHERE institution = 'monzo' AND account_ref = %s AND source = 'synthetic'
-            """, (account_ref,))
-            latest = cur.fetchone()[0]
+            adjustment_rows.append((
+                account_ref,
+                adj_ref,
+                latest,
+                diff,
+                'Interest / Reconciliation',
+                f'Adjustment to match actual pot balance of {actual_balance:.2f}',
+                Json({"type": "reconciliation", "actual_balance": actual_balance}),
+            ))
 
-            cur.execute("""
+        if adjustment_rows:
+            execute_values(cur, """
                 INSERT INTO raw_transaction (
                     source, institution, account_ref, transaction_ref,
                     posted_at, amount, currency,
                     raw_merchant, raw_memo, is_dirty, raw_data
-                ) VALUES (
-                    'synthetic', 'monzo', %s, %s,
-                    %s, %s, 'GBP',
-                    %s, %s, false, %s
-                )
+                ) VALUES %s
                 ON CONFLICT (institution, account_ref, transaction_ref)
                     WHERE transaction_ref IS NOT NULL
                 DO UPDATE SET amount = EXCLUDED.amount, posted_at = EXCLUDED.posted_at
-            """, (
-                account_ref,
-                adj_ref,
-                latest,
-                diff,
-                'Interest / Reconciliation',
-                f'Adjustment to match actual pot balance of {actual_balance:.2f}',
-                json.dumps({"type": "reconciliation", "actual_balance": actual_balance}),
-            ))
-            adjustments += 1
+            """, adjustment_rows,
+                template="('synthetic', 'monzo', %s, %s, %s, %s, 'GBP', %s, %s, false, %s)")
+            adjustments += len(adjustment_rows)
 
         if not dry_run:
             conn.commit()
 
-        return {"inserted": inserted, "skipped": skipped, "total": len(rows), "adjustments": adjustments}
+        return {"inserted": inserted, "skipped": skipped, "total": total, "adjustments": adjustments}
     finally:
         conn.close()
 
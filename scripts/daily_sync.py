@@ -12,41 +12,51 @@ Env vars:
     HEALTHCHECK_WISE_URL   — pinged after successful Wise sync
 """
 
+import atexit
 import json
 import os
-import subprocess
 import sys
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+import requests
 
 from config.settings import settings
+from scripts.wise_bulk_load import parse_activity, write_transactions, build_api_fx_events
+from src.cleaning.matcher import match_all
+from src.cleaning.processor import process_all
+from src.dedup.matcher import find_duplicates
+from src.ingestion.monzo import authenticate, list_accounts, fetch_transactions
+from src.ingestion.wise import get_profiles, get_balances, fetch_activities, enrich_activities
+from src.ingestion.writer import write_monzo_transactions
 
 
 def ping_healthcheck(url: str | None, label: str):
     """Ping a healthcheck URL. Silently skips if not configured."""
     if not url:
         return
-    try:
-        subprocess.run(
-            ["curl", "-fsS", "-m", "10", "--retry", "3", url],
-            capture_output=True, timeout=60,
-        )
-        print(f"  [{label}] Healthcheck pinged.")
-    except Exception as e:
-        print(f"  [{label}] Healthcheck ping failed: {e}")
+    # In-process GET with the same budget as the old `curl -m 10 --retry 3`
+    for attempt in range(4):
+        try:
+            requests.get(url, timeout=10).raise_for_status()
+            print(f"  [{label}] Healthcheck pinged.")
+            return
+        except requests.RequestException as e:
+            if attempt == 3:
+                print(f"  [{label}] Healthcheck ping failed: {e}")
+                return
+            time.sleep(2 ** attempt)
 
 
-def sync_wise() -> dict:
+def sync_wise(pool: ThreadedConnectionPool) -> dict:
     """Sync Wise transactions for the last 30 days."""
-    from src.ingestion.wise import get_profiles, get_balances, fetch_activities, enrich_activities
-    from scripts.wise_bulk_load import parse_activity, write_transactions, build_api_fx_events
-
     since = datetime.now(timezone.utc) - timedelta(days=30)
 
     profiles = get_profiles()
@@ -67,7 +77,7 @@ def sync_wise() -> dict:
 
     print(f"  Parsed {len(txns)} transactions")
 
-    conn = psycopg2.connect(settings.dsn)
+    conn = pool.getconn()
     try:
         if txns:
             result = write_transactions(txns, conn)
@@ -83,16 +93,13 @@ def sync_wise() -> dict:
         result["balance_mismatches"] = reconcile_wise_balances(profile_id, conn)
         return result
     finally:
-        conn.close()
+        pool.putconn(conn)
 
 
 def reconcile_wise_balances(profile_id: int, conn, tolerance: float = 0.01) -> list[dict]:
     """Compare live Wise balances to local SUM(amount) per currency. Print
     mismatches and return them. Does not raise — caller decides how to react.
     """
-    from src.ingestion.wise import get_balances
-    from decimal import Decimal
-
     live = {b["currency"]: Decimal(str(b["amount"]["value"]))
             for b in get_balances(profile_id)}
 
@@ -124,11 +131,8 @@ def reconcile_wise_balances(profile_id: int, conn, tolerance: float = 0.01) -> l
     return mismatches
 
 
-def sync_monzo() -> dict:
+def sync_monzo(pool: ThreadedConnectionPool) -> dict:
     """Sync Monzo transactions for the last 30 days."""
-    from src.ingestion.monzo import authenticate, list_accounts, fetch_transactions, AuthRequiredError
-    from src.ingestion.writer import write_monzo_transactions
-
     access_token = authenticate(headless=True)
     auth_time = time.time()
 
@@ -138,39 +142,38 @@ def sync_monzo() -> dict:
     total_inserted = 0
     total_skipped = 0
 
-    for acc in accounts:
-        if acc.get("closed"):
-            continue
-
-        acc_id = acc["id"]
-        print(f"  Account: {acc_id}")
-        txns = fetch_transactions(access_token, acc_id, since=since, auth_time=auth_time)
-        print(f"  Fetched {len(txns)} transactions")
-
-        if txns:
-            result = write_monzo_transactions(txns, acc_id)
-            total_inserted += result["inserted"]
-            total_skipped += result["skipped"]
+    conn = pool.getconn()
+    try:
+        for acc in accounts:
+            if acc.get("closed"):
+                continue
+
+            acc_id = acc["id"]
+            print(f"  Account: {acc_id}")
+            txns = fetch_transactions(access_token, acc_id, since=since, auth_time=auth_time)
+            print(f"  Fetched {len(txns)} transactions")
+
+            if txns:
+                result = write_monzo_transactions(txns, acc_id, conn=conn)
+                total_inserted += result["inserted"]
+                total_skipped += result["skipped"]
+    finally:
+        pool.putconn(conn)
 
     return {"inserted": total_inserted, "skipped": total_skipped}
 
 
 def run_cleaning():
     """Run the cleaning pipeline for new transactions."""
-    from src.cleaning.processor import process_all
-    from src.cleaning.matcher import match_all
-
     print("  Cleaning raw merchants...")
     process_all()
     print("  Matching to canonical merchants...")
     match_all()
 
 
-def run_dedup():
+def run_dedup(pool: ThreadedConnectionPool):
     """Run the dedup pipeline."""
-    from src.dedup.matcher import find_duplicates
-
-    conn = psycopg2.connect(settings.dsn)
+    conn = pool.getconn()
     try:
         result = find_duplicates(conn)
         print(f"  Superseded: {result['source_superseded']}, "
@@ -179,14 +182,14 @@ def run_dedup():
               f"iBank internal: {result['ibank_internal_groups']}, "
               f"Skipped: {result['skipped']}")
     finally:
-        conn.close()
+        pool.putconn(conn)
 
 
-def run_categorisation():
+def run_categorisation(pool: ThreadedConnectionPool):
     """Run full categorisation pipeline: naming, source hints, LLM, fuzzy merge, Amazon, override learning."""
     from src.categorisation.engine import run_all
 
-    conn = psycopg2.connect(settings.dsn)
+    conn = pool.getconn()
     try:
         results = run_all(conn)
         # Summarise key stats
@@ -203,7 +206,7 @@ def run_categorisation():
               f"Amazon: {amazon.get('amazon_categorised', 0)} categorised, "
               f"Learned: {overrides.get('merchant_corrections', 0)} corrections")
     finally:
-        conn.close()
+        pool.putconn(conn)
 
 
 def main():
@@ -212,11 +215,23 @@ def main():
 
     print(f"=== Daily Sync — {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n")
 
+    # Connections are reused across steps; two cover the concurrent syncs
+    pool = ThreadedConnectionPool(1, 2, settings.dsn)
+    atexit.register(pool.closeall)
+
+    # Steps 1+2: Wise and Monzo hit different APIs and touch disjoint rows,
+    # so fetch them concurrently; each borrows its own pooled connection. Their
+    # progress lines may interleave, results are reported in order below.
+    print("Steps 1+2: Sync Wise and Monzo...")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        wise_future = executor.submit(sync_wise, pool)
+        monzo_future = executor.submit(sync_monzo, pool)
+
     # Step 1: Wise
     wise_ok = False
-    print("Step 1: Sync Wise...")
+    print("\nStep 1: Sync Wise...")
     try:
-        result = sync_wise()
+        result = wise_future.result()
         mismatches = result.get("balance_mismatches", [])
         print(f"  Result: {result['inserted']} new, "
               f"{result.get('updated', 0)} updated, "
@@ -226,18 +241,18 @@ def main():
         wise_ok = True
     except Exception as e:
         print(f"  ERROR syncing Wise: {e}")
-        traceback.print_exc()
+        traceback.print_exception(e)
 
     # Step 2: Monzo
     monzo_ok = False
     print("\nStep 2: Sync Monzo...")
     try:
-        result = sync_monzo()
+        result = monzo_future.result()
         print(f"  Result: {result['inserted']} new, {result['skipped']} dupes")
         monzo_ok = True
     except Exception as e:
         print(f"  ERROR syncing Monzo: {e}")
-        traceback.print_exc()
+        traceback.print_exception(e)
 
     # Step 3: Cleaning
     print("\nStep 3: Cleaning pipeline...")
@@ -251,7 +266,7 @@ def main():
     # Step 4: Dedup
     print("\nStep 4: Dedup pipeline...")
     try:
-        run_dedup()
+        run_dedup(pool)
         print("  Done.")
     except Exception as e:
         print(f"  ERROR in dedup: {e}")
@@ -260,7 +275,7 @@ def main():
     # Step 5: Auto-categorisation (source hints only, no LLM)
     print("\nStep 5: Auto-categorisation...")
     try:
-        run_categorisation()
+        run_categorisation(pool)
         print("  Done.")
     except Exception as e:
         print(f"  ERROR in categorisation: {e}")
@@ -280,13 +295,13 @@ def main():
     print("\nStep 7: Apply tag rules...")
     try:
         from src.api.routers.tag_rules import reconcile_tag_rules
-        conn = psycopg2.connect(settings.dsn)
+        conn = pool.getconn()
         try:
             result = reconcile_tag_rules(conn)
             print(f"  Rules: {result['rules_applied']}, "
                   f"Created: {result['tags_created']}, Removed: {result['tags_removed']}")
         finally:
-            conn.close()
+            pool.putconn(conn)
     except Exception as e:
         print(f"  ERROR applying tag rules: {e}")
         traceback.print_exc()
@@ -321,32 +336,34 @@ def main():
     print("\nStep 9: Link transfers & FX events...")
     try:
         from scripts.link_fx_events import (
-            find_fx_pairs, find_same_ccy_pairs, find_visa_payment_pairs,
-            find_already_linked, link_fx_pairs, link_same_ccy_pairs,
+            create_active_tx, find_fx_pairs, find_same_ccy_pairs,
+            find_visa_payment_pairs, link_fx_pairs, link_same_ccy_pairs,
             link_visa_payment_pairs,
         )
-        conn = psycopg2.connect(settings.dsn)
+        conn = pool.getconn()
         try:
             cur = conn.cursor()
-            already_linked = find_already_linked(cur)
 
-            fx_pairs = find_fx_pairs(cur)
-            fx_created, fx_skipped = link_fx_pairs(cur, fx_pairs, already_linked)
+            fx_pairs = find_fx_pairs(conn)
+            fx_created, fx_skipped = link_fx_pairs(cur, fx_pairs)
             conn.commit()
 
+            # Active transactions, shared by the transfer and Visa finders
+            create_active_tx(cur)
+
             xfr_pairs = find_same_ccy_pairs(cur)
-            xfr_created, xfr_skipped = link_same_ccy_pairs(cur, xfr_pairs, already_linked)
+            xfr_created, xfr_skipped = link_same_ccy_pairs(cur, xfr_pairs)
             conn.commit()
 
             visa_pairs = find_visa_payment_pairs(cur)
-            visa_created, visa_skipped = link_visa_payment_pairs(cur, visa_pairs, already_linked)
+            visa_created, visa_skipped = link_visa_payment_pairs(cur, visa_pairs)
             conn.commit()
 
             print(f"  FX: {fx_created} created, {fx_skipped} skipped")
             print(f"  Transfers: {xfr_created} created, {xfr_skipped} skipped")
             print(f"  Visa payments: {visa_created} created, {visa_skipped} skipped")
         finally:
-            conn.close()
+            pool.putconn(conn)
     except Exception as e:
         print(f"  ERROR linking transfers: {e}")
         traceback.print_exc()
@@ -355,7 +372,7 @@ def main():
     print("\nStep 10: Refresh stock prices...")
     try:
         from src.stocks.prices import fetch_current_prices
-        conn = psycopg2.connect(settings.dsn)
+        conn = pool.getconn()
         try:
             result = fetch_current_prices(conn)
             print(f"  Updated: {result['updated']} prices, "
@@ -363,7 +380,7 @@ def main():
             for err in result["errors"]:
                 print(f"    {err['symbol']}: {err['error']}")
         finally:
-            conn.close()
+            pool.putconn(conn)
     except Exception as e:
         print(f"  ERROR refreshing prices: {e}")
         traceback.print_exc()
@@ -386,7 +403,7 @@ def main():
     try:
         from src.receipts.matcher import auto_match_receipt
 
-        conn = psycopg2.connect(settings.dsn)
+        conn = pool.getconn()
         try:
             cur = conn.cursor()
 
@@ -429,7 +446,7 @@ def main():
                 print("  CalDAV disabled — skipping overdue alerts")
 
         finally:
-            conn.close()
+            pool.putconn(conn)
     except Exception as e:
         print(f"  ERROR in receipt sweep: {e}")
         traceback.print_exc()
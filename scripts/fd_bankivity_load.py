@@ -8,6 +8,7 @@ transaction ID as transaction_ref for idempotent inserts.
 Usage:
     python scripts/fd_bankivity_load.py ~/path/to/NonaFinance.bank8
     python scripts/fd_bankivity_load.py --dry-run ~/path/to/NonaFinance.bank8
+    python scripts/fd_bankivity_load.py --bulk ~/path/to/NonaFinance.bank8
 """
 
 import argparse
@@ -17,12 +18,12 @@ import sys
 from datetime import datetime, timezone
 from decimal import Decimal
 from pathlib import Path
+from typing import Dict, Iterable, Iterator
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-import psycopg2
-
-from config.settings import settings
+# psycopg2, config.settings (pydantic) and the raw writer are imported where
+# first needed, so --dry-run parses without loading them.
 
 # Core Data epoch offset: seconds between Unix epoch (1970) and Core Data epoch (2001-01-01)
 CORE_DATA_EPOCH_OFFSET = 978307200
@@ -34,113 +35,134 @@ ACCOUNT_MAP = {
 }
 
 
-def extract_transactions(db_path: str) -> list[dict]:
-    """Extract Salt Edge-sourced FD transactions from Bankivity SQLite DB."""
+def iter_transactions(db_path: str) -> Iterator[tuple]:
+    """Stream Salt Edge-sourced FD transactions from the Bankivity SQLite DB.
+
+    Yields raw_transaction rows in RAW_TRANSACTION_COLUMNS order, with
+    raw_data as a JSON string, ready for execute_values or COPY, so the
+    ledger is never held in memory as a whole.
+    """
     conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    try:
+        cur = conn.cursor()
+
+        cur.execute("""
+            SELECT
+                a.ZPNAME as account_name,
+                t.ZPDATE as txn_date_cd,
+                t.ZPTITLE as title,
+                -- As text, so Decimal gets SQLite's digits, not a float repr
+                CAST(li.ZPTRANSACTIONAMOUNT AS TEXT) as amount,
+                CAST(li.ZPRUNNINGBALANCE AS TEXT) as running_balance,
+                li.ZPMEMO as memo,
+                ls.ZPSOURCEIDENTIFIER as saltedge_txn_id,
+                ls.ZPDETAILS as source_details,
+                ls.ZPAMOUNT as source_amount
+            FROM ZTRANSACTION t
+            JOIN ZLINEITEM li ON li.ZPTRANSACTION = t.Z_PK
+            JOIN ZACCOUNT a ON a.Z_PK = li.ZPACCOUNT
+            JOIN ZLINEITEMSOURCE ls ON ls.ZPLINEITEM = li.Z_PK
+                AND ls.ZPSOURCETYPE = 'saltedge'
+            WHERE a.ZPNAME IN ({placeholders})
+            ORDER BY t.ZPDATE DESC
+        """.format(placeholders=",".join("?" for _ in ACCOUNT_MAP)),
+            list(ACCOUNT_MAP.keys()),
+        )
+
+        # Plain tuples, unpacked once per row (no sqlite3.Row name lookups)
+        for (account_name, cd_timestamp, title, amount, running_balance,
+             memo, saltedge_txn_id, source_details, _source_amount) in cur:
+            account_ref = ACCOUNT_MAP.get(account_name)
+            if not account_ref:
+                continue
+
+            # Convert Core Data timestamp to date string
+            unix_ts = cd_timestamp + CORE_DATA_EPOCH_OFFSET
+            posted_at = datetime.fromtimestamp(unix_ts, tz=timezone.utc).strftime("%Y-%m-%d")
+
+            amount = Decimal(amount)
+
+            raw_data = {
+                "saltedge_txn_id": saltedge_txn_id,
+                "description": title,
+                "amount": str(amount),
+                "date": posted_at,
+            }
+            if running_balance is not None:
+                raw_data["running_balance"] = str(Decimal(running_balance))
+            if memo:
+                raw_data["memo"] = memo
+            if source_details and source_details != title:
+                raw_data["source_details"] = source_details
+
+            yield (
+                "first_direct_bankivity",
+                "first_direct",
+                account_ref,
+                f"se_{saltedge_txn_id}",
+                posted_at,
+                amount,
+                "GBP",
+                title,
+                memo or None,
+                False,
+                json.dumps(raw_data),
+            )
+    finally:
+        conn.close()
+
+
+def tally_accounts(rows: Iterable[tuple], stats: Dict[str, list]) -> Iterator[tuple]:
+    """Pass rows through, recording [count, first_date, last_date] per account_ref."""
+    for row in rows:
+        account_ref, posted_at = row[2], row[4]
+        acct = stats.get(account_ref)
+        if acct is None:
+            stats[account_ref] = [1, posted_at, posted_at]
+        else:
+            acct[0] += 1
+            if posted_at < acct[1]:
+                acct[1] = posted_at
+            elif posted_at > acct[2]:
+                acct[2] = posted_at
+        yield row
+
+
+def write_transactions(rows: Iterable[tuple], conn, bulk: bool = False) -> int:
+    """Write raw_transaction rows. Batched, idempotent via ON CONFLICT.
+
+    Consumes `rows` in a single pass and returns the number inserted.
+    Does not commit; the caller commits once for the whole load.
+    """
+    from psycopg2.extras import execute_values
+    from src.ingestion.writer import RAW_TRANSACTION_COLUMNS, copy_raw_transactions
+
     cur = conn.cursor()
 
-    cur.execute("""
-        SELECT
-            a.ZPNAME as account_name,
-            t.ZPDATE as txn_date_cd,
-            t.ZPTITLE as title,
-            li.ZPTRANSACTIONAMOUNT as amount,
-            li.ZPRUNNINGBALANCE as running_balance,
-            li.ZPMEMO as memo,
-            ls.ZPSOURCEIDENTIFIER as saltedge_txn_id,
-            ls.ZPDETAILS as source_details,
-            ls.ZPAMOUNT as source_amount
-        FROM ZTRANSACTION t
-        JOIN ZLINEITEM li ON li.ZPTRANSACTION = t.Z_PK
-        JOIN ZACCOUNT a ON a.Z_PK = li.ZPACCOUNT
-        JOIN ZLINEITEMSOURCE ls ON ls.ZPLINEITEM = li.Z_PK
-            AND ls.ZPSOURCETYPE = 'saltedge'
-        WHERE a.ZPNAME IN ({placeholders})
-        ORDER BY t.ZPDATE DESC
-    """.format(placeholders=",".join("?" for _ in ACCOUNT_MAP)),
-        list(ACCOUNT_MAP.keys()),
+    if bulk:
+        return len(copy_raw_transactions(cur, rows))
+
+    result = execute_values(
+        cur,
+        f"""INSERT INTO raw_transaction ({RAW_TRANSACTION_COLUMNS})
+        VALUES %s
+        ON CONFLICT (institution, account_ref, transaction_ref)
+            WHERE transaction_ref IS NOT NULL
+        DO NOTHING
+        RETURNING id""",
+        rows,
+        template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb)",
+        page_size=1000,
+        fetch=True,
     )
+    return len(result)
 
-    txns = []
-    for row in cur:
-        account_name = row["account_name"]
-        account_ref = ACCOUNT_MAP.get(account_name)
-        if not account_ref:
-            continue
-
-        # Convert Core Data timestamp to date string
-        cd_timestamp = row["txn_date_cd"]
-        unix_ts = cd_timestamp + CORE_DATA_EPOCH_OFFSET
-        posted_at = datetime.fromtimestamp(unix_ts, tz=timezone.utc).strftime("%Y-%m-%d")
-
-        amount = Decimal(str(row["amount"]))
-        saltedge_txn_id = row["saltedge_txn_id"]
-
-        raw_data = {
-            "saltedge_txn_id": saltedge_txn_id,
-            "description": row["title"],
-            "amount": str(amount),
-            "date": posted_at,
-        }
-        if row["running_balance"] is not None:
-            raw_data["running_balance"] = str(Decimal(str(row["running_balance"])))
-        if row["memo"]:
-            raw_data["memo"] = row["memo"]
-        if row["source_details"] and row["source_details"] != row["title"]:
-            raw_data["source_details"] = row["source_details"]
-
-        txns.append({
-            "account_ref": account_ref,
-            "transaction_ref": f"se_{saltedge_txn_id}",
-            "posted_at": posted_at,
-            "amount": amount,
-            "raw_merchant": row["title"],
-            "raw_memo": row["memo"] or None,
-            "raw_data": raw_data,
-        })
-
-    conn.close()
-    return txns
-
-
-def write_transactions(txns: list[dict], conn) -> dict[str, int]:
-    """Write transactions to raw_transaction. Idempotent via ON CONFLICT."""
-    cur = conn.cursor()
-    inserted = 0
 
-    for txn in txns:
-        cur.execute("""
-            INSERT INTO raw_transaction (
-                source, institution, account_ref, transaction_ref,
-                posted_at, amount, currency,
-                raw_merchant, raw_memo, is_dirty, raw_data
-            ) VALUES (
-                'first_direct_bankivity', 'first_direct', %s, %s,
-                %s, %s, 'GBP',
-                %s, %s, false, %s
-            )
-            ON CONFLICT (institution, account_ref, transaction_ref)
-                WHERE transaction_ref IS NOT NULL
-            DO NOTHING
-            RETURNING id
-        """, (
-            txn["account_ref"],
-            txn["transaction_ref"],
-            txn["posted_at"],
-            txn["amount"],
-            txn["raw_merchant"],
-            txn["raw_memo"],
-            json.dumps(txn["raw_data"]),
-        ))
-
-        result = cur.fetchone()
-        if result:
-            inserted += 1
-
-    conn.commit()
-    skipped = len(txns) - inserted
-    return {"inserted": inserted, "skipped": skipped}
+def print_account_summary(stats: Dict[str, list]):
+    total = sum(count for count, _, _ in stats.values())
+    print(f"  Extracted {total} Salt Edge transactions:")
+    for acct, (count, first, last) in sorted(stats.items()):
+        print(f"    {acct}: {count} ({first} to {last})")
 
 
 def main():
@@ -148,6 +170,8 @@ def main():
         description="Load First Direct transactions from Bankivity (Salt Edge)")
     parser.add_argument("bank8", help="Path to .bank8 directory")
     parser.add_argument("--dry-run", action="store_true", help="Parse and report only")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Cold load: stage rows with COPY instead of batched INSERTs")
     args = parser.parse_args()
 
     bank8_path = Path(args.bank8)
@@ -160,26 +184,26 @@ def main():
     print("=== First Direct Bankivity (Salt Edge) Loader ===\n")
     print(f"  Database: {db_path}\n")
 
-    txns = extract_transactions(str(db_path))
-
-    # Group by account for reporting
-    by_account: dict[str, list[dict]] = {}
-    for txn in txns:
-        by_account.setdefault(txn["account_ref"], []).append(txn)
-
-    print(f"  Extracted {len(txns)} Salt Edge transactions:")
-    for acct, acct_txns in sorted(by_account.items()):
-        dates = [t["posted_at"] for t in acct_txns]
-        print(f"    {acct}: {len(acct_txns)} ({min(dates)} to {max(dates)})")
+    stats: Dict[str, list] = {}
+    rows = tally_accounts(iter_transactions(str(db_path)), stats)
 
     if args.dry_run:
+        for _ in rows:
+            pass
+        print_account_summary(stats)
         print("\n  [DRY RUN] No data written.")
         return
 
+    import psycopg2
+    from config.settings import settings
+
     conn = psycopg2.connect(settings.dsn)
     try:
-        result = write_transactions(txns, conn)
-        print(f"\n  Result: {result['inserted']} new, {result['skipped']} duplicates.")
+        inserted = write_transactions(rows, conn, bulk=args.bulk)
+        conn.commit()
+        print_account_summary(stats)
+        skipped = sum(count for count, _, _ in stats.values()) - inserted
+        print(f"\n  Result: {inserted} new, {skipped} duplicates.")
     finally:
         conn.close()
 
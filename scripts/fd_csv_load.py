@@ -11,24 +11,23 @@ Usage:
     python scripts/fd_csv_load.py ~/Downloads/20022026_8897.csv
     python scripts/fd_csv_load.py --dry-run ~/Downloads/*.csv
     python scripts/fd_csv_load.py --account 1234 ~/Downloads/file.csv
+    python scripts/fd_csv_load.py --bulk ~/Downloads/*.csv    # COPY-based cold load
 """
 
 import argparse
 import csv
 import hashlib
-import json
 import re
 import sys
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 from pathlib import Path
 from typing import Dict, List, Optional, Set, Tuple
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-import psycopg2
-
-from config.settings import settings
+# psycopg2, config.settings (pydantic) and the raw writer are imported where
+# first needed, so --dry-run parses without loading them.
 
 # Filename pattern: *_{NNNN}*.csv or *_{NNNN}.csv
 ACCOUNT_RE = re.compile(r"_(\d{4})(?:-\d+)?\.csv$")
@@ -53,9 +52,33 @@ def extract_account_from_filename(filepath: str) -> Optional[str]:
 
 
 def make_hash_ref(date_str: str, amount: str, description: str) -> str:
-    """Generate a stable transaction ref from date + amount + description."""
+    """Generate a stable transaction ref from date + amount + description.
+
+    Must stay SHA-256 based: refs already stored in raw_transaction are the
+    first 16 hex chars of this digest, and ON CONFLICT idempotency relies on
+    reproducing them exactly. Only the 8 bytes we keep are hex-encoded.
+    """
     key = f"{date_str}|{amount}|{description}"
-    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return hashlib.sha256(key.encode("utf-8")).digest()[:8].hex()
+
+
+def parse_fd_date(date_str: str) -> Optional[str]:
+    """Convert DD/MM/YYYY to YYYY-MM-DD, or None if it isn't a valid date.
+
+    Well-formed dates are re-sliced and checked with date.fromisoformat;
+    strptime is only the fallback for unpadded values like 1/2/2024.
+    """
+    if len(date_str) == 10 and date_str[2] == "/" and date_str[5] == "/":
+        iso = f"{date_str[6:10]}-{date_str[3:5]}-{date_str[0:2]}"
+        try:
+            date.fromisoformat(iso)
+            return iso
+        except ValueError:
+            return None
+    try:
+        return datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
 
 
 def parse_fd_csv(filepath: str) -> Tuple[List[dict], str, Optional[str]]:
@@ -83,9 +106,8 @@ def parse_fd_csv(filepath: str) -> Tuple[List[dict], str, Optional[str]]:
                 continue
 
             # Parse date DD/MM/YYYY -> YYYY-MM-DD
-            try:
-                posted_at = datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%d")
-            except ValueError:
+            posted_at = parse_fd_date(date_str)
+            if posted_at is None:
                 continue
 
             amount = Decimal(amount_str)
@@ -123,13 +145,18 @@ def parse_fd_csv(filepath: str) -> Tuple[List[dict], str, Optional[str]]:
     return txns, fmt, account_num
 
 
-def load_csv_files(filepaths: List[str], account_override: Optional[str]) -> Dict[str, List[dict]]:
+def load_csv_files(
+    filepaths: List[str], account_override: Optional[str]
+) -> Tuple[Dict[str, List[dict]], Dict[str, Tuple[str, str]]]:
     """Load and group transactions by account from multiple CSV files.
 
-    Returns {account_ref: [txns]}.
+    Returns ({account_ref: [txns]}, {account_ref: (first_date, last_date)}),
+    the date range being tracked as rows are added.
     """
     by_account: Dict[str, List[dict]] = {}
-    seen: Set[Tuple[str, str]] = set()
+    date_ranges: Dict[str, Tuple[str, str]] = {}
+    # One flat bytes key per (account_ref, transaction_ref) rather than a tuple
+    seen: Set[bytes] = set()
 
     for fp in filepaths:
         txns, fmt, account_num = parse_fd_csv(fp)
@@ -144,9 +171,10 @@ def load_csv_files(filepaths: List[str], account_override: Optional[str]) -> Dic
         if account_ref not in by_account:
             by_account[account_ref] = []
 
+        prefix = account_ref.encode() + b"\0"
         added = 0
         for txn in txns:
-            key = (account_ref, txn["transaction_ref"])
+            key = prefix + txn["transaction_ref"].encode()
             if key in seen:
                 continue
             seen.add(key)
@@ -154,49 +182,90 @@ def load_csv_files(filepaths: List[str], account_override: Optional[str]) -> Dic
             by_account[account_ref].append(txn)
             added += 1
 
+            posted_at = txn["posted_at"]
+            first_last = date_ranges.get(account_ref)
+            if first_last is None:
+                date_ranges[account_ref] = (posted_at, posted_at)
+            elif posted_at < first_last[0]:
+                date_ranges[account_ref] = (posted_at, first_last[1])
+            elif posted_at > first_last[1]:
+                date_ranges[account_ref] = (first_last[0], posted_at)
+
         print(f"  {Path(fp).name} (format {fmt}, account {acct}): "
               f"{len(txns)} rows, {added} unique")
 
-    return by_account
+    return by_account, date_ranges
 
 
-def write_transactions(txns: List[dict], conn) -> Dict[str, int]:
-    """Write parsed FD transactions to raw_transaction. Idempotent."""
+def write_transactions(txns: List[dict], conn, bulk: bool = False) -> Dict[str, int]:
+    """Write parsed FD transactions to raw_transaction. Batched, idempotent.
+
+    Re-runs mostly hit rows that already exist, so the batched path first
+    drops refs already present (one anti-join SELECT) and only inserts the
+    rest; ON CONFLICT still guards against a concurrent writer.
+    Does not commit; the caller commits once for the whole load.
+    """
+    from psycopg2.extras import Json, execute_values
+    from src.ingestion.writer import RAW_TRANSACTION_COLUMNS, copy_raw_transactions
+
     cur = conn.cursor()
-    inserted = 0
 
-    for txn in txns:
+    if not bulk and txns:
         cur.execute("""
-            INSERT INTO raw_transaction (
-                source, institution, account_ref, transaction_ref,
-                posted_at, amount, currency,
-                raw_merchant, raw_memo, is_dirty, raw_data
-            ) VALUES (
-                'first_direct_csv', 'first_direct', %s, %s,
-                %s, %s, 'GBP',
-                %s, %s, false, %s
-            )
-            ON CONFLICT (institution, account_ref, transaction_ref)
-                WHERE transaction_ref IS NOT NULL
-            DO NOTHING
-            RETURNING id
-        """, (
+            SELECT r.account_ref, r.transaction_ref
+            FROM raw_transaction r
+            JOIN unnest(%s::text[], %s::text[]) AS k(account_ref, transaction_ref)
+              ON r.account_ref = k.account_ref
+             AND r.transaction_ref = k.transaction_ref
+            WHERE r.institution = 'first_direct'
+        """, ([t["account_ref"] for t in txns], [t["transaction_ref"] for t in txns]))
+        existing = set(cur.fetchall())
+        new_txns = [t for t in txns if (t["account_ref"], t["transaction_ref"]) not in existing]
+    else:
+        new_txns = txns
+
+    rows = [
+        (
+            "first_direct_csv",
+            "first_direct",
             txn["account_ref"],
             txn["transaction_ref"],
             txn["posted_at"],
             txn["amount"],
+            "GBP",
             txn["raw_merchant"],
             None,
-            json.dumps(txn["raw_data"]),
-        ))
-
-        result = cur.fetchone()
-        if result:
-            inserted += 1
+            False,
+            Json(txn["raw_data"]),
+        )
+        for txn in new_txns
+    ]
+
+    if bulk:
+        result = copy_raw_transactions(cur, rows)
+    elif rows:
+        result = execute_values(
+            cur,
+            f"""INSERT INTO raw_transaction ({RAW_TRANSACTION_COLUMNS})
+            VALUES %s
+            ON CONFLICT (institution, account_ref, transaction_ref)
+                WHERE transaction_ref IS NOT NULL
+            DO NOTHING
+            RETURNING account_ref""",
+            rows,
+            page_size=1000,
+            fetch=True,
+        )
+    else:
+        result = []
+
+    inserted = len(result)
+    inserted_by_account: Dict[str, int] = {}
+    for (account_ref,) in result:
+        inserted_by_account[account_ref] = inserted_by_account.get(account_ref, 0) + 1
 
-    conn.commit()
     skipped = len(txns) - inserted
-    return {"inserted": inserted, "skipped": skipped}
+    return {"inserted": inserted, "skipped": skipped, "inserted_by_account": inserted_by_account}
 
 
 def main():
@@ -204,6 +273,8 @@ def main():
     parser.add_argument("files", nargs="+", help="Path(s) to First Direct CSV files")
     parser.add_argument("--account", help="Override account number (e.g. 5682)")
     parser.add_argument("--dry-run", action="store_true", help="Parse and report only")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Cold load: stage rows with COPY instead of batched INSERTs")
     args = parser.parse_args()
 
     print("=== First Direct CSV Loader ===\n")
@@ -215,31 +286,39 @@ def main():
             sys.exit(1)
 
     # Parse
-    by_account = load_csv_files(args.files, args.account)
+    by_account, date_ranges = load_csv_files(args.files, args.account)
 
     total = sum(len(txns) for txns in by_account.values())
     print(f"\n  Total unique transactions: {total}")
     for acct, txns in sorted(by_account.items()):
-        dates = [t["posted_at"] for t in txns]
-        print(f"    {acct}: {len(txns)} ({min(dates)} to {max(dates)})")
+        if acct in date_ranges:
+            first, last = date_ranges[acct]
+            print(f"    {acct}: {len(txns)} ({first} to {last})")
+        else:
+            print(f"    {acct}: 0")
 
     if args.dry_run:
         print("\n  [DRY RUN] No data written.")
         return
 
     # Write
+    import psycopg2
+    from config.settings import settings
+
     conn = psycopg2.connect(settings.dsn)
     try:
-        total_inserted = 0
-        total_skipped = 0
+        # All accounts in one batched insert (account_ref is part of the
+        # conflict key) and one transaction: a single commit (and WAL flush)
+        all_txns = [t for _, txns in sorted(by_account.items()) for t in txns]
+        result = write_transactions(all_txns, conn, bulk=args.bulk)
+        conn.commit()
+
         for acct, txns in sorted(by_account.items()):
-            result = write_transactions(txns, conn)
-            print(f"\n  {acct}: {result['inserted']} new, {result['skipped']} duplicates.")
-            total_inserted += result["inserted"]
-            total_skipped += result["skipped"]
+            new = result["inserted_by_account"].get(acct, 0)
+            print(f"\n  {acct}: {new} new, {len(txns) - new} duplicates.")
 
         print(f"\n=== Done ===")
-        print(f"Total: {total_inserted} new, {total_skipped} duplicates.")
+        print(f"Total: {result['inserted']} new, {result['skipped']} duplicates.")
     finally:
         conn.close()
 
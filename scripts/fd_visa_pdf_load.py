@@ -26,18 +26,17 @@ import argparse
 import csv
 import hashlib
 import json
+import os
 import re
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from datetime import datetime
 from decimal import Decimal
 from glob import glob
 from pathlib import Path
 from typing import Optional
 
-sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-
 # Card prefix -> account_ref mapping
 CARD_PREFIX_MAP = {
     '4543 6120': 'fd_8178',   # Joint Visa
@@ -130,26 +129,61 @@ CONTINUATION_PATTERNS = [
     re.compile(r"^\s+[\d.]+\s+\w{3}@[\d.]+", re.IGNORECASE),  # FX: "10.35 EUR@1.1923"
 ]
 
+# Each list fused into one alternation so a line is scanned once, not once
+# per pattern. IGNORECASE is safe for all: the case-sensitive patterns above
+# contain no letters. The lists are kept for readability/debugging.
+SKIP_RE = re.compile("|".join(f"(?:{p.pattern})" for p in SKIP_PATTERNS), re.IGNORECASE)
+CONTINUATION_RE = re.compile(
+    "|".join(f"(?:{p.pattern})" for p in CONTINUATION_PATTERNS), re.IGNORECASE,
+)
+
+# Every line that can change parse_pdf's section state. Whitespace is
+# [^\S\n] so a hit on the full text never spans two lines; lines before the
+# first hit can be jumped over without being tokenised.
+SECTION_MARKER_RE = re.compile(
+    r"Ms[^\S\n]+Heather|Rutherford|Your[^\S\n]*Transaction[^\S\n]+Details"
+    r"|Received[^\S\n]*By[^\S\n]*Us|Statement[^\S\n]+Date"
+    r"|Summary[^\S\n]*Of[^\S\n]*Interest",
+    re.IGNORECASE,
+)
+
 
-@dataclass
+@dataclass(slots=True)
 class Transaction:
     received_date: str      # YYYY-MM-DD
     transaction_date: str   # YYYY-MM-DD
     description: str
-    amount: Decimal
+    amount_pence: int       # signed, debits negative
     is_credit: bool = False
     extra_details: list = field(default_factory=list)
     statement_date: str = ""  # YYYY-MM-DD of the statement
+    _position: int = field(default=0, init=False, repr=False)  # set in main()
+
+    @property
+    def amount(self) -> Decimal:
+        """Amount in pounds, always with two decimal places ("-12.30")."""
+        return Decimal(self.amount_pence).scaleb(-2)
 
 
 def parse_short_date(date_str: str, statement_year_hint: Optional[int] = None) -> str:
     """Parse '16 Jan 26' -> '2026-01-16'."""
-    m = DATE_RE.match(date_str.strip())
-    if not m:
-        raise ValueError(f"Cannot parse date: {date_str!r}")
-    day = int(m.group(1))
-    month = MONTH_MAP[m.group(2).lower()]
-    year_raw = int(m.group(3))
+    # Fast path for the clean "DD Mon YY[YY]" form; OCR variants use DATE_RE
+    parts = date_str.split()
+    month = None
+    if (len(parts) == 3 and len(parts[1]) == 3
+            and parts[0].isdecimal() and len(parts[0]) <= 2
+            and parts[2].isdecimal() and 2 <= len(parts[2]) <= 4):
+        month = MONTH_MAP.get(parts[1].lower())
+    if month:
+        day = int(parts[0])
+        year_raw = int(parts[2])
+    else:
+        m = DATE_RE.match(date_str.strip())
+        if not m:
+            raise ValueError(f"Cannot parse date: {date_str!r}")
+        day = int(m.group(1))
+        month = MONTH_MAP[m.group(2).lower()]
+        year_raw = int(m.group(3))
     if year_raw < 100:
         # Two-digit year: 20 -> 2020, 26 -> 2026
         year = 2000 + year_raw
@@ -189,12 +223,73 @@ def extract_statement_date(text: str, filename_year: Optional[int] = None) -> Op
     return None
 
 
+def _is_date_tokens(day: str, month: str, year: str) -> bool:
+    """True if three whitespace-separated tokens form a clean 'DD Mon YY[YY]'."""
+    return (len(day) <= 2 and day.isdecimal()
+            and len(month) == 3 and month.lower() in MONTH_MAP
+            and 2 <= len(year) <= 4 and year.isdecimal())
+
+
+def match_txn_line(line: str) -> Optional[tuple[str, str, str]]:
+    """Split a transaction line into (received, transaction, rest), else None.
+
+    Gives the same groups as TXN_LINE_RE. A transaction line is leading
+    whitespace/'-'/'=' then one or two digits and a month abbreviation, so
+    nearly every other line is rejected on that prefix without touching `re`;
+    clean "DD Mon YY DD Mon YY rest" lines are tokenised directly and only
+    irregular (OCR) layouts use the regex.
+    """
+    s = line.lstrip()
+    while s[:1] in ("-", "="):
+        s = s[1:].lstrip()
+    i = 0
+    while i < 3 and s[i:i + 1].isdecimal():
+        i += 1
+    if not 1 <= i <= 2:
+        return None
+    while s[i:i + 1].isspace() or s[i:i + 1] in (".", ","):
+        i += 1
+    if s[i:i + 3].lower() not in MONTH_MAP:
+        return None
+
+    toks = line.split(None, 6)
+    if (len(toks) == 7 and toks[6][0] not in ".)"
+            and _is_date_tokens(toks[0], toks[1], toks[2])
+            and _is_date_tokens(toks[3], toks[4], toks[5])):
+        return (f"{toks[0]} {toks[1]} {toks[2]}",
+                f"{toks[3]} {toks[4]} {toks[5]}",
+                toks[6])
+
+    m = TXN_LINE_RE.match(line)
+    return m.groups() if m else None
+
+
+def split_amount(rest: str) -> Optional[tuple[str, bool, int]]:
+    """Find the trailing amount in `rest`: (raw_amount, is_credit, start).
+
+    Same result as AMOUNT_RE.search, but the usual "1,234.56[ CR]" ending is
+    found by walking back from the end of the line; only lines that do not
+    end that way are handed to the regex.
+    """
+    end = len(rest.rstrip())
+    is_credit = rest[end - 2:end].lower() == "cr"
+    if is_credit:
+        end = len(rest[:end - 2].rstrip())
+    if (end >= 4 and rest[end - 3] in ".,"
+            and rest[end - 2].isdecimal() and rest[end - 1].isdecimal()):
+        start = end - 3
+        while start and (rest[start - 1].isdecimal() or rest[start - 1] == ","):
+            start -= 1
+        if start < end - 3:
+            return rest[start:end], is_credit, start
+
+    m = AMOUNT_RE.search(rest)
+    return (m.group(1), m.group(2) is not None, m.start()) if m else None
+
+
 def should_skip_line(line: str) -> bool:
     """Check if line is a header/footer/boilerplate to skip."""
-    for pat in SKIP_PATTERNS:
-        if pat.search(line):
-            return True
-    return False
+    return SKIP_RE.search(line) is not None
 
 
 def is_continuation_line(line: str) -> bool:
@@ -203,11 +298,10 @@ def is_continuation_line(line: str) -> bool:
     if not stripped:
         return False
     # Lines that start with spaces and contain no date pattern at the start
-    if line.startswith("   ") and not TXN_LINE_RE.match(line):
+    if line.startswith("   ") and not match_txn_line(line):
         # Could be extra flight details, FX info, etc.
-        for pat in CONTINUATION_PATTERNS:
-            if pat.search(line):
-                return True
+        if CONTINUATION_RE.search(line):
+            return True
         # Generic continuation: indented text that's not a new transaction
         # and doesn't match skip patterns
         if not should_skip_line(line) and len(stripped) > 2:
@@ -230,13 +324,15 @@ def parse_pdf(filepath: str, account_ref_override: str = "") -> tuple[list[Trans
     """
     result = subprocess.run(
         ["pdftotext", "-layout", filepath, "-"],
-        capture_output=True, text=True, timeout=30,
+        capture_output=True, timeout=30,
     )
     if result.returncode != 0:
-        print(f"  ERROR: pdftotext failed for {filepath}: {result.stderr}")
+        stderr = result.stderr.decode("utf-8", "replace")
+        print(f"  ERROR: pdftotext failed for {filepath}: {stderr}")
         return [], ""
 
-    text = result.stdout
+    # pdftotext writes UTF-8; decode the whole capture once
+    text = result.stdout.decode("utf-8", "replace")
 
     # Extract year from filename (e.g. "20130412 First Direct..." -> 2013)
     fname = Path(filepath).name
@@ -253,9 +349,27 @@ def parse_pdf(filepath: str, account_ref_override: str = "") -> tuple[list[Trans
     in_second_cardholder = False
     past_summary = False  # Past the Account Summary header area
 
-    lines = text.split("\n")
+    pos = 0
+    text_len = len(text)
+    while pos <= text_len:
+        # Until a section or statement-date marker is seen, every line is
+        # discarded unread: jump straight to the line holding the next marker
+        if not in_transaction_section and not past_summary:
+            marker = SECTION_MARKER_RE.search(text, pos)
+            if marker is None:
+                break
+            pos = text.rfind("\n", 0, marker.start()) + 1
+
+        end = text.find("\n", pos)
+        if end == -1:
+            end = text_len
+        line = text[pos:end]
+        pos = end + 1
+
+        # Blank lines never change section state and are always skipped
+        if not line or line.isspace():
+            continue
 
-    for i, line in enumerate(lines):
         # Detect second cardholder section
         # For Joint Visa: include second cardholder transactions
         # For Sole Visa: skip second cardholder (if present)
@@ -286,7 +400,7 @@ def parse_pdf(filepath: str, account_ref_override: str = "") -> tuple[list[Trans
         # If not in a detected section, try to auto-detect by matching transaction lines
         if not in_transaction_section and past_summary:
             # Check if this line looks like a transaction (has two dates + amount)
-            if TXN_LINE_RE.match(line) and AMOUNT_RE.search(line):
+            if match_txn_line(line) and split_amount(line):
                 in_transaction_section = True
                 # Fall through to parse this line
 
@@ -301,24 +415,24 @@ def parse_pdf(filepath: str, account_ref_override: str = "") -> tuple[list[Trans
             continue
 
         # Try to match a transaction line
-        txn_match = TXN_LINE_RE.match(line)
+        txn_match = match_txn_line(line)
         if txn_match:
-            received_str = txn_match.group(1).strip()
-            trans_str = txn_match.group(2).strip()
-            rest = txn_match.group(3).strip()
+            received_str, trans_str, rest = (g.strip() for g in txn_match)
 
             # Extract amount from end of rest
-            amount_match = AMOUNT_RE.search(rest)
+            amount_match = split_amount(rest)
             if amount_match:
-                raw_amount = amount_match.group(1)
+                raw_amount, is_credit, amount_start = amount_match
                 # Handle comma as decimal separator (OCR artifact: "806,21")
                 # If last separator before final 2 digits is comma, treat as decimal
                 if raw_amount[-3] == ',':
                     amount_str = raw_amount[:-3].replace(",", "").replace(".", "") + "." + raw_amount[-2:]
                 else:
                     amount_str = raw_amount.replace(",", "")
-                is_credit = amount_match.group(2) is not None
-                description = rest[:amount_match.start()].strip()
+                # Recurring merchants (TfL, Tesco...) share one string object
+                # across statements, so the position-key lookups in main()
+                # compare them by identity
+                description = sys.intern(rest[:amount_start].strip())
 
                 try:
                     received_date = parse_short_date(received_str, stmt_year_hint)
@@ -327,15 +441,16 @@ def parse_pdf(filepath: str, account_ref_override: str = "") -> tuple[list[Trans
                     print(f"  WARNING: {e} in {filepath}")
                     continue
 
-                amount = Decimal(amount_str)
+                # amount_str is always "digits.dd": whole pence as an int
+                amount_pence = int(amount_str.replace(".", ""))
                 if not is_credit:
-                    amount = -amount  # Debits are negative (purchases)
+                    amount_pence = -amount_pence  # Debits are negative (purchases)
 
                 txn = Transaction(
                     received_date=received_date,
                     transaction_date=transaction_date,
                     description=description,
-                    amount=amount,
+                    amount_pence=amount_pence,
                     is_credit=is_credit,
                     statement_date=statement_date,
                 )
@@ -357,12 +472,15 @@ def make_transaction_ref(txn: Transaction, position: int = 0) -> str:
     Includes received_date and positional index to disambiguate
     legitimate same-day same-amount same-merchant transactions
     (e.g. two pints at the pub, multiple TFL journeys).
+
+    Stays SHA-256: loaded rows are keyed on these 16 hex chars, so a
+    different hash would re-insert every statement on the next load.
     """
     key = (
         f"{txn.transaction_date}|{txn.received_date}|"
         f"{txn.amount}|{txn.description}|{position}"
     )
-    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return hashlib.sha256(key.encode("utf-8")).digest()[:8].hex()
 
 
 def write_csv(transactions: list[Transaction], output_path: str):
@@ -371,71 +489,79 @@ def write_csv(transactions: list[Transaction], output_path: str):
         writer = csv.writer(f)
         writer.writerow(["Date", "Description", "Amount", "Reference"])
 
-        for txn in transactions:
-            # Format date as DD/MM/YYYY for consistency with FD CSV format
-            dt = datetime.strptime(txn.transaction_date, "%Y-%m-%d")
-            date_str = dt.strftime("%d/%m/%Y")
-
-            writer.writerow([
-                date_str,
+        # Format date as DD/MM/YYYY for consistency with FD CSV format
+        # (transaction_date is always the YYYY-MM-DD from parse_short_date)
+        writer.writerows(
+            (
+                f"{txn.transaction_date[8:10]}/{txn.transaction_date[5:7]}/{txn.transaction_date[0:4]}",
                 txn.description,
                 str(txn.amount),
-                make_transaction_ref(txn, getattr(txn, '_position', 0)),
-            ])
+                make_transaction_ref(txn, txn._position),
+            )
+            for txn in transactions
+        )
+
+
+def raw_data_for(txn: Transaction) -> dict:
+    """raw_data payload stored alongside a loaded Visa transaction."""
+    raw_data = {
+        "received_date": txn.received_date,
+        "transaction_date": txn.transaction_date,
+        "description": txn.description,
+        "amount": str(txn.amount),
+        "is_credit": txn.is_credit,
+        "statement_date": txn.statement_date,
+    }
+    if txn.extra_details:
+        raw_data["extra_details"] = txn.extra_details
+    return raw_data
+
+
+def build_db_rows(transactions: list[Transaction], account_ref: str) -> list[tuple]:
+    """Build raw_transaction row tuples (JSON and memo pre-serialised)."""
+    return [
+        (
+            account_ref,
+            make_transaction_ref(txn, txn._position),
+            txn.transaction_date,
+            txn.amount,
+            txn.description,
+            "; ".join(txn.extra_details) if txn.extra_details else None,
+            json.dumps(raw_data_for(txn)),
+        )
+        for txn in transactions
+    ]
 
 
 def load_to_db(transactions: list[Transaction], account_ref: str = 'fd_8897'):
     """Load transactions directly into raw_transaction."""
+    # DB-only dependencies: parsing, --dry-run and CSV output never need them
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
     import psycopg2
+    from psycopg2.extras import execute_values
     from config.settings import settings
 
+    # Serialise everything before opening the connection
+    rows = build_db_rows(transactions, account_ref)
+
     conn = psycopg2.connect(settings.dsn)
     cur = conn.cursor()
-    inserted = 0
-    skipped = 0
-
-    for txn in transactions:
-        ref = make_transaction_ref(txn, getattr(txn, '_position', 0))
-        raw_data = {
-            "received_date": txn.received_date,
-            "transaction_date": txn.transaction_date,
-            "description": txn.description,
-            "amount": str(txn.amount),
-            "is_credit": txn.is_credit,
-            "statement_date": txn.statement_date,
-        }
-        if txn.extra_details:
-            raw_data["extra_details"] = txn.extra_details
-
-        cur.execute("""
-            INSERT INTO raw_transaction (
-                source, institution, account_ref, transaction_ref,
-                posted_at, amount, currency,
-                raw_merchant, raw_memo, is_dirty, raw_data
-            ) VALUES (
-                'first_direct_pdf', 'first_direct', %s, %s,
-                %s, %s, 'GBP',
-                %s, %s, false, %s
-            )
-            ON CONFLICT (institution, account_ref, transaction_ref)
-                WHERE transaction_ref IS NOT NULL
-            DO NOTHING
-            RETURNING id
-        """, (
-            account_ref,
-            ref,
-            txn.transaction_date,
-            txn.amount,
-            txn.description,
-            "; ".join(txn.extra_details) if txn.extra_details else None,
-            json.dumps(raw_data),
-        ))
 
-        result = cur.fetchone()
-        if result:
-            inserted += 1
-        else:
-            skipped += 1
+    result = execute_values(cur, """
+        INSERT INTO raw_transaction (
+            source, institution, account_ref, transaction_ref,
+            posted_at, amount, currency,
+            raw_merchant, raw_memo, is_dirty, raw_data
+        ) VALUES %s
+        ON CONFLICT (institution, account_ref, transaction_ref)
+            WHERE transaction_ref IS NOT NULL
+        DO NOTHING
+        RETURNING id
+    """, rows,
+        template="('first_direct_pdf', 'first_direct', %s, %s, %s, %s, 'GBP', %s, %s, false, %s)",
+        page_size=1000, fetch=True)
+    inserted = len(result)
+    skipped = len(rows) - inserted
 
     conn.commit()
     conn.close()
@@ -469,13 +595,15 @@ def main():
     )
     args = parser.parse_args()
 
-    # Expand globs
-    pdf_files = []
+    # Expand globs into one set, so a PDF matched by overlapping patterns is
+    # parsed once (twice would give its lines a second run of positions)
+    matched: set[str] = set()
     for pattern in args.files:
-        expanded = sorted(glob(pattern))
+        expanded = glob(pattern)
         if not expanded:
             print(f"WARNING: No files match {pattern}")
-        pdf_files.extend(expanded)
+        matched.update(expanded)
+    pdf_files = sorted(matched)
 
     if not pdf_files:
         print("ERROR: No PDF files found")
@@ -487,18 +615,29 @@ def main():
     all_transactions: list[Transaction] = []
     account_refs_seen: set[str] = set()
 
-    for filepath in pdf_files:
-        txns, acct_ref = parse_pdf(filepath, args.account_ref or "")
+    # pdftotext runs are independent external processes: extract in parallel,
+    # then report in file order
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        parsed = list(executor.map(
+            lambda fp: parse_pdf(fp, args.account_ref or ""), pdf_files,
+        ))
+
+    for filepath, (txns, acct_ref) in zip(pdf_files, parsed):
         account_refs_seen.add(acct_ref)
         fname = Path(filepath).name
         if txns:
-            dates = [t.transaction_date for t in txns]
-            amounts = sum(t.amount for t in txns)
-            credits = [t for t in txns if t.is_credit]
-            debits = [t for t in txns if not t.is_credit]
+            n_credits = 0
+            first = last = txns[0].transaction_date
+            for t in txns:
+                n_credits += t.is_credit
+                d = t.transaction_date
+                if d < first:
+                    first = d
+                elif d > last:
+                    last = d
             print(f"  {fname}: {len(txns)} txns "
-                  f"({len(debits)} debits, {len(credits)} credits) "
-                  f"[{min(dates)} to {max(dates)}] acct={acct_ref}")
+                  f"({len(txns) - n_credits} debits, {n_credits} credits) "
+                  f"[{first} to {last}] acct={acct_ref}")
         else:
             print(f"  {fname}: 0 txns")
         all_transactions.extend(txns)
@@ -507,23 +646,35 @@ def main():
     all_transactions.sort(key=lambda t: (t.received_date, t.transaction_date))
 
     # Assign positional index within each (txn_date, received_date, amount, description)
-    # group to disambiguate legitimate same-day same-amount same-merchant transactions
-    from collections import Counter
-    position_counter: Counter = Counter()
+    # group to disambiguate legitimate same-day same-amount same-merchant transactions.
+    # Equal keys are not necessarily adjacent after the date sort, so a running
+    # dict is needed. The same pass gathers the summary totals and date range.
+    next_position: dict[tuple, int] = {}
+    total_debits = total_credits = 0  # pence
+    first = last = all_transactions[0].transaction_date if all_transactions else ""
     for txn in all_transactions:
-        key = (txn.transaction_date, txn.received_date, str(txn.amount), txn.description)
-        txn._position = position_counter[key]
-        position_counter[key] += 1
+        # amount_pence identifies the amount exactly as str(txn.amount) did
+        key = (txn.transaction_date, txn.received_date, txn.amount_pence, txn.description)
+        position = next_position.get(key, 0)
+        txn._position = position
+        next_position[key] = position + 1
+
+        if txn.is_credit:
+            total_credits += txn.amount_pence
+        else:
+            total_debits += txn.amount_pence
+        d = txn.transaction_date
+        if d < first:
+            first = d
+        elif d > last:
+            last = d
 
     print(f"\n  Total: {len(all_transactions)} transactions")
 
     if all_transactions:
-        dates = [t.transaction_date for t in all_transactions]
-        total_debits = sum(t.amount for t in all_transactions if not t.is_credit)
-        total_credits = sum(t.amount for t in all_transactions if t.is_credit)
-        print(f"  Date range: {min(dates)} to {max(dates)}")
-        print(f"  Total debits: £{total_debits:,.2f}")
-        print(f"  Total credits: £{total_credits:,.2f} (payments)")
+        print(f"  Date range: {first} to {last}")
+        print(f"  Total debits: £{Decimal(total_debits).scaleb(-2):,.2f}")
+        print(f"  Total credits: £{Decimal(total_credits).scaleb(-2):,.2f} (payments)")
 
     if args.dry_run:
         print(f"\n  [DRY RUN] No output written.")
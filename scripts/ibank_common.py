@@ -0,0 +1,46 @@
+"""Shared pieces of the iBank matching scripts.
+
+ibank_enrich.py and ibank_import_tags.py both pair iBank transactions with
+active API/CSV ones on (institution, account_key, posted_at, amount,
+currency). The SQL that resolves that key and the suppression check are
+defined once here, so the two scripts cannot drift apart.
+"""
+
+# Account key: aliased accounts resolve to their canonical account_ref.
+# Use with ACCOUNT_ALIAS_JOIN_SQL over `raw_transaction rt`.
+ACCOUNT_KEY_SQL = "COALESCE(aa.canonical_ref, rt.account_ref) AS account_key"
+
+ACCOUNT_ALIAS_JOIN_SQL = """LEFT JOIN account_alias aa
+        ON aa.institution = rt.institution
+        AND aa.account_ref = rt.account_ref"""
+
+# True for a raw_transaction rt that lost deduplication (not in active_transaction)
+SUPPRESSED_SQL = """EXISTS (
+            SELECT 1 FROM dedup_group_member dgm
+            WHERE dgm.raw_transaction_id = rt.id AND NOT dgm.is_preferred
+        )"""
+
+# Columns two row sets are joined on (JOIN ... USING) to pair transactions
+MATCH_KEY_COLUMNS = "institution, account_key, posted_at, amount, currency"
+
+
+def iter_rows(conn, name, query, params=None, *, row_type=None, itersize=10000):
+    """Stream a query through a server-side cursor, yielding a row at a time.
+
+    Rows are row_type._make(row) when a NamedTuple type is given (its fields
+    must follow the SELECT order), else dicts keyed by column name. They
+    arrive in itersize batches, so a large result is never held as a full
+    fetchall() list alongside the rows built from it.
+    """
+    with conn.cursor(name=name) as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        if row_type is not None:
+            yield from map(row_type._make, cur)
+            return
+        cols = None
+        for row in cur:
+            if cols is None:
+                # A named cursor only has a description after the first fetch
+                cols = [desc[0] for desc in cur.description]
+            yield dict(zip(cols, row))
@@ -19,83 +19,178 @@ Usage:
 """
 
 import argparse
+import re
 import sys
 from collections import defaultdict
+from datetime import date
+from decimal import Decimal
 from pathlib import Path
+from typing import NamedTuple
+from uuid import UUID
 
 import psycopg2
+from psycopg2.extras import execute_values, register_uuid
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from config.settings import settings
+from scripts.ibank_common import (
+    ACCOUNT_ALIAS_JOIN_SQL, ACCOUNT_KEY_SQL, MATCH_KEY_COLUMNS, iter_rows,
+)
+
+
+# Lower-cased fragments marking an iBank name as an internal/system string
+_BAD_DISPLAY_RE = re.compile("|".join(map(re.escape, [
+    'internal transfer', 'interest from', 'interest to',
+    'monzo-', 'funds from employer', 'received money from',
+    'card transaction of', 'xxxxxx', 'to monzo', 'bevan',
+])))
+
+
+class IBankRow(NamedTuple):
+    """An iBank raw_transaction, in IBANK_ROWS_SQL column order."""
+    id: UUID
+    source: str
+    institution: str
+    account_key: str
+    posted_at: date
+    amount: Decimal
+    currency: str
+    raw_merchant: str | None
+    ibank_category: str | None
+    ibank_note: str | None
+    posted_ord: int  # posted_at.toordinal(), for date-window arithmetic
+    amount_units: int  # amount in 1/10000ths, for hashing in match keys
+
+
+class ApiRow(NamedTuple):
+    """An active API/CSV raw_transaction, in API_ROWS_SQL column order."""
+    id: UUID
+    source: str
+    institution: str
+    account_key: str
+    posted_at: date
+    amount: Decimal
+    currency: str
+    raw_merchant: str | None
+    canonical_merchant_id: UUID
+    cm_name: str
+    cm_current_category: str | None
+    cm_current_display: str | None
+    posted_ord: int
+    amount_units: int
+
+
+# posted_at as a proleptic Gregorian day number, equal to date.toordinal()
+POSTED_ORD_SQL = "(rt.posted_at - DATE '0001-01-01') + 1 AS posted_ord"
+
+# amount is numeric(18,4), so scaling by 10^4 is exact and fits a bigint;
+# ints hash far cheaper than Decimals in the fuzzy-match keys
+AMOUNT_UNITS_SQL = "(rt.amount * 10000)::bigint AS amount_units"
+
+# iBank transactions ({inst_filter} is filled per call)
+IBANK_ROWS_SQL = f"""
+    SELECT
+        rt.id, rt.source, rt.institution,
+        {ACCOUNT_KEY_SQL},
+        rt.posted_at, rt.amount, rt.currency,
+        rt.raw_merchant,
+        rt.raw_data->>'ibank_category' AS ibank_category,
+        rt.raw_data->>'ibank_note' AS ibank_note,
+        {POSTED_ORD_SQL},
+        {AMOUNT_UNITS_SQL}
+    FROM raw_transaction rt
+    {ACCOUNT_ALIAS_JOIN_SQL}
+    WHERE rt.source = 'ibank'
+    {{inst_filter}}
+"""
+
+# Active API/CSV transactions with canonical merchant linkage
+API_ROWS_SQL = f"""
+    SELECT
+        rt.id, rt.source, rt.institution,
+        {ACCOUNT_KEY_SQL},
+        rt.posted_at, rt.amount, rt.currency,
+        rt.raw_merchant,
+        mrm.canonical_merchant_id,
+        cm.name AS cm_name,
+        cm.category_hint AS cm_current_category,
+        cm.display_name AS cm_current_display,
+        {POSTED_ORD_SQL},
+        {AMOUNT_UNITS_SQL}
+    FROM raw_transaction rt
+    {ACCOUNT_ALIAS_JOIN_SQL}
+    JOIN cleaned_transaction ct ON ct.raw_transaction_id = rt.id
+    JOIN merchant_raw_mapping mrm ON mrm.cleaned_merchant = ct.cleaned_merchant
+    JOIN canonical_merchant cm ON cm.id = mrm.canonical_merchant_id
+    WHERE rt.source <> 'ibank'
+      AND rt.id IN (SELECT id FROM active_transaction)
+      AND cm.merged_into_id IS NULL
+    {{inst_filter}}
+"""
 
 
 def find_all_transactions(conn, *, institution=None):
     """Load all iBank and active API/CSV transactions with resolved account keys.
 
-    Returns (ibank_rows, api_rows) where each row is a dict.
+    Returns (ibank_rows, api_rows) as lists of IBankRow / ApiRow.
+    """
+    inst_filter = "AND rt.institution = %(inst)s" if institution else ""
+    params = {"inst": institution} if institution else {}
+
+    ibank_rows = list(iter_rows(
+        conn, "ibank_rows",
+        IBANK_ROWS_SQL.format(inst_filter=inst_filter),
+        params, row_type=IBankRow))
+    api_rows = list(iter_rows(
+        conn, "api_rows",
+        API_ROWS_SQL.format(inst_filter=inst_filter),
+        params, row_type=ApiRow))
+
+    return ibank_rows, api_rows
+
+
+def find_exact_matches(conn, *, institution=None):
+    """Find 1:1 exact (account, date, amount, currency) matches in one query.
+
+    Joins the same row sets find_all_transactions loads; a pair is kept
+    when its key is held by exactly one row on each side. Removing such a
+    pair never makes another key 1:1, so a single join gives everything
+    repeated passes would.
+
+    Returns {ibank_id: api_id}.
     """
     cur = conn.cursor()
 
     inst_filter = "AND rt.institution = %(inst)s" if institution else ""
 
-    # iBank transactions
     cur.execute(f"""
-        SELECT
-            rt.id, rt.source, rt.institution,
-            COALESCE(aa.canonical_ref, rt.account_ref) AS account_key,
-            rt.posted_at, rt.amount, rt.currency,
-            rt.raw_merchant,
-            rt.raw_data->>'ibank_category' AS ibank_category,
-            rt.raw_data->>'ibank_note' AS ibank_note
-        FROM raw_transaction rt
-        LEFT JOIN account_alias aa
-            ON aa.institution = rt.institution
-            AND aa.account_ref = rt.account_ref
-        WHERE rt.source = 'ibank'
-        {inst_filter}
+        WITH ibank AS ({IBANK_ROWS_SQL.format(inst_filter=inst_filter)}),
+        api AS ({API_ROWS_SQL.format(inst_filter=inst_filter)}),
+        pairs AS (
+            SELECT i.id AS ibank_id, a.id AS api_id,
+                   COUNT(*) OVER (PARTITION BY i.id) AS api_count,
+                   COUNT(*) OVER (PARTITION BY a.id) AS ibank_count
+            FROM ibank i
+            JOIN api a USING ({MATCH_KEY_COLUMNS})
+        )
+        SELECT ibank_id, api_id
+        FROM pairs
+        WHERE api_count = 1 AND ibank_count = 1
     """, {"inst": institution} if institution else {})
-    ibank_cols = [desc[0] for desc in cur.description]
-    ibank_rows = [dict(zip(ibank_cols, row)) for row in cur.fetchall()]
-
-    # Active API/CSV transactions with canonical merchant linkage
-    cur.execute(f"""
-        SELECT
-            rt.id, rt.source, rt.institution,
-            COALESCE(aa.canonical_ref, rt.account_ref) AS account_key,
-            rt.posted_at, rt.amount, rt.currency,
-            rt.raw_merchant,
-            mrm.canonical_merchant_id,
-            cm.name AS cm_name,
-            cm.category_hint AS cm_current_category,
-            cm.display_name AS cm_current_display
-        FROM raw_transaction rt
-        LEFT JOIN account_alias aa
-            ON aa.institution = rt.institution
-            AND aa.account_ref = rt.account_ref
-        JOIN cleaned_transaction ct ON ct.raw_transaction_id = rt.id
-        JOIN merchant_raw_mapping mrm ON mrm.cleaned_merchant = ct.cleaned_merchant
-        JOIN canonical_merchant cm ON cm.id = mrm.canonical_merchant_id
-        WHERE rt.source <> 'ibank'
-          AND rt.id IN (SELECT id FROM active_transaction)
-          AND cm.merged_into_id IS NULL
-        {inst_filter}
-    """, {"inst": institution} if institution else {})
-    api_cols = [desc[0] for desc in cur.description]
-    api_rows = [dict(zip(api_cols, row)) for row in cur.fetchall()]
-
-    return ibank_rows, api_rows
+    return dict(cur.fetchall())
 
 
-def match_transactions(ibank_rows, api_rows):
+def match_transactions(ibank_rows, api_rows, exact_matches):
     """Match iBank to API/CSV transactions by (account, date, amount, currency).
 
     Strategy:
-      1. Exact date: progressive 1:1 matching on (account, date, amount, currency)
+      1. Exact date: 1:1 matching on (account, date, amount, currency),
+         already done server-side by find_exact_matches ({ibank_id: api_id})
       2. Fuzzy date ±1 day: handles transaction vs posted date offsets (FD, Wise)
       3. Fuzzy date ±3 days: handles wider offsets (Monzo created vs settled)
 
-    Each stage runs progressive passes — match, remove, repeat until stable.
+    Each fuzzy stage runs progressive passes — match, remove, repeat until stable.
 
     Returns (matches, unmatched_ibank, unmatched_api) where:
       - matches: list of (ibank_row, api_row) tuples
@@ -106,96 +201,68 @@ def match_transactions(ibank_rows, api_rows):
     matched_api_ids = set()
     all_matches = []
 
-    def _run_exact_passes():
-        """Progressive 1:1 matching on exact (account, date, amount, currency)."""
-        def _make_key(row):
-            return (row['institution'], row['account_key'], row['posted_at'],
-                    row['amount'], row['currency'])
-
-        total = 0
-        pass_num = 0
-        while True:
-            pass_num += 1
-
-            ibank_by_key = defaultdict(list)
-            for r in ibank_rows:
-                if r['id'] not in matched_ibank_ids:
-                    ibank_by_key[_make_key(r)].append(r)
-
-            api_by_key = defaultdict(list)
-            for r in api_rows:
-                if r['id'] not in matched_api_ids:
-                    api_by_key[_make_key(r)].append(r)
-
-            new_matches = 0
-            for key, ib_list in ibank_by_key.items():
-                ap_list = api_by_key.get(key, [])
-                if len(ib_list) == 1 and len(ap_list) == 1:
-                    all_matches.append((ib_list[0], ap_list[0]))
-                    matched_ibank_ids.add(ib_list[0]['id'])
-                    matched_api_ids.add(ap_list[0]['id'])
-                    new_matches += 1
-
-            total += new_matches
-            if new_matches == 0:
-                break
-
-        return total
-
     def _run_fuzzy_date_passes(day_tolerance=1):
         """Progressive 1:1 matching with +/- day_tolerance on date.
 
         For each unmatched API/CSV transaction, look for iBank transactions
         with same (account, amount, currency) within +/- day_tolerance days.
         Only match if exactly one candidate on each side.
+
+        Both sides are bucketed by (account, amount, currency), so each
+        candidate check scans one small bucket rather than every row.
         """
-        from datetime import timedelta
+        nonlocal ibank_pending, api_pending
+        ib_matched = matched_ibank_ids.__contains__
+        ap_matched = matched_api_ids.__contains__
 
         total = 0
         pass_num = 0
         while True:
             pass_num += 1
 
-            # Index unmatched iBank by (account, amount, currency) -> list of (date, row)
+            # Drop rows matched so far, so each pass only walks the remainder
+            ibank_pending = [p for p in ibank_pending if not ib_matched(p[0].id)]
+            api_pending = [p for p in api_pending if not ap_matched(p[0].id)]
+            if not ibank_pending or not api_pending:
+                break
+
+            # Index unmatched rows by (account, amount, currency)
             ibank_by_amt = defaultdict(list)
-            for r in ibank_rows:
-                if r['id'] not in matched_ibank_ids:
-                    key = (r['institution'], r['account_key'], r['amount'], r['currency'])
-                    ibank_by_amt[key].append(r)
+            for r, key in ibank_pending:
+                ibank_by_amt[key].append(r)
+
+            api_by_amt = defaultdict(list)
+            for r, key in api_pending:
+                api_by_amt[key].append(r)
 
             new_matches = 0
             # For each unmatched API txn, find iBank candidates within date window
-            for ap in api_rows:
-                if ap['id'] in matched_api_ids:
+            for ap, key in api_pending:
+                if ap_matched(ap.id):
                     continue
-                key = (ap['institution'], ap['account_key'], ap['amount'], ap['currency'])
-                ib_candidates = ibank_by_amt.get(key, [])
+                ib_candidates = ibank_by_amt.get(key)
                 if not ib_candidates:
                     continue
 
                 # Filter to those within date tolerance
                 nearby = [
                     ib for ib in ib_candidates
-                    if abs((ib['posted_at'] - ap['posted_at']).days) <= day_tolerance
-                    and ib['id'] not in matched_ibank_ids
+                    if abs(ib.posted_ord - ap.posted_ord) <= day_tolerance
+                    and not ib_matched(ib.id)
                 ]
                 if len(nearby) == 1:
                     # Also check: is this the only unmatched API txn that would
                     # match this iBank txn? (1:1 requirement from the iBank side)
                     ib = nearby[0]
                     api_candidates_for_ib = [
-                        a for a in api_rows
-                        if a['id'] not in matched_api_ids
-                        and a['institution'] == ib['institution']
-                        and a['account_key'] == ib['account_key']
-                        and a['amount'] == ib['amount']
-                        and a['currency'] == ib['currency']
-                        and abs((a['posted_at'] - ib['posted_at']).days) <= day_tolerance
+                        a for a in api_by_amt[key]
+                        if not ap_matched(a.id)
+                        and abs(a.posted_ord - ib.posted_ord) <= day_tolerance
                     ]
                     if len(api_candidates_for_ib) == 1:
                         all_matches.append((ib, ap))
-                        matched_ibank_ids.add(ib['id'])
-                        matched_api_ids.add(ap['id'])
+                        matched_ibank_ids.add(ib.id)
+                        matched_api_ids.add(ap.id)
                         new_matches += 1
 
             total += new_matches
@@ -204,8 +271,22 @@ def match_transactions(ibank_rows, api_rows):
 
         return total
 
-    # Stage 1: Exact date matching
-    exact_count = _run_exact_passes()
+    # (row, (account, amount, currency)) still awaiting a match; keys are
+    # built once and the lists shrink as the fuzzy passes match rows
+    ibank_pending = [(r, (r.institution, r.account_key, r.amount_units, r.currency))
+                     for r in ibank_rows]
+    api_pending = [(r, (r.institution, r.account_key, r.amount_units, r.currency))
+                   for r in api_rows]
+
+    # Stage 1: Exact date matching (pairs from the DB, in iBank load order)
+    api_by_id = {r.id: r for r in api_rows}
+    for ib in ibank_rows:
+        api_id = exact_matches.get(ib.id)
+        if api_id is not None:
+            all_matches.append((ib, api_by_id[api_id]))
+            matched_ibank_ids.add(ib.id)
+            matched_api_ids.add(api_id)
+    exact_count = len(all_matches)
     print(f"    Exact date: {exact_count} matches")
 
     # Stage 2: Fuzzy date matching (+/- 1 day) on remainder
@@ -218,8 +299,8 @@ def match_transactions(ibank_rows, api_rows):
 
     print(f"    Total: {exact_count + fuzzy1_count + fuzzy3_count} matches")
 
-    unmatched_ibank = [r for r in ibank_rows if r['id'] not in matched_ibank_ids]
-    unmatched_api = [r for r in api_rows if r['id'] not in matched_api_ids]
+    unmatched_ibank = [r for r in ibank_rows if r.id not in matched_ibank_ids]
+    unmatched_api = [r for r in api_rows if r.id not in matched_api_ids]
 
     return all_matches, unmatched_ibank, unmatched_api
 
@@ -231,17 +312,13 @@ def _is_better_display_name(ibank_name, current_name, current_display):
 
     existing = current_display or current_name
     ibank_stripped = ibank_name.strip()
+    lower = ibank_stripped.lower()
 
-    if ibank_stripped.lower() == existing.lower():
+    if lower == existing.lower():
         return False
 
     # Reject iBank names that look like internal/system strings
-    lower = ibank_stripped.lower()
-    if any(s in lower for s in [
-        'internal transfer', 'interest from', 'interest to',
-        'monzo-', 'funds from employer', 'received money from',
-        'card transaction of', 'xxxxxx', 'to monzo', 'bevan',
-    ]):
+    if _BAD_DISPLAY_RE.search(lower):
         return False
 
     # Reject if iBank name is longer (we want simpler names)
@@ -263,11 +340,11 @@ def run_enrichment(conn, *, dry_run=False, institution=None):
     """)
     scm = {}
     for source_cat, cat_id, conf in cur.fetchall():
-        scm[source_cat] = (str(cat_id), float(conf))
+        scm[source_cat] = (cat_id, float(conf))
 
     # Load category paths for display
     cur.execute("SELECT id, full_path FROM category")
-    cat_paths = {str(r[0]): r[1] for r in cur.fetchall()}
+    cat_paths = dict(cur.fetchall())
 
     # Load and match transactions
     print("  Loading transactions...")
@@ -275,20 +352,22 @@ def run_enrichment(conn, *, dry_run=False, institution=None):
     print(f"  iBank: {len(ibank_rows)}, API/CSV: {len(api_rows)}")
 
     print("  Matching...")
-    matches, unmatched_ibank, unmatched_api = match_transactions(ibank_rows, api_rows)
+    exact_matches = find_exact_matches(conn, institution=institution)
+    matches, unmatched_ibank, unmatched_api = match_transactions(
+        ibank_rows, api_rows, exact_matches)
     print(f"  Matched: {len(matches)}, Unmatched iBank: {len(unmatched_ibank)}, Unmatched API/CSV: {len(unmatched_api)}")
 
     # --- Reconciliation summary by account ---
     print("\n  Reconciliation by account:")
     acct_stats = defaultdict(lambda: {"matched": 0, "unmatched_ibank": 0, "unmatched_api": 0})
     for ib, ap in matches:
-        key = f"{ib['institution']}/{ib['account_key']}"
+        key = f"{ib.institution}/{ib.account_key}"
         acct_stats[key]["matched"] += 1
     for r in unmatched_ibank:
-        key = f"{r['institution']}/{r['account_key']}"
+        key = f"{r.institution}/{r.account_key}"
         acct_stats[key]["unmatched_ibank"] += 1
     for r in unmatched_api:
-        key = f"{r['institution']}/{r['account_key']}"
+        key = f"{r.institution}/{r.account_key}"
         acct_stats[key]["unmatched_api"] += 1
 
     print(f"    {'Account':<40} {'Matched':>8} {'Unm.iBank':>10} {'Unm.API':>10}")
@@ -300,63 +379,67 @@ def run_enrichment(conn, *, dry_run=False, institution=None):
     # --- Merchant enrichment ---
     print("\n  Enriching canonical merchants...")
 
-    # Group matches by canonical_merchant_id
+    # Group matched iBank rows by canonical_merchant_id; the merchant's own
+    # columns are the same on every API row that links to it
     by_merchant = defaultdict(list)
+    merchant_rows = {}
     for ib, ap in matches:
-        cm_id = str(ap['canonical_merchant_id'])
-        by_merchant[cm_id].append({
-            **ib,
-            'cm_name': ap['cm_name'],
-            'cm_current_category': ap['cm_current_category'],
-            'cm_current_display': ap['cm_current_display'],
-        })
+        cm_id = ap.canonical_merchant_id
+        by_merchant[cm_id].append(ib)
+        merchant_rows.setdefault(cm_id, ap)
 
     print(f"  Covering {len(by_merchant)} distinct canonical merchants")
 
+    # iBank category -> (category_id, primary category) when its primary
+    # (first " | " part) is mapped, else None; split once per distinct string
+    ibank_cat_hits = {}
+    for ib, _ in matches:
+        ibank_cat = ib.ibank_category
+        if ibank_cat and ibank_cat not in ibank_cat_hits:
+            primary_cat = ibank_cat.split(' | ', 1)[0].strip()
+            ibank_cat_hits[ibank_cat] = (
+                (scm[primary_cat][0], primary_cat) if primary_cat in scm else None
+            )
+
     categories_set = 0
     display_names_set = 0
     skipped_has_category = 0
     skipped_no_ibank_cat = 0
     skipped_unmapped_cat = 0
-
-    for cm_id, match_list in sorted(by_merchant.items(), key=lambda x: x[1][0]['cm_name']):
-        first = match_list[0]
-        cm_name = first['cm_name']
-        has_category = first['cm_current_category'] is not None
-        has_display = first['cm_current_display'] is not None
+    # (value, canonical_merchant_id), written in one statement each below
+    category_updates = []
+    display_updates = []
+
+    # Name order only matters for the dry-run listing; the batched writes
+    # below don't depend on it
+    merchant_items = by_merchant.items()
+    if dry_run:
+        merchant_items = sorted(merchant_items,
+                                key=lambda x: merchant_rows[x[0]].cm_name)
+
+    for cm_id, match_list in merchant_items:
+        merchant = merchant_rows[cm_id]
+        cm_name = merchant.cm_name
+        has_category = merchant.cm_current_category is not None
+        has_display = merchant.cm_current_display is not None
 
         # --- Category enrichment ---
         if has_category:
             skipped_has_category += 1
         else:
-            # Find the best iBank category from all matches for this merchant
-            best_cat_path = None
-            best_cat_id = None
-            for m in match_list:
-                ibank_cat = m['ibank_category']
-                if not ibank_cat:
-                    continue
-                primary_cat = ibank_cat.split(' | ')[0].strip()
-                if primary_cat in scm:
-                    cat_id, _ = scm[primary_cat]
-                    best_cat_id = cat_id
-                    best_cat_path = cat_paths.get(cat_id, primary_cat)
-                    break  # take first valid match
-
-            if best_cat_id:
+            # Take the first mapped iBank category among this merchant's matches
+            best = next((hit for m in match_list
+                         if m.ibank_category and (hit := ibank_cat_hits[m.ibank_category])),
+                        None)
+
+            if best:
+                best_cat_id, primary_cat = best
+                best_cat_path = cat_paths.get(best_cat_id, primary_cat)
                 if dry_run:
                     print(f"    [category] {cm_name:<45} -> {best_cat_path}")
                 else:
-                    cur.execute("""
-                        UPDATE canonical_merchant
-                        SET category_hint = %s,
-                            category_method = 'ibank_enrichment',
-                            category_confidence = 0.90,
-                            category_set_at = now()
-                        WHERE id = %s AND category_hint IS NULL
-                    """, (best_cat_path, cm_id))
-                    categories_set += cur.rowcount
-            elif any(m['ibank_category'] for m in match_list):
+                    category_updates.append((best_cat_path, cm_id))
+            elif any(m.ibank_category for m in match_list):
                 skipped_unmapped_cat += 1
             else:
                 skipped_no_ibank_cat += 1
@@ -364,60 +447,91 @@ def run_enrichment(conn, *, dry_run=False, institution=None):
         # --- Display name enrichment ---
         if not has_display:
             for m in match_list:
-                if _is_better_display_name(m['raw_merchant'], cm_name, first['cm_current_display']):
+                if _is_better_display_name(m.raw_merchant, cm_name, merchant.cm_current_display):
                     if dry_run:
-                        print(f"    [display]  {cm_name:<45} -> {m['raw_merchant']}")
+                        print(f"    [display]  {cm_name:<45} -> {m.raw_merchant}")
                     else:
-                        cur.execute(
-                            "UPDATE canonical_merchant SET display_name = %s WHERE id = %s AND display_name IS NULL",
-                            (m['raw_merchant'], cm_id),
-                        )
-                        display_names_set += cur.rowcount
+                        display_updates.append((m.raw_merchant, cm_id))
                     break
 
+    if category_updates:
+        result = execute_values(cur, """
+            UPDATE canonical_merchant cm
+            SET category_hint = v.category_hint,
+                category_method = 'ibank_enrichment',
+                category_confidence = 0.90,
+                category_set_at = now()
+            FROM (VALUES %s) AS v (category_hint, id)
+            WHERE cm.id = v.id AND cm.category_hint IS NULL
+            RETURNING cm.id
+        """, category_updates, template="(%s, %s::uuid)", page_size=1000, fetch=True)
+        categories_set = len(result)
+
+    if display_updates:
+        result = execute_values(cur, """
+            UPDATE canonical_merchant cm
+            SET display_name = v.display_name
+            FROM (VALUES %s) AS v (display_name, id)
+            WHERE cm.id = v.id AND cm.display_name IS NULL
+            RETURNING cm.id
+        """, display_updates, template="(%s, %s::uuid)", page_size=1000, fetch=True)
+        display_names_set = len(result)
+
     # --- Note transfer ---
     print("\n  Transferring iBank notes...")
 
-    # Find which API/CSV transactions already have notes
-    cur.execute("SELECT raw_transaction_id FROM transaction_note")
-    existing_notes = {str(r[0]) for r in cur.fetchall()}
-
     notes_set = 0
     notes_skipped_exists = 0
     notes_skipped_empty = 0
     notes_skipped_echo = 0
+    # (raw_transaction_id, note), with the iBank row each came from
+    note_inserts = []
+    note_sources = []
 
     for ib, ap in matches:
-        api_id = str(ap['id'])
-        ibank_note = (ib.get('ibank_note') or '').strip()
+        ibank_note = (ib.ibank_note or '').strip()
 
         if not ibank_note:
             notes_skipped_empty += 1
             continue
 
-        if api_id in existing_notes:
-            notes_skipped_exists += 1
-            continue
-
         # Skip notes that are just the merchant name echoed
-        ibank_merchant = (ib.get('raw_merchant') or '').strip()
+        ibank_merchant = (ib.raw_merchant or '').strip()
         if ibank_note.lower() == ibank_merchant.lower():
             notes_skipped_echo += 1
             continue
 
-        if dry_run:
+        note_inserts.append((ap.id, ibank_note))
+        note_sources.append(ib)
+
+    if dry_run:
+        # Only the candidates are looked up, not every existing note
+        existing_notes = set()
+        if note_inserts:
+            cur.execute(
+                "SELECT raw_transaction_id FROM transaction_note"
+                " WHERE raw_transaction_id = ANY(%s::uuid[])",
+                ([api_id for api_id, _ in note_inserts],),
+            )
+            existing_notes = {r[0] for r in cur.fetchall()}
+
+        for (api_id, ibank_note), ib in zip(note_inserts, note_sources):
+            if api_id in existing_notes:
+                notes_skipped_exists += 1
+                continue
             if notes_set < 20:
-                print(f"    [note] {ib['posted_at']} {ib['amount']:>10} {ibank_note[:60]}")
-        else:
-            cur.execute("""
-                INSERT INTO transaction_note (raw_transaction_id, note, source)
-                VALUES (%s, %s, 'ibank_import')
-                ON CONFLICT (raw_transaction_id) DO NOTHING
-            """, (api_id, ibank_note))
-            notes_set += cur.rowcount
-
-        if dry_run:
+                print(f"    [note] {ib.posted_at} {ib.amount:>10} {ibank_note[:60]}")
             notes_set += 1
+    elif note_inserts:
+        # ON CONFLICT skips transactions that already have a note
+        result = execute_values(cur, """
+            INSERT INTO transaction_note (raw_transaction_id, note, source)
+            VALUES %s
+            ON CONFLICT (raw_transaction_id) DO NOTHING
+            RETURNING raw_transaction_id
+        """, note_inserts, template="(%s, %s, 'ibank_import')", page_size=1000, fetch=True)
+        notes_set = len(result)
+        notes_skipped_exists = len(note_inserts) - notes_set
 
     if not dry_run:
         conn.commit()
@@ -456,6 +570,9 @@ def main():
     print("=== iBank Enrichment ===\n")
 
     conn = psycopg2.connect(settings.dsn)
+    # UUID columns arrive as uuid.UUID; the SQL casts ids itself, so
+    # run_enrichment() works on connections without this too
+    register_uuid(conn_or_curs=conn)
     try:
         run_enrichment(conn, dry_run=args.dry_run, institution=args.institution)
     finally:
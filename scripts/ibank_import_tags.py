@@ -15,187 +15,205 @@ Usage:
 """
 
 import argparse
+import csv
+import io
 import sqlite3
 import sys
-from collections import defaultdict
 from pathlib import Path
 
 import psycopg2
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 from config.settings import settings
+from scripts.ibank_common import (
+    ACCOUNT_ALIAS_JOIN_SQL, ACCOUNT_KEY_SQL, MATCH_KEY_COLUMNS, SUPPRESSED_SQL,
+)
 
 IBANK_DB = "/Users/stu/Documents/01 Filing/01 Finance/11 iBank/iBank-Mac.bank8/StoreContent/core.sql"
 
 
 def extract_tags_from_ibank():
-    """Extract (line_item_uid, tag_name) pairs from iBank SQLite.
+    """Stream (line_item_uid, tag_name) pairs from iBank SQLite.
 
     Tags sit on line items (ZLINEITEM) via the Z_19PTAGS junction table.
     Most tags are on category-side line items (account class 6000/7000),
     so we join through ZPTRANSACTION to reach the bank-side line item.
     """
     ib = sqlite3.connect(IBANK_DB)
-    cur = ib.cursor()
+    try:
+        cur = ib.cursor()
+        cur.execute("""
+            -- Tags via category line items -> bank line items
+            SELECT DISTINCT bank_li.ZPUNIQUEID, tag.ZPNAME
+            FROM Z_19PTAGS jt
+            JOIN ZLINEITEM cat_li ON cat_li.Z_PK = jt.Z_19PLINEITEMS
+            JOIN ZACCOUNT cat_a ON cat_a.Z_PK = cat_li.ZPACCOUNT
+            JOIN ZLINEITEM bank_li ON bank_li.ZPTRANSACTION = cat_li.ZPTRANSACTION
+            JOIN ZACCOUNT bank_a ON bank_a.Z_PK = bank_li.ZPACCOUNT
+            JOIN ZTAG tag ON tag.Z_PK = jt.Z_47PTAGS
+            WHERE cat_a.ZPACCOUNTCLASS IN (6000, 7000)
+              AND bank_a.ZPACCOUNTCLASS NOT IN (6000, 7000)
+
+            UNION
+
+            -- Tags directly on bank line items
+            SELECT DISTINCT li.ZPUNIQUEID, tag.ZPNAME
+            FROM Z_19PTAGS jt
+            JOIN ZLINEITEM li ON li.Z_PK = jt.Z_19PLINEITEMS
+            JOIN ZACCOUNT a ON a.Z_PK = li.ZPACCOUNT
+            JOIN ZTAG tag ON tag.Z_PK = jt.Z_47PTAGS
+            WHERE a.ZPACCOUNTCLASS NOT IN (6000, 7000)
+        """)
+        yield from cur
+    finally:
+        ib.close()
 
-    cur.execute("""
-        -- Tags via category line items -> bank line items
-        SELECT DISTINCT bank_li.ZPUNIQUEID, tag.ZPNAME
-        FROM Z_19PTAGS jt
-        JOIN ZLINEITEM cat_li ON cat_li.Z_PK = jt.Z_19PLINEITEMS
-        JOIN ZACCOUNT cat_a ON cat_a.Z_PK = cat_li.ZPACCOUNT
-        JOIN ZLINEITEM bank_li ON bank_li.ZPTRANSACTION = cat_li.ZPTRANSACTION
-        JOIN ZACCOUNT bank_a ON bank_a.Z_PK = bank_li.ZPACCOUNT
-        JOIN ZTAG tag ON tag.Z_PK = jt.Z_47PTAGS
-        WHERE cat_a.ZPACCOUNTCLASS IN (6000, 7000)
-          AND bank_a.ZPACCOUNTCLASS NOT IN (6000, 7000)
-
-        UNION
-
-        -- Tags directly on bank line items
-        SELECT DISTINCT li.ZPUNIQUEID, tag.ZPNAME
-        FROM Z_19PTAGS jt
-        JOIN ZLINEITEM li ON li.Z_PK = jt.Z_19PLINEITEMS
-        JOIN ZACCOUNT a ON a.Z_PK = li.ZPACCOUNT
-        JOIN ZTAG tag ON tag.Z_PK = jt.Z_47PTAGS
-        WHERE a.ZPACCOUNTCLASS NOT IN (6000, 7000)
-    """)
-    rows = cur.fetchall()
-    ib.close()
-    return rows  # list of (line_item_uid, tag_name)
+
+def stage_ibank_tags(pg_conn, ibank_tags):
+    """COPY (line_item_uid, tag_name) pairs into the ibank_tag_stage temp table.
+
+    The table lives for the session, so both phases join against it
+    server-side instead of mapping and inserting row by row in Python.
+    ibank_tags is consumed in one pass. Returns (associations, unique tags).
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    total = 0
+    tag_names = set()
+    for row in ibank_tags:
+        writer.writerow([r"\N" if v is None else v for v in row])
+        total += 1
+        tag_names.add(row[1])
+    buf.seek(0)
+
+    cur = pg_conn.cursor()
+    cur.execute("CREATE TEMP TABLE ibank_tag_stage (li_uid text, tag text)")
+    cur.copy_expert(
+        r"COPY ibank_tag_stage (li_uid, tag) FROM STDIN WITH (FORMAT csv, NULL '\N')",
+        buf,
+    )
+    return total, len(tag_names)
 
 
-def phase1_direct_import(pg_conn, ibank_tags, dry_run=False):
-    """Map iBank line item UIDs to raw_transaction.transaction_ref and insert tags."""
+def phase1_direct_import(pg_conn, dry_run=False):
+    """Map iBank line item UIDs to raw_transaction.transaction_ref and insert tags.
+
+    The mapped (raw_transaction_id, tag) pairs are kept in the ibank_tag_map
+    temp table for phase 2. Returns the number of tagged transactions.
+    """
     cur = pg_conn.cursor()
 
-    # Build lookup: transaction_ref -> raw_transaction.id for iBank source
+    # Group tags by raw_transaction_id (iBank source only)
     cur.execute("""
-        SELECT transaction_ref, id
-        FROM raw_transaction
-        WHERE source = 'ibank' AND transaction_ref IS NOT NULL
+        CREATE TEMP TABLE ibank_tag_map AS
+        SELECT DISTINCT rt.id AS raw_transaction_id, s.tag
+        FROM ibank_tag_stage s
+        JOIN raw_transaction rt
+            ON rt.transaction_ref = s.li_uid
+            AND rt.source = 'ibank'
     """)
-    ref_to_id = {r[0]: r[1] for r in cur.fetchall()}
-
-    # Group tags by raw_transaction_id
-    tags_by_txn = defaultdict(set)
-    unmatched = 0
-    for li_uid, tag_name in ibank_tags:
-        rt_id = ref_to_id.get(li_uid)
-        if rt_id:
-            tags_by_txn[rt_id].add(tag_name)
-        else:
-            unmatched += 1
+    cur.execute("""
+        SELECT
+            (SELECT count(*) FROM ibank_tag_map),
+            (SELECT count(DISTINCT raw_transaction_id) FROM ibank_tag_map),
+            (SELECT count(*) FROM ibank_tag_stage s
+             WHERE NOT EXISTS (
+                 SELECT 1 FROM raw_transaction rt
+                 WHERE rt.transaction_ref = s.li_uid AND rt.source = 'ibank'
+             ))
+    """)
+    total_associations, tagged_txns, unmatched = cur.fetchone()
 
-    total_associations = sum(len(tags) for tags in tags_by_txn.values())
-    print(f"  Matched: {total_associations} tag associations across {len(tags_by_txn)} transactions")
+    print(f"  Matched: {total_associations} tag associations across {tagged_txns} transactions")
     if unmatched:
         print(f"  Unmatched line item UIDs: {unmatched}")
 
     if dry_run:
-        return tags_by_txn
+        return tagged_txns
 
     # Insert tags
-    inserted = 0
-    for rt_id, tags in tags_by_txn.items():
-        for tag in tags:
-            cur.execute("""
-                INSERT INTO transaction_tag (raw_transaction_id, tag, source)
-                VALUES (%s, %s, 'ibank_import')
-                ON CONFLICT (raw_transaction_id, tag) DO NOTHING
-            """, (str(rt_id), tag))
-            inserted += cur.rowcount
+    cur.execute("""
+        INSERT INTO transaction_tag (raw_transaction_id, tag, source)
+        SELECT raw_transaction_id, tag, 'ibank_import'
+        FROM ibank_tag_map
+        ON CONFLICT (raw_transaction_id, tag) DO NOTHING
+    """)
+    inserted = cur.rowcount
 
     pg_conn.commit()
     print(f"  Inserted: {inserted} (skipped {total_associations - inserted} existing)")
-    return tags_by_txn
+    return tagged_txns
 
 
-def phase2_propagate(pg_conn, tags_by_ibank_id, dry_run=False):
+def phase2_propagate(pg_conn, dry_run=False):
     """Propagate tags from suppressed iBank transactions to active API/CSV counterparts.
 
     Uses the same matching approach as ibank_enrich.py:
     match by (institution, account_key, posted_at, amount, currency).
+    A suppressed iBank transaction propagates only when exactly one active
+    transaction shares its key. Matching and insert run as one statement
+    against phase 1's ibank_tag_map.
     """
     cur = pg_conn.cursor()
 
-    # Get suppressed iBank transaction IDs that have tags
-    tagged_ids = list(tags_by_ibank_id.keys())
-    if not tagged_ids:
-        print("  No tags to propagate")
-        return
-
     # Find which tagged iBank transactions are suppressed (not active)
-    cur.execute("""
-        SELECT rt.id, rt.institution,
-               COALESCE(aa.canonical_ref, rt.account_ref) AS account_key,
+    cur.execute(f"""
+        CREATE TEMP TABLE ibank_tag_suppressed AS
+        SELECT rt.id, rt.institution, {ACCOUNT_KEY_SQL},
                rt.posted_at, rt.amount, rt.currency
         FROM raw_transaction rt
-        LEFT JOIN account_alias aa
-            ON aa.institution = rt.institution AND aa.account_ref = rt.account_ref
+        {ACCOUNT_ALIAS_JOIN_SQL}
         WHERE rt.source = 'ibank'
-          AND rt.id = ANY(%s::uuid[])
-          AND EXISTS (
-              SELECT 1 FROM dedup_group_member dgm
-              WHERE dgm.raw_transaction_id = rt.id AND NOT dgm.is_preferred
-          )
-    """, ([str(i) for i in tagged_ids],))
-    suppressed = [dict(zip([d[0] for d in cur.description], row)) for row in cur.fetchall()]
-    print(f"  Suppressed iBank transactions with tags: {len(suppressed)}")
+          AND rt.id IN (SELECT raw_transaction_id FROM ibank_tag_map)
+          AND {SUPPRESSED_SQL}
+    """)
+    cur.execute("SELECT count(*) FROM ibank_tag_suppressed")
+    suppressed = cur.fetchone()[0]
+    print(f"  Suppressed iBank transactions with tags: {suppressed}")
 
     if not suppressed:
         return
 
-    # Get all active non-iBank transactions for matching
-    cur.execute("""
-        SELECT rt.id, rt.institution,
-               COALESCE(aa.canonical_ref, rt.account_ref) AS account_key,
-               rt.posted_at, rt.amount, rt.currency
-        FROM raw_transaction rt
-        LEFT JOIN account_alias aa
-            ON aa.institution = rt.institution AND aa.account_ref = rt.account_ref
-        WHERE rt.source <> 'ibank'
-          AND NOT EXISTS (
-              SELECT 1 FROM dedup_group_member dgm
-              WHERE dgm.raw_transaction_id = rt.id AND NOT dgm.is_preferred
-          )
-    """)
-    active_rows = [dict(zip([d[0] for d in cur.description], row)) for row in cur.fetchall()]
-
-    # Index active by match key
-    active_by_key = defaultdict(list)
-    for r in active_rows:
-        key = (r['institution'], r['account_key'], r['posted_at'], r['amount'], r['currency'])
-        active_by_key[key].append(r)
-
-    # Match and propagate
-    propagated = 0
-    matched_txns = 0
-    unmatched_txns = 0
-
-    for ib_row in suppressed:
-        key = (ib_row['institution'], ib_row['account_key'],
-               ib_row['posted_at'], ib_row['amount'], ib_row['currency'])
-        candidates = active_by_key.get(key, [])
-
-        if len(candidates) == 1:
-            # 1:1 match — propagate tags
-            active_id = candidates[0]['id']
-            tags = tags_by_ibank_id.get(ib_row['id'], set())
-            matched_txns += 1
-
-            if not dry_run:
-                for tag in tags:
-                    cur.execute("""
-                        INSERT INTO transaction_tag (raw_transaction_id, tag, source)
-                        VALUES (%s, %s, 'ibank_import')
-                        ON CONFLICT (raw_transaction_id, tag) DO NOTHING
-                    """, (str(active_id), tag))
-                    propagated += cur.rowcount
-            else:
-                propagated += len(tags)
-        else:
-            unmatched_txns += 1
+    # Match each suppressed row to the active non-iBank rows sharing its key,
+    # keeping it only when there is exactly one
+    cur.execute(f"""
+        WITH active AS (
+            SELECT rt.id, rt.institution, {ACCOUNT_KEY_SQL},
+                   rt.posted_at, rt.amount, rt.currency
+            FROM raw_transaction rt
+            {ACCOUNT_ALIAS_JOIN_SQL}
+            WHERE rt.source <> 'ibank'
+              AND NOT {SUPPRESSED_SQL}
+        ),
+        candidates AS (
+            SELECT s.id AS ibank_id, a.id AS active_id,
+                   COUNT(*) OVER (PARTITION BY s.id) AS n_candidates
+            FROM ibank_tag_suppressed s
+            JOIN active a USING ({MATCH_KEY_COLUMNS})
+        ),
+        pairs AS (
+            SELECT ibank_id, active_id FROM candidates WHERE n_candidates = 1
+        ),
+        tags AS (
+            SELECT p.active_id, m.tag
+            FROM pairs p
+            JOIN ibank_tag_map m ON m.raw_transaction_id = p.ibank_id
+        ),
+        inserted AS (
+            INSERT INTO transaction_tag (raw_transaction_id, tag, source)
+            SELECT DISTINCT active_id, tag, 'ibank_import'
+            FROM tags
+            WHERE NOT %(dry_run)s
+            ON CONFLICT (raw_transaction_id, tag) DO NOTHING
+            RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM pairs),
+               (SELECT count(*) FROM tags),
+               (SELECT count(*) FROM inserted)
+    """, {"dry_run": dry_run})
+    matched_txns, candidate_tags, inserted = cur.fetchone()
+    propagated = candidate_tags if dry_run else inserted
+    unmatched_txns = suppressed - matched_txns
 
     if not dry_run:
         pg_conn.commit()
@@ -212,21 +230,24 @@ def main():
 
     print("=== iBank Tag Import ===\n")
 
-    # Extract from iBank
-    print("Extracting tags from iBank SQLite...")
-    ibank_tags = extract_tags_from_ibank()
-    print(f"  Total associations: {len(ibank_tags)}")
-    print(f"  Unique tags: {len(set(r[1] for r in ibank_tags))}\n")
-
     pg = psycopg2.connect(settings.dsn)
     try:
+        # Extract from iBank, streamed straight into the staging table
+        print("Extracting tags from iBank SQLite...")
+        total, unique_tags = stage_ibank_tags(pg, extract_tags_from_ibank())
+        print(f"  Total associations: {total}")
+        print(f"  Unique tags: {unique_tags}\n")
+
         # Phase 1: Direct import to iBank raw_transactions
         print("Phase 1: Direct import (iBank transaction_ref match)")
-        tags_by_ibank_id = phase1_direct_import(pg, ibank_tags, dry_run=args.dry_run)
+        tagged_txns = phase1_direct_import(pg, dry_run=args.dry_run)
 
         # Phase 2: Propagate to active API/CSV counterparts
         print("\nPhase 2: Propagate to active transactions")
-        phase2_propagate(pg, tags_by_ibank_id, dry_run=args.dry_run)
+        if tagged_txns:
+            phase2_propagate(pg, dry_run=args.dry_run)
+        else:
+            print("  No tags to propagate")
 
         if args.dry_run:
             print("\n(dry run — no changes made)")
@@ -11,12 +11,16 @@ Usage:
 """
 
 import argparse
+import csv
+import io
 import sys
+import uuid
 from collections import defaultdict
 from decimal import Decimal
 from pathlib import Path
 
 import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 from config.settings import settings
@@ -24,54 +28,159 @@ from config.settings import settings
 
 # ── Shared helpers ──────────────────────────────────────────────────
 
+# Above this many rows, legs and category overrides are written with COPY
+# (first-run backfills); smaller runs use execute_values
+BULK_COPY_THRESHOLD = 5000
 
-def find_already_linked(cur):
-    """Get set of transaction IDs already linked to economic events."""
-    cur.execute("SELECT raw_transaction_id FROM economic_event_leg")
-    return {row[0] for row in cur.fetchall()}
+
+# True when the transaction id in {} already has an economic event leg.
+# Checked against the live table, so a phase sees the links earlier phases
+# wrote in this run
+LINKED_SQL = "EXISTS (SELECT 1 FROM economic_event_leg l WHERE l.raw_transaction_id = {})"
+
+
+def count_already_linked(cur):
+    """Count transactions already linked to economic events."""
+    cur.execute("SELECT COUNT(DISTINCT raw_transaction_id) FROM economic_event_leg")
+    return cur.fetchone()[0]
+
+
+def _copy_rows(cur, table, columns, rows):
+    """COPY rows (tuples in `columns` order) into `table` as CSV."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([r"\N" if v is None else v for v in row])
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buf,
+    )
 
 
 def _set_transfer_category(cur, txn_ids):
-    """Set +Transfer category override on transaction IDs."""
-    for tid in txn_ids:
+    """Set +Transfer category override on transaction IDs, in one batched statement.
+
+    The IDs must be distinct: ON CONFLICT DO UPDATE can't touch a row twice
+    in one statement. Large batches are COPYed into a staging table and
+    upserted from there.
+    """
+    if not txn_ids:
+        return
+    if len(txn_ids) > BULK_COPY_THRESHOLD:
+        cur.execute("CREATE TEMP TABLE stg_transfer_override (raw_transaction_id uuid)")
+        _copy_rows(cur, "stg_transfer_override", "raw_transaction_id",
+                   [(str(tid),) for tid in txn_ids])
         cur.execute("""
             INSERT INTO transaction_category_override (raw_transaction_id, category_path, source)
-            VALUES (%s, '+Transfer', 'system')
+            SELECT raw_transaction_id, '+Transfer', 'system' FROM stg_transfer_override
             ON CONFLICT (raw_transaction_id)
             DO UPDATE SET category_path = '+Transfer', source = 'system', updated_at = now()
-        """, (str(tid),))
+        """)
+        cur.execute("DROP TABLE stg_transfer_override")
+        return
+    execute_values(cur, """
+        INSERT INTO transaction_category_override (raw_transaction_id, category_path, source)
+        VALUES %s
+        ON CONFLICT (raw_transaction_id)
+        DO UPDATE SET category_path = '+Transfer', source = 'system', updated_at = now()
+    """, [(str(tid),) for tid in txn_ids], template="(%s, '+Transfer', 'system')", page_size=1000)
+
+
+def _write_events(cur, events, legs, fx_events=()):
+    """Insert economic events, their legs and any FX details, one batch per table.
+
+    Event IDs are generated client-side (uuid4) by the callers, so legs and
+    fx_event rows can reference their event without a RETURNING round trip
+    per event. Rows are (id, event_type, initiated_at, description),
+    (event_id, raw_transaction_id, leg_type, amount, currency) and fx_event
+    columns in insert order. Legs go through COPY above BULK_COPY_THRESHOLD.
+    """
+    if events:
+        execute_values(cur, """
+            INSERT INTO economic_event (id, event_type, initiated_at, description, match_status)
+            VALUES %s
+        """, events, template="(%s, %s, %s, %s, 'auto_matched')", page_size=1000)
+    if len(legs) > BULK_COPY_THRESHOLD:
+        _copy_rows(cur, "economic_event_leg",
+                   "economic_event_id, raw_transaction_id, leg_type, amount, currency", legs)
+    elif legs:
+        execute_values(cur, """
+            INSERT INTO economic_event_leg
+                (economic_event_id, raw_transaction_id, leg_type, amount, currency)
+            VALUES %s
+        """, legs, page_size=1000)
+    if fx_events:
+        execute_values(cur, """
+            INSERT INTO fx_event
+                (economic_event_id, source_amount, source_currency,
+                 target_amount, target_currency, achieved_rate,
+                 fee_amount, fee_currency, provider)
+            VALUES %s
+        """, fx_events, template="(%s, %s, %s, %s, %s, %s, %s, %s, 'wise')", page_size=1000)
+
+
+def create_active_tx(cur):
+    """Materialise active (non-suppressed) transactions as the active_tx temp table.
+
+    The same-currency and Visa finders both read from it, so raw_transaction
+    and the dedup suppression check are scanned once rather than per finder.
+    Linking writes only events, legs and category overrides, so the set does
+    not change between phases. The table must outlive the commit after
+    step 2, so it is not ON COMMIT DROP; any copy left on a reused (pooled)
+    connection is dropped and rebuilt instead.
+    """
+    cur.execute("DROP TABLE IF EXISTS active_tx")
+    cur.execute("""
+        CREATE TEMP TABLE active_tx AS
+        SELECT rt.id, rt.posted_at::date AS dt, rt.amount, rt.currency,
+               rt.institution, rt.account_ref, rt.raw_merchant,
+               rt.institution || '/' || rt.account_ref AS acct
+        FROM raw_transaction rt
+        WHERE NOT EXISTS (
+            SELECT 1 FROM dedup_group_member dgm
+            WHERE dgm.raw_transaction_id = rt.id AND NOT dgm.is_preferred
+        )
+    """)
+    cur.execute("CREATE INDEX ON active_tx (dt, currency, amount)")
+    cur.execute("CREATE INDEX ON active_tx (institution, account_ref)")
+    cur.execute("ANALYZE active_tx")
 
 
 # ── FX conversion pairs (Wise CSV batch ID) ────────────────────────
 
 
-def find_fx_pairs(cur):
-    """Find Wise CSV FX conversion pairs by batch ID."""
-    cur.execute("""
-        SELECT
-            id, amount, currency, account_ref, posted_at,
-            raw_data->>'ID' AS batch_id,
-            raw_data->>'Exchange rate' AS exchange_rate,
-            raw_data->>'Source amount (after fees)' AS source_amount,
-            raw_data->>'Source currency' AS source_currency,
-            raw_data->>'Target amount (after fees)' AS target_amount,
-            raw_data->>'Target currency' AS target_currency,
-            raw_data->>'Source fee amount' AS fee_amount,
-            raw_data->>'Source fee currency' AS fee_currency
-        FROM raw_transaction
-        WHERE institution = 'wise'
-          AND source = 'wise_csv'
-          AND raw_data ? 'Source currency'
-          AND raw_data->>'Direction' = 'NEUTRAL'
-          AND raw_data->>'Source currency' != raw_data->>'Target currency'
-        ORDER BY posted_at, raw_data->>'ID', amount
-    """)
-    columns = [desc[0] for desc in cur.description]
-    rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+def find_fx_pairs(conn):
+    """Find Wise CSV FX conversion pairs by batch ID.
 
+    Rows stream from a named cursor straight into their batch groups, so
+    the result set is never held as a list as well.
+    """
     groups = defaultdict(list)
-    for row in rows:
-        groups[row["batch_id"]].append(row)
+    with conn.cursor(name="fx_pair_rows", cursor_factory=RealDictCursor) as cur:
+        cur.itersize = 5000
+        cur.execute(f"""
+            SELECT
+                id, amount, currency, account_ref, posted_at,
+                raw_data->>'ID' AS batch_id,
+                raw_data->>'Exchange rate' AS exchange_rate,
+                raw_data->>'Source amount (after fees)' AS source_amount,
+                raw_data->>'Source currency' AS source_currency,
+                raw_data->>'Target amount (after fees)' AS target_amount,
+                raw_data->>'Target currency' AS target_currency,
+                raw_data->>'Source fee amount' AS fee_amount,
+                raw_data->>'Source fee currency' AS fee_currency,
+                {LINKED_SQL.format("raw_transaction.id")} AS already_linked
+            FROM raw_transaction
+            WHERE institution = 'wise'
+              AND source = 'wise_csv'
+              AND raw_data ? 'Source currency'
+              AND raw_data->>'Direction' = 'NEUTRAL'
+              AND raw_data->>'Source currency' != raw_data->>'Target currency'
+            ORDER BY posted_at, raw_data->>'ID', amount
+        """)
+        for row in cur:
+            groups[row["batch_id"]].append(row)
 
     pairs = []
     for batch_id, members in groups.items():
@@ -90,23 +199,29 @@ def find_fx_pairs(cur):
                 "target_currency": members[0]["target_currency"],
                 "fee_amount": members[0]["fee_amount"],
                 "fee_currency": members[0]["fee_currency"],
+                "already_linked": any(m["already_linked"] for m in members),
             })
 
     pairs.sort(key=lambda p: p["posted_at"])
     return pairs
 
 
-def link_fx_pairs(cur, pairs, already_linked, dry_run=False):
+def link_fx_pairs(cur, pairs, dry_run=False):
     """Create economic events for FX conversion pairs."""
     created = 0
     skipped_linked = 0
+    # Rows for _write_events and _set_transfer_category, written in batches
+    # once every pair has been handled
+    events, legs, fx_events = [], [], []
+    transfer_ids = []
 
     for pair in pairs:
-        txn_ids = pair["txn_ids"]
-        if txn_ids[0] in already_linked or txn_ids[1] in already_linked:
+        if pair["already_linked"]:
             skipped_linked += 1
             continue
 
+        txn_ids = pair["txn_ids"]
+
         amounts = pair["amounts"]
         currencies = pair["currencies"]
         source_ccy = pair["source_currency"]
@@ -133,33 +248,13 @@ def link_fx_pairs(cur, pairs, already_linked, dry_run=False):
             created += 1
             continue
 
-        cur.execute("""
-            INSERT INTO economic_event (event_type, initiated_at, description, match_status)
-            VALUES ('fx_conversion', %s, %s, 'auto_matched')
-            RETURNING id
-        """, (pair["posted_at"], description))
-        event_id = cur.fetchone()[0]
-
-        cur.execute("""
-            INSERT INTO economic_event_leg
-                (economic_event_id, raw_transaction_id, leg_type, amount, currency)
-            VALUES (%s, %s, 'source', %s, %s)
-        """, (event_id, str(source_txn_id), source_txn_amount, source_txn_ccy))
-
-        cur.execute("""
-            INSERT INTO economic_event_leg
-                (economic_event_id, raw_transaction_id, leg_type, amount, currency)
-            VALUES (%s, %s, 'target', %s, %s)
-        """, (event_id, str(target_txn_id), target_txn_amount, target_txn_ccy))
+        event_id = str(uuid.uuid4())
+        events.append((event_id, "fx_conversion", pair["posted_at"], description))
+        legs.append((event_id, str(source_txn_id), "source", source_txn_amount, source_txn_ccy))
+        legs.append((event_id, str(target_txn_id), "target", target_txn_amount, target_txn_ccy))
 
         if source_amt and target_amt and rate:
-            cur.execute("""
-                INSERT INTO fx_event
-                    (economic_event_id, source_amount, source_currency,
-                     target_amount, target_currency, achieved_rate,
-                     fee_amount, fee_currency, provider)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'wise')
-            """, (
+            fx_events.append((
                 event_id,
                 Decimal(source_amt),
                 source_ccy,
@@ -170,10 +265,11 @@ def link_fx_pairs(cur, pairs, already_linked, dry_run=False):
                 fee_ccy if fee_amt else None,
             ))
 
-        _set_transfer_category(cur, [source_txn_id, target_txn_id])
-        already_linked.update(txn_ids)
+        transfer_ids += [source_txn_id, target_txn_id]
         created += 1
 
+    _write_events(cur, events, legs, fx_events)
+    _set_transfer_category(cur, transfer_ids)
     return created, skipped_linked
 
 
@@ -186,27 +282,19 @@ def find_same_ccy_pairs(cur):
     Matches debits and credits across different accounts on the same date
     with the same absolute amount and currency. Only returns pairs where
     exactly one debit matches exactly one credit for that (date, amount, currency)
-    combination — ambiguous many-to-many cases are skipped.
+    combination — ambiguous many-to-many cases are skipped. Pairs with a leg
+    that is already linked are still returned (already_linked), so they are
+    reported as skipped and still count towards ambiguity. Reads the
+    active_tx temp table (create_active_tx).
     """
-    cur.execute("""
-        WITH active AS (
-            SELECT rt.id, rt.posted_at, rt.amount, rt.currency,
-                   rt.institution, rt.account_ref
-            FROM raw_transaction rt
-            WHERE NOT EXISTS (
-                SELECT 1 FROM dedup_group_member dgm
-                WHERE dgm.raw_transaction_id = rt.id AND NOT dgm.is_preferred
-            )
-        ),
-        debits AS (
-            SELECT id, posted_at::date AS dt, amount, currency,
-                   institution || '/' || account_ref AS acct
-            FROM active WHERE amount < 0
+    cur.execute(f"""
+        WITH debits AS (
+            SELECT id, dt, amount, currency, acct
+            FROM active_tx WHERE amount < 0
         ),
         credits AS (
-            SELECT id, posted_at::date AS dt, amount, currency,
-                   institution || '/' || account_ref AS acct
-            FROM active WHERE amount > 0
+            SELECT id, dt, amount, currency, acct
+            FROM active_tx WHERE amount > 0
         ),
         candidates AS (
             SELECT d.id AS debit_id, c.id AS credit_id,
@@ -219,32 +307,43 @@ def find_same_ccy_pairs(cur):
                 AND d.acct != c.acct
         )
         SELECT debit_id, credit_id, dt, debit_amount, credit_amount,
-               currency, debit_acct, credit_acct
-        FROM candidates c
+               currency, debit_acct, credit_acct,
+               {LINKED_SQL.format("debit_id")}
+               OR {LINKED_SQL.format("credit_id")} AS already_linked
+        FROM (
+            SELECT c.*,
+                   COUNT(*) OVER (PARTITION BY debit_id) AS debit_matches,
+                   COUNT(*) OVER (PARTITION BY credit_id) AS credit_matches
+            FROM candidates c
+        ) q
         WHERE
             -- Unambiguous: this debit only matches one credit
-            (SELECT COUNT(*) FROM candidates x WHERE x.debit_id = c.debit_id) = 1
+            debit_matches = 1
             -- And this credit only matches one debit
-            AND (SELECT COUNT(*) FROM candidates x WHERE x.credit_id = c.credit_id) = 1
+            AND credit_matches = 1
         ORDER BY dt, debit_acct
     """)
     columns = [desc[0] for desc in cur.description]
     return [dict(zip(columns, row)) for row in cur.fetchall()]
 
 
-def link_same_ccy_pairs(cur, pairs, already_linked, dry_run=False):
+def link_same_ccy_pairs(cur, pairs, dry_run=False):
     """Create economic events for same-currency transfer pairs."""
     created = 0
     skipped_linked = 0
+    # Rows for _write_events and _set_transfer_category, written in batches
+    # once every pair has been handled
+    events, legs = [], []
+    transfer_ids = []
 
     for pair in pairs:
-        debit_id = pair["debit_id"]
-        credit_id = pair["credit_id"]
-
-        if debit_id in already_linked or credit_id in already_linked:
+        if pair["already_linked"]:
             skipped_linked += 1
             continue
 
+        debit_id = pair["debit_id"]
+        credit_id = pair["credit_id"]
+
         amt = abs(pair["debit_amount"])
         ccy = pair["currency"]
         description = f"{amt} {ccy} | {pair['debit_acct']} -> {pair['credit_acct']}"
@@ -254,29 +353,16 @@ def link_same_ccy_pairs(cur, pairs, already_linked, dry_run=False):
             created += 1
             continue
 
-        cur.execute("""
-            INSERT INTO economic_event (event_type, initiated_at, description, match_status)
-            VALUES ('transfer', %s, %s, 'auto_matched')
-            RETURNING id
-        """, (pair["dt"], description))
-        event_id = cur.fetchone()[0]
+        event_id = str(uuid.uuid4())
+        events.append((event_id, "transfer", pair["dt"], description))
+        legs.append((event_id, str(debit_id), "source", pair["debit_amount"], ccy))
+        legs.append((event_id, str(credit_id), "target", pair["credit_amount"], ccy))
 
-        cur.execute("""
-            INSERT INTO economic_event_leg
-                (economic_event_id, raw_transaction_id, leg_type, amount, currency)
-            VALUES (%s, %s, 'source', %s, %s)
-        """, (event_id, str(debit_id), pair["debit_amount"], ccy))
-
-        cur.execute("""
-            INSERT INTO economic_event_leg
-                (economic_event_id, raw_transaction_id, leg_type, amount, currency)
-            VALUES (%s, %s, 'target', %s, %s)
-        """, (event_id, str(credit_id), pair["credit_amount"], ccy))
-
-        _set_transfer_category(cur, [debit_id, credit_id])
-        already_linked.update([debit_id, credit_id])
+        transfer_ids += [debit_id, credit_id]
         created += 1
 
+    _write_events(cur, events, legs)
+    _set_transfer_category(cur, transfer_ids)
     return created, skipped_linked
 
 
@@ -290,28 +376,21 @@ def find_visa_payment_pairs(cur):
     credits show "PAYMENT RECEIVED - THANK YOU". Amounts match exactly but
     the credit can post up to 5 days after the debit.
 
-    Only unambiguous 1:1 matches are returned.
+    Only unambiguous 1:1 matches are returned, flagged already_linked when
+    either leg already has an event. Reads the active_tx temp table
+    (create_active_tx).
     """
-    cur.execute("""
-        WITH active AS (
-            SELECT rt.id, rt.posted_at, rt.amount, rt.currency,
-                   rt.institution, rt.account_ref, rt.raw_merchant
-            FROM raw_transaction rt
-            WHERE NOT EXISTS (
-                SELECT 1 FROM dedup_group_member dgm
-                WHERE dgm.raw_transaction_id = rt.id AND NOT dgm.is_preferred
-            )
-        ),
-        debits AS (
-            SELECT id, posted_at::date AS dt, amount, currency
-            FROM active
+    cur.execute(f"""
+        WITH debits AS (
+            SELECT id, dt, amount, currency
+            FROM active_tx
             WHERE institution = 'first_direct' AND account_ref = 'fd_5682'
               AND amount < 0
               AND UPPER(COALESCE(raw_merchant, '')) LIKE '%%FIRST DIRECT VISA%%'
         ),
         credits AS (
-            SELECT id, posted_at::date AS dt, amount, currency
-            FROM active
+            SELECT id, dt, amount, currency
+            FROM active_tx
             WHERE institution = 'first_direct' AND account_ref = 'fd_8897'
               AND amount > 0
               AND UPPER(COALESCE(raw_merchant, '')) LIKE '%%PAYMENT RECEIVED%%'
@@ -329,30 +408,39 @@ def find_visa_payment_pairs(cur):
                 AND c.dt <= d.dt + 5
         )
         SELECT debit_id, credit_id, debit_date, credit_date, day_gap,
-               debit_amount, credit_amount, currency
-        FROM candidates c
-        WHERE
-            (SELECT COUNT(*) FROM candidates x WHERE x.debit_id = c.debit_id) = 1
-            AND (SELECT COUNT(*) FROM candidates x WHERE x.credit_id = c.credit_id) = 1
+               debit_amount, credit_amount, currency,
+               {LINKED_SQL.format("debit_id")}
+               OR {LINKED_SQL.format("credit_id")} AS already_linked
+        FROM (
+            SELECT c.*,
+                   COUNT(*) OVER (PARTITION BY debit_id) AS debit_matches,
+                   COUNT(*) OVER (PARTITION BY credit_id) AS credit_matches
+            FROM candidates c
+        ) q
+        WHERE debit_matches = 1 AND credit_matches = 1
         ORDER BY debit_date
     """)
     columns = [desc[0] for desc in cur.description]
     return [dict(zip(columns, row)) for row in cur.fetchall()]
 
 
-def link_visa_payment_pairs(cur, pairs, already_linked, dry_run=False):
+def link_visa_payment_pairs(cur, pairs, dry_run=False):
     """Create economic events for FD Joint→Visa payment pairs."""
     created = 0
     skipped_linked = 0
+    # Rows for _write_events and _set_transfer_category, written in batches
+    # once every pair has been handled
+    events, legs = [], []
+    transfer_ids = []
 
     for pair in pairs:
-        debit_id = pair["debit_id"]
-        credit_id = pair["credit_id"]
-
-        if debit_id in already_linked or credit_id in already_linked:
+        if pair["already_linked"]:
             skipped_linked += 1
             continue
 
+        debit_id = pair["debit_id"]
+        credit_id = pair["credit_id"]
+
         amt = abs(pair["debit_amount"])
         ccy = pair["currency"]
         gap = pair["day_gap"]
@@ -363,29 +451,16 @@ def link_visa_payment_pairs(cur, pairs, already_linked, dry_run=False):
             created += 1
             continue
 
-        cur.execute("""
-            INSERT INTO economic_event (event_type, initiated_at, description, match_status)
-            VALUES ('transfer', %s, %s, 'auto_matched')
-            RETURNING id
-        """, (pair["debit_date"], description))
-        event_id = cur.fetchone()[0]
+        event_id = str(uuid.uuid4())
+        events.append((event_id, "transfer", pair["debit_date"], description))
+        legs.append((event_id, str(debit_id), "source", pair["debit_amount"], ccy))
+        legs.append((event_id, str(credit_id), "target", pair["credit_amount"], ccy))
 
-        cur.execute("""
-            INSERT INTO economic_event_leg
-                (economic_event_id, raw_transaction_id, leg_type, amount, currency)
-            VALUES (%s, %s, 'source', %s, %s)
-        """, (event_id, str(debit_id), pair["debit_amount"], ccy))
-
-        cur.execute("""
-            INSERT INTO economic_event_leg
-                (economic_event_id, raw_transaction_id, leg_type, amount, currency)
-            VALUES (%s, %s, 'target', %s, %s)
-        """, (event_id, str(credit_id), pair["credit_amount"], ccy))
-
-        _set_transfer_category(cur, [debit_id, credit_id])
-        already_linked.update([debit_id, credit_id])
+        transfer_ids += [debit_id, credit_id]
         created += 1
 
+    _write_events(cur, events, legs)
+    _set_transfer_category(cur, transfer_ids)
     return created, skipped_linked
 
 
@@ -403,24 +478,26 @@ def main():
 
         print("=== Transfer & FX Event Linker ===\n")
 
-        already_linked = find_already_linked(cur)
-        print(f"Already linked transactions: {len(already_linked)}\n")
+        print(f"Already linked transactions: {count_already_linked(cur)}\n")
 
         # Step 1: FX conversion pairs (Wise CSV batch ID)
         print("Step 1: FX conversion pairs (Wise CSV batch ID)")
-        fx_pairs = find_fx_pairs(cur)
+        fx_pairs = find_fx_pairs(conn)
         print(f"  Found: {len(fx_pairs)} pairs")
-        fx_created, fx_skipped = link_fx_pairs(cur, fx_pairs, already_linked, dry_run=args.dry_run)
+        fx_created, fx_skipped = link_fx_pairs(cur, fx_pairs, dry_run=args.dry_run)
         print(f"  Created: {fx_created}, Skipped: {fx_skipped}\n")
 
         if not args.dry_run:
             conn.commit()
 
+        # Active transactions, shared by steps 2 and 3
+        create_active_tx(cur)
+
         # Step 2: Same-currency transfer pairs
         print("Step 2: Same-currency transfer pairs (unambiguous only)")
         xfr_pairs = find_same_ccy_pairs(cur)
         print(f"  Found: {len(xfr_pairs)} unambiguous pairs")
-        xfr_created, xfr_skipped = link_same_ccy_pairs(cur, xfr_pairs, already_linked, dry_run=args.dry_run)
+        xfr_created, xfr_skipped = link_same_ccy_pairs(cur, xfr_pairs, dry_run=args.dry_run)
         print(f"  Created: {xfr_created}, Skipped: {xfr_skipped}\n")
 
         if not args.dry_run:
@@ -430,7 +507,7 @@ def main():
         print("Step 3: FD Joint -> Visa payments (fuzzy date)")
         visa_pairs = find_visa_payment_pairs(cur)
         print(f"  Found: {len(visa_pairs)} pairs")
-        visa_created, visa_skipped = link_visa_payment_pairs(cur, visa_pairs, already_linked, dry_run=args.dry_run)
+        visa_created, visa_skipped = link_visa_payment_pairs(cur, visa_pairs, dry_run=args.dry_run)
         print(f"  Created: {visa_created}, Skipped: {visa_skipped}\n")
 
         if not args.dry_run:
@@ -15,8 +15,8 @@ import argparse
 import json
 import sqlite3
 import sys
-from collections import defaultdict
 from decimal import Decimal
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Tuple
 
@@ -68,33 +68,45 @@ def load_categories(ibank_cur, pg_conn) -> Dict[str, str]:
     # Build parent PK → full_path lookup
     pk_to_path = {r[0]: r[3] for r in rows}
 
-    # Insert categories, tracking path → UUID
-    path_to_uuid = {}
-    inserted = 0
-
+    # One row per full_path. A repeated path keeps the name and type it was
+    # first seen with and the last is_active, as one-by-one upserts would.
+    categories = {}
+    parent_paths = {}
     for pk, acc_class, name, full_path, parent_pk, hidden in rows:
         cat_type = "income" if acc_class == INCOME_CLASS else "expense"
+        categories.setdefault(full_path, [name, cat_type, None])[2] = not bool(hidden)
+        parent_paths[full_path] = pk_to_path.get(parent_pk) if parent_pk else None
 
-        # Find parent UUID if exists
-        parent_uuid = None
-        if parent_pk and parent_pk in pk_to_path:
-            parent_path = pk_to_path[parent_pk]
-            parent_uuid = path_to_uuid.get(parent_path)
-
-        is_active = not bool(hidden)
-
-        pg_cur.execute("""
+    # Insert categories without parents first, tracking path → UUID...
+    path_to_uuid = {}
+    if categories:
+        returned = psycopg2.extras.execute_values(pg_cur, """
             INSERT INTO category (full_path, name, parent_id, category_type, is_active)
-            VALUES (%s, %s, %s, %s, %s)
+            VALUES %s
             ON CONFLICT (full_path) DO UPDATE SET
                 parent_id = EXCLUDED.parent_id,
                 is_active = EXCLUDED.is_active
-            RETURNING id
-        """, (full_path, name, parent_uuid, cat_type, is_active))
-
-        cat_uuid = pg_cur.fetchone()[0]
-        path_to_uuid[full_path] = str(cat_uuid)
-        inserted += 1
+            RETURNING id, full_path
+        """, [(path, name, cat_type, is_active)
+              for path, (name, cat_type, is_active) in categories.items()],
+            template="(%s, %s, NULL, %s, %s)", page_size=1000, fetch=True)
+        path_to_uuid = {full_path: str(cat_uuid) for cat_uuid, full_path in returned}
+
+    # ...then link each to its parent now that every UUID is known
+    parent_links = [
+        (path_to_uuid[path], path_to_uuid[parent_path])
+        for path, parent_path in parent_paths.items()
+        if parent_path in path_to_uuid and parent_path != path
+    ]
+    if parent_links:
+        psycopg2.extras.execute_values(pg_cur, """
+            UPDATE category c
+            SET parent_id = v.parent_id
+            FROM (VALUES %s) AS v (id, parent_id)
+            WHERE c.id = v.id
+        """, parent_links, template="(%s::uuid, %s::uuid)", page_size=1000)
+
+    inserted = len(rows)
 
     pg_conn.commit()
     print(f"  Categories: {inserted} loaded")
@@ -109,69 +121,74 @@ def load_merchant_mappings(ibank_cur, pg_conn, cat_path_to_uuid: Dict[str, str])
     """
     pg_cur = pg_conn.cursor()
 
-    # Get merchant→category with counts and recency
+    # Pick each merchant's dominant category in SQLite: the most frequent
+    # non-archive category, or the most frequent archive one when that is
+    # all there is. class_total sums the counts within the winner's class
+    # (archive or not), the denominator for its confidence.
     ibank_cur.execute("""
-        SELECT t.ZPTITLE as merchant,
-               cat.ZPFULLNAME as category,
-               count(*) as txn_count,
-               max(t.ZPDATE) as last_used
-        FROM ZTRANSACTION t
-        JOIN ZLINEITEM li ON li.ZPTRANSACTION = t.Z_PK
-        JOIN ZACCOUNT cat ON li.ZPACCOUNT = cat.Z_PK
-        WHERE cat.ZPACCOUNTCLASS IN (6000, 7000)
-          AND t.ZPTITLE IS NOT NULL AND t.ZPTITLE != ''
-        GROUP BY t.ZPTITLE, cat.ZPFULLNAME
-        ORDER BY t.ZPTITLE, txn_count DESC
+        WITH merchant_cat AS (
+            SELECT t.ZPTITLE AS merchant,
+                   cat.ZPFULLNAME AS category,
+                   count(*) AS txn_count,
+                   substr(cat.ZPFULLNAME, 1, 11) = 'ZZZ-Archive' AS is_archive
+            FROM ZTRANSACTION t
+            JOIN ZLINEITEM li ON li.ZPTRANSACTION = t.Z_PK
+            JOIN ZACCOUNT cat ON li.ZPACCOUNT = cat.Z_PK
+            WHERE cat.ZPACCOUNTCLASS IN (6000, 7000)
+              AND t.ZPTITLE IS NOT NULL AND t.ZPTITLE != ''
+            GROUP BY t.ZPTITLE, cat.ZPFULLNAME
+        ),
+        ranked AS (
+            SELECT merchant, category, txn_count,
+                   sum(txn_count) OVER (PARTITION BY merchant, is_archive) AS class_total,
+                   row_number() OVER (
+                       PARTITION BY merchant
+                       ORDER BY is_archive, txn_count DESC, category
+                   ) AS rn
+            FROM merchant_cat
+        )
+        SELECT merchant, category, txn_count, class_total
+        FROM ranked
+        WHERE rn = 1
+        ORDER BY merchant
     """)
 
-    # Group by merchant, pick best category
-    merchant_cats = defaultdict(list)
-    for merchant, category, count, last_used in ibank_cur.fetchall():
-        merchant_cats[merchant].append((category, count, last_used))
-
-    canonical_inserted = 0
-    mapping_inserted = 0
-
-    for merchant, cat_counts in merchant_cats.items():
-        # Separate archive vs non-archive categories
-        non_archive = [(c, n, t) for c, n, t in cat_counts if not c.startswith("ZZZ-Archive")]
-        archive = [(c, n, t) for c, n, t in cat_counts if c.startswith("ZZZ-Archive")]
-
-        if non_archive:
-            # Prefer most frequent non-archive category
-            dominant_cat, dominant_count, _ = max(non_archive, key=lambda x: x[1])
-            total_count = sum(n for _, n, _ in non_archive)
-        else:
-            # All archive — use most frequent archive category
-            dominant_cat, dominant_count, _ = max(archive, key=lambda x: x[1])
-            total_count = sum(n for _, n, _ in archive)
-
+    # (merchant, category, confidence) for dominant categories we know
+    merchants = []
+    for merchant, dominant_cat, dominant_count, total_count in ibank_cur.fetchall():
         confidence = Decimal(dominant_count) / Decimal(total_count)
 
         cat_uuid = cat_path_to_uuid.get(dominant_cat)
         if not cat_uuid:
             continue
+        merchants.append((merchant, dominant_cat, float(confidence)))
 
-        # Create canonical merchant
-        pg_cur.execute("""
+    canonical_inserted = 0
+    mapping_inserted = 0
+
+    if merchants:
+        # Create canonical merchants (one row per merchant, so each name
+        # appears once per statement)
+        returned = psycopg2.extras.execute_values(pg_cur, """
             INSERT INTO canonical_merchant (name, category_hint)
-            VALUES (%s, %s)
+            VALUES %s
             ON CONFLICT (name) DO UPDATE SET category_hint = EXCLUDED.category_hint
-            RETURNING id
-        """, (merchant, dominant_cat))
-        cm_id = pg_cur.fetchone()[0]
-        canonical_inserted += 1
+            RETURNING id, name
+        """, [(merchant, cat) for merchant, cat, _ in merchants], page_size=1000, fetch=True)
+        name_to_id = {name: cm_id for cm_id, name in returned}
+        canonical_inserted = len(returned)
 
-        # Create raw mapping (merchant string → canonical merchant)
-        pg_cur.execute("""
+        # Create raw mappings (merchant string → canonical merchant)
+        psycopg2.extras.execute_values(pg_cur, """
             INSERT INTO merchant_raw_mapping
                 (cleaned_merchant, canonical_merchant_id, match_type, confidence, mapped_by)
-            VALUES (%s, %s, %s, %s, %s)
+            VALUES %s
             ON CONFLICT (cleaned_merchant) DO UPDATE SET
                 canonical_merchant_id = EXCLUDED.canonical_merchant_id,
                 confidence = EXCLUDED.confidence
-        """, (merchant, cm_id, "ibank_history", float(confidence), "ibank_migration"))
-        mapping_inserted += 1
+        """, [(merchant, name_to_id[merchant], conf) for merchant, _, conf in merchants],
+            template="(%s, %s, 'ibank_history', %s, 'ibank_migration')", page_size=1000)
+        mapping_inserted = len(merchants)
 
     pg_conn.commit()
     print(f"  Canonical merchants: {canonical_inserted} loaded")
@@ -192,67 +209,65 @@ def load_accounts(ibank_cur, pg_conn):
         ORDER BY a.ZPACCOUNTCLASS, a.ZPNAME
     """)
 
-    inserted = 0
-    for pk, acc_class, name, full_name, hidden, currency in ibank_cur.fetchall():
-        account_type = ACCOUNT_CLASS_MAP.get(acc_class, "other")
-        is_active = not bool(hidden)
-
-        # Derive institution from name
-        institution = _guess_institution(name)
+    rows = [
+        (
+            # Derive institution from name
+            _guess_institution(name),
+            name,
+            currency or "GBP",
+            ACCOUNT_CLASS_MAP.get(acc_class, "other"),
+            not bool(hidden),
+        )
+        for pk, acc_class, name, full_name, hidden, currency in ibank_cur.fetchall()
+    ]
 
-        pg_cur.execute("""
+    inserted = 0
+    if rows:
+        returned = psycopg2.extras.execute_values(pg_cur, """
             INSERT INTO account (institution, name, currency, account_type, is_active)
-            VALUES (%s, %s, %s, %s, %s)
+            VALUES %s
             ON CONFLICT DO NOTHING
             RETURNING id
-        """, (institution, name, currency or "GBP", account_type, is_active))
-
-        if pg_cur.fetchone():
-            inserted += 1
+        """, rows, page_size=1000, fetch=True)
+        inserted = len(returned)
 
     pg_conn.commit()
     print(f"  Accounts: {inserted} loaded")
 
 
+# (substrings, whole words, institution) for _guess_institution, checked
+# in order against the lower-cased account name; first hit wins
+_INSTITUTION_RULES = (
+    (("monzo",), (), "monzo"),
+    (("wise",), (), "wise"),
+    (("fidelity",), (), "fidelity"),
+    (("aegon",), (), "aegon"),
+    (("marcus", "goldman"), (), "goldman_sachs"),
+    (("national savings",), (), "ns_and_i"),
+    (("computershare",), (), "computershare"),
+    (("standard life",), (), "standard_life"),
+    (("scottish widows",), ("trp",), "scottish_widows"),
+    (("swiss bank",), (), "swiss_bank"),
+    (("citi",), (), "citi"),
+    (("octopus",), (), "octopus"),
+    (("puma",), (), "puma_vct"),
+    (("credit card",), (), "unknown"),
+    (("sole account", "regular saver", "cash isa", "bonus savings", "e-savings"), (),
+     "first_direct"),
+    (("mortgage",), (), "first_direct"),
+    (("cash (",), (), "cash"),
+    (("fund & share",), (), "hl"),
+)
+
+
+@lru_cache(maxsize=4096)
 def _guess_institution(name: str) -> str:
     """Best-effort institution from account name."""
     lower = name.lower()
-    if "monzo" in lower:
-        return "monzo"
-    if "wise" in lower:
-        return "wise"
-    if "fidelity" in lower:
-        return "fidelity"
-    if "aegon" in lower:
-        return "aegon"
-    if "marcus" in lower or "goldman" in lower:
-        return "goldman_sachs"
-    if "national savings" in lower:
-        return "ns_and_i"
-    if "computershare" in lower:
-        return "computershare"
-    if "standard life" in lower:
-        return "standard_life"
-    if "scottish widows" in lower or "trp" in lower.split():
-        return "scottish_widows"
-    if "swiss bank" in lower:
-        return "swiss_bank"
-    if "citi" in lower:
-        return "citi"
-    if "octopus" in lower:
-        return "octopus"
-    if "puma" in lower:
-        return "puma_vct"
-    if "credit card" in lower:
-        return "unknown"
-    if "sole account" in lower or "regular saver" in lower or "cash isa" in lower or "bonus savings" in lower or "e-savings" in lower:
-        return "first_direct"
-    if "mortgage" in lower:
-        return "first_direct"
-    if "cash (" in lower:
-        return "cash"
-    if "fund & share" in lower:
-        return "hl"
+    words = lower.split()
+    for substrings, whole_words, institution in _INSTITUTION_RULES:
+        if any(s in lower for s in substrings) or any(w in words for w in whole_words):
+            return institution
     return "unknown"
 
 
@@ -535,49 +535,32 @@ def run_apply_split_rules(conn) -> dict:
     """
     cur = conn.cursor()
 
-    # Load rules ordered by priority
+    cur.execute("SELECT count(*) FROM merchant_split_rule")
+    rules_applied = cur.fetchone()[0]
+
+    # All rules in one set-based pass; DISTINCT ON keeps the first rule
+    # (by priority) that matches each transaction.
     cur.execute("""
-        SELECT id, merchant_pattern, amount_exact, amount_min, amount_max, target_merchant_id
-        FROM merchant_split_rule
-        ORDER BY priority, id
+        INSERT INTO transaction_merchant_override
+            (raw_transaction_id, canonical_merchant_id, split_rule_id)
+        SELECT DISTINCT ON (rt.id) rt.id, r.target_merchant_id, r.id
+        FROM merchant_split_rule r
+        JOIN cleaned_transaction ct ON ct.cleaned_merchant LIKE r.merchant_pattern
+        JOIN active_transaction rt ON rt.id = ct.raw_transaction_id
+        WHERE (r.amount_exact IS NULL OR rt.amount = r.amount_exact)
+          AND (r.amount_min IS NULL OR rt.amount >= r.amount_min)
+          AND (r.amount_max IS NULL OR rt.amount <= r.amount_max)
+          AND NOT EXISTS (
+              SELECT 1 FROM transaction_merchant_override tmo
+              WHERE tmo.raw_transaction_id = rt.id
+          )
+        ORDER BY rt.id, r.priority, r.id
+        ON CONFLICT (raw_transaction_id) DO NOTHING
     """)
-    rules = cur.fetchall()
-
-    total_created = 0
-    for rule_id, pattern, amt_exact, amt_min, amt_max, target_id in rules:
-        amount_conditions = []
-        params: dict = {"pattern": pattern, "target_id": str(target_id), "rule_id": rule_id}
-
-        if amt_exact is not None:
-            amount_conditions.append("rt.amount = %(amt_exact)s")
-            params["amt_exact"] = amt_exact
-        if amt_min is not None:
-            amount_conditions.append("rt.amount >= %(amt_min)s")
-            params["amt_min"] = amt_min
-        if amt_max is not None:
-            amount_conditions.append("rt.amount <= %(amt_max)s")
-            params["amt_max"] = amt_max
-
-        amount_where = (" AND " + " AND ".join(amount_conditions)) if amount_conditions else ""
-
-        cur.execute(f"""
-            INSERT INTO transaction_merchant_override
-                (raw_transaction_id, canonical_merchant_id, split_rule_id)
-            SELECT rt.id, %(target_id)s::uuid, %(rule_id)s
-            FROM cleaned_transaction ct
-            JOIN active_transaction rt ON rt.id = ct.raw_transaction_id
-            WHERE ct.cleaned_merchant LIKE %(pattern)s
-              {amount_where}
-              AND NOT EXISTS (
-                  SELECT 1 FROM transaction_merchant_override tmo
-                  WHERE tmo.raw_transaction_id = rt.id
-              )
-            ON CONFLICT (raw_transaction_id) DO NOTHING
-        """, params)
-        total_created += cur.rowcount
+    total_created = cur.rowcount
 
     conn.commit()
-    return {"rules_applied": len(rules), "overrides_created": total_created}
+    return {"rules_applied": rules_applied, "overrides_created": total_created}
 
 
 @router.post("/merchants/split-rules/apply")
@@ -10,7 +10,7 @@ _scripts_dir = str(Path(__file__).resolve().parent.parent.parent / "scripts")
 if _scripts_dir not in sys.path:
     sys.path.insert(0, _scripts_dir)
 
-from fd_bankivity_load import extract_transactions, write_transactions
+from fd_bankivity_load import iter_transactions, tally_accounts, write_transactions
 
 
 def _resolve_db_path(bank8_path: str) -> Path:
@@ -29,9 +29,10 @@ def _resolve_db_path(bank8_path: str) -> Path:
 
 def _preview(db_path: str, conn) -> dict:
     """Extract transactions from SQLite and compare against DB."""
-    txns = extract_transactions(db_path)
+    # Rows are raw_transaction tuples: [2] account_ref, [3] transaction_ref
+    txns = list(iter_transactions(db_path))
 
-    refs = [t["transaction_ref"] for t in txns]
+    refs = [t[3] for t in txns]
     if refs:
         cur = conn.cursor()
         cur.execute("""
@@ -45,11 +46,11 @@ def _preview(db_path: str, conn) -> dict:
     else:
         existing_refs = set()
 
-    new_txns = [t for t in txns if t["transaction_ref"] not in existing_refs]
+    new_txns = [t for t in txns if t[3] not in existing_refs]
 
     by_account: dict[str, int] = {}
     for t in new_txns:
-        by_account[t["account_ref"]] = by_account.get(t["account_ref"], 0) + 1
+        by_account[t[2]] = by_account.get(t[2], 0) + 1
 
     return {
         "total": len(txns),
@@ -60,6 +61,15 @@ def _preview(db_path: str, conn) -> dict:
     }
 
 
+def _execute(db_path: str, conn) -> dict:
+    """Stream transactions from SQLite into raw_transaction and commit."""
+    stats: dict[str, list] = {}
+    inserted = write_transactions(tally_accounts(iter_transactions(db_path), stats), conn)
+    conn.commit()
+    total = sum(count for count, _, _ in stats.values())
+    return {"inserted": inserted, "skipped": total - inserted}
+
+
 def preview_bankivity(bank8_path: str, conn) -> dict:
     """Validate .bank8 directory path, extract and preview transactions."""
     db_path = _resolve_db_path(bank8_path)
@@ -76,13 +86,11 @@ def preview_bankivity_file(sql_path: str, conn) -> dict:
 def execute_bankivity(bank8_path: str, conn) -> dict:
     """Extract and write transactions from .bank8 directory."""
     db_path = _resolve_db_path(bank8_path)
-    txns = extract_transactions(str(db_path))
-    return write_transactions(txns, conn)
+    return _execute(str(db_path), conn)
 
 
 def execute_bankivity_file(sql_path: str, conn) -> dict:
     """Extract and write transactions from an uploaded core.sql file."""
     if not Path(sql_path).exists():
         raise ValueError(f"File does not exist: {sql_path}")
-    txns = extract_transactions(sql_path)
-    return write_transactions(txns, conn)
+    return _execute(sql_path, conn)
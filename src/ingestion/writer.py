@@ -1,49 +1,40 @@
 """Idempotent writer for raw_transaction table."""
 
-import json
+import csv
+import io
 from datetime import date
 from decimal import Decimal
 
 import psycopg2
-import psycopg2.extras
+from psycopg2.extras import Json, execute_values
 
 from config.settings import settings
 
 
-def write_monzo_transactions(transactions: list[dict], account_ref: str) -> dict:
+def write_monzo_transactions(transactions: list[dict], account_ref: str, conn=None) -> dict:
     """
     Write Monzo transactions to raw_transaction. Idempotent via ON CONFLICT.
 
+    Uses `conn` if given (left open for the caller), otherwise opens its own.
     Returns {"inserted": n, "skipped": n}.
     """
     if not transactions:
         return {"inserted": 0, "skipped": 0}
 
-    conn = psycopg2.connect(settings.dsn)
+    own_conn = conn is None
+    if own_conn:
+        conn = psycopg2.connect(settings.dsn)
     try:
         cur = conn.cursor()
-        inserted = 0
 
+        rows = []
         for txn in transactions:
             amount = Decimal(txn["amount"]) / 100  # pence → pounds
             posted_at = txn.get("settled") or txn.get("created")
             if posted_at:
                 posted_at = posted_at[:10]  # just the date portion
 
-            cur.execute("""
-                INSERT INTO raw_transaction (
-                    source, institution, account_ref, transaction_ref,
-                    posted_at, amount, currency,
-                    raw_merchant, raw_memo, is_dirty, raw_data
-                ) VALUES (
-                    'monzo_api', 'monzo', %s, %s,
-                    %s, %s, %s,
-                    %s, %s, false, %s
-                )
-                ON CONFLICT (institution, account_ref, transaction_ref)
-                    WHERE transaction_ref IS NOT NULL
-                DO NOTHING
-            """, (
+            rows.append((
                 account_ref,
                 txn["id"],
                 posted_at,
@@ -51,13 +42,76 @@ def write_monzo_transactions(transactions: list[dict], account_ref: str) -> dict
                 txn.get("currency", "GBP"),
                 txn.get("description"),
                 txn.get("notes") or None,
-                json.dumps(txn),
+                Json(txn),
             ))
-            if cur.rowcount > 0:
-                inserted += 1
+
+        result = execute_values(cur, """
+            INSERT INTO raw_transaction (
+                source, institution, account_ref, transaction_ref,
+                posted_at, amount, currency,
+                raw_merchant, raw_memo, is_dirty, raw_data
+            ) VALUES %s
+            ON CONFLICT (institution, account_ref, transaction_ref)
+                WHERE transaction_ref IS NOT NULL
+            DO NOTHING
+            RETURNING id
+        """, rows,
+            template="('monzo_api', 'monzo', %s, %s, %s, %s, %s, %s, %s, false, %s)",
+            page_size=1000, fetch=True)
+        inserted = len(result)
 
         conn.commit()
         skipped = len(transactions) - inserted
         return {"inserted": inserted, "skipped": skipped}
     finally:
-        conn.close()
+        if own_conn:
+            conn.close()
+
+
+RAW_TRANSACTION_COLUMNS = (
+    "source, institution, account_ref, transaction_ref, "
+    "posted_at, amount, currency, "
+    "raw_merchant, raw_memo, is_dirty, raw_data"
+)
+
+
+def copy_raw_transactions(cur, rows) -> list:
+    """Bulk-insert raw_transaction rows via COPY into a temp staging table.
+
+    `rows` is an iterable of tuples in RAW_TRANSACTION_COLUMNS order, with
+    raw_data as a psycopg2 Json wrapper (or a JSON string). Rows whose
+    (institution, account_ref, transaction_ref) already exist are skipped.
+    Intended for cold loads of large histories. Does not commit.
+
+    Returns the (account_ref,) of each row inserted, like execute_values
+    with fetch=True.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([
+            r"\N" if v is None else v.dumps(v.adapted) if isinstance(v, Json) else v
+            for v in row
+        ])
+    buf.seek(0)
+
+    cur.execute("""
+        CREATE TEMP TABLE stg_raw_transaction
+            (LIKE raw_transaction INCLUDING DEFAULTS)
+    """)
+    cur.copy_expert(
+        f"COPY stg_raw_transaction ({RAW_TRANSACTION_COLUMNS}) "
+        r"FROM STDIN WITH (FORMAT csv, NULL '\N')",
+        buf,
+    )
+    cur.execute(f"""
+        INSERT INTO raw_transaction ({RAW_TRANSACTION_COLUMNS})
+        SELECT {RAW_TRANSACTION_COLUMNS} FROM stg_raw_transaction
+        ON CONFLICT (institution, account_ref, transaction_ref)
+            WHERE transaction_ref IS NOT NULL
+        DO NOTHING
+        RETURNING account_ref
+    """)
+    inserted = cur.fetchall()
+    cur.execute("DROP TABLE stg_raw_transaction")
+    return inserted